@@ -0,0 +1,569 @@
+#!/usr/bin/env python3
+"""
+Performance benchmarks for the Stroke Detection System backend
+Run from the backend directory:
+    python benchmarks.py [--rows N] [--uploads N] [--db-seconds S] [--json results.json]
+
+The full upload benchmark runs the FastAPI app in-process against a temporary
+SQLite database, so the working stroke.db and uploads folder are never touched.
+"""
+
+import argparse
+import io
+import json
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime
+from types import SimpleNamespace
+
+# Add the backend directory to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from tpa_eligibility import get_tpa_rule_set
+from eligibility_service import build_eligibility_data, apply_eligibility
+from prompt_builder import generation_messages, refine_messages, count_message_tokens, prompt_stats
+from rules_plan import generate_rules_plan
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Bumped whenever a key of the --json output is renamed, removed or changes meaning;
+# the layout is documented under "Benchmarks" in the top-level README
+BENCHMARK_SCHEMA_VERSION = 1
+
+
+def legacy_check_tpa_eligibility(data: dict):
+    """The hand-written chain used before the rule table, kept as the baseline."""
+    # Initial assessment
+    if data["hours_since_onset"] > 4.5:
+        return False, "Initial Assessment: Patient presented beyond 4.5-hour treatment window"
+    if data["imaging_confirmed"] != "yes":
+        return False, "Initial Assessment: Ischemic stroke not confirmed by neuroimaging (CT/MRI)"
+    if data["consent"] != "yes":
+        return False, "Initial Assessment: Informed consent not obtained from patient or representative"
+
+    # Inclusion criteria
+    if data["age"] < 18:
+        return False, "Exclusion: Patient is under 18 years old"
+    if data["nhiss_score"] < 4:
+        return False, "Exclusion: NIHSS score below minimum threshold for thrombolytic therapy"
+    if data["inr"] > 1.7:
+        return False, "Exclusion: INR exceeds safe threshold for thrombolysis (INR > 1.7)"
+
+    if not (60 <= data["heart_rate"] <= 100):
+        return False, "Exclusion: Abnormal heart rate outside 60–100 bpm"
+    if not (12 <= data["respiratory_rate"] <= 20):
+        return False, "Exclusion: Abnormal respiratory rate outside 12–20 breaths/min"
+    if not (97 <= data["temperature"] <= 100.4):
+        return False, "Exclusion: Abnormal body temperature outside acceptable range (97–100.4 °F)"
+    if not (95 <= data["oxygen_saturation"] <= 100):
+        return False, "Exclusion: Oxygen saturation below 95%"
+
+    # Exclusion criteria
+    if data["recent_trauma"] == "yes":
+        return False, "Exclusion: Recent head or spinal trauma within 3 months"
+    if data["recent_stroke_or_injury"] == "yes":
+        return False, "Exclusion: History of stroke or serious head injury within 3 months"
+    if data["intracranial_issue"] == "yes":
+        return False, "Exclusion: Presence of intracranial hemorrhage, tumor, or vascular malformation"
+    if data["recent_mi"] == "yes":
+        return False, "Exclusion: Recent myocardial infarction (heart attack)"
+    if data["systolic_bp"] > 185 or data["diastolic_bp"] > 110:
+        return False, "Exclusion: Blood pressure exceeds safe threshold for tPA (SBP > 185 or DBP > 110 mmHg)"
+    if data["glucose"] < 50 or data["glucose"] > 400:
+        return False, "Exclusion: Blood glucose outside acceptable range (<50 or >400 mg/dL)"
+    if data["anticoagulant_risk"] == "yes":
+        return False, "Exclusion: Use of anticoagulants with elevated INR ≥ 3"
+    if data["platelet_count"] < 100:
+        return False, "Exclusion: Platelet count below safe minimum (<100,000/μL)"
+    if data["recent_surgery"] == "yes":
+        return False, "Exclusion: Recent surgery or biopsy of parenchymal organ"
+
+    return True, "Meets all criteria for intravenous thrombolysis (tPA administration)"
+
+
+def random_eligibility_rows(count: int, seed: int = 42):
+    """Eligibility inputs spread around every threshold so all branches are exercised."""
+    rng = random.Random(seed)
+
+    def yes_no(p_yes):
+        return "yes" if rng.random() < p_yes else "no"
+
+    return [
+        {
+            "age": rng.randint(10, 95),
+            "hours_since_onset": rng.choice([0.5, 2.0, 4.5, 4.6, 6.0]),
+            "imaging_confirmed": yes_no(0.97),
+            "consent": yes_no(0.97),
+            "nhiss_score": rng.randint(0, 30),
+            "inr": rng.choice([0.9, 1.2, 1.7, 1.8, 3.0]),
+            "heart_rate": rng.randint(50, 110),
+            "respiratory_rate": rng.randint(10, 22),
+            "temperature": rng.choice([96.9, 97.0, 98.6, 100.4, 100.5]),
+            "oxygen_saturation": rng.randint(92, 100),
+            "recent_trauma": yes_no(0.03),
+            "recent_stroke_or_injury": yes_no(0.03),
+            "intracranial_issue": yes_no(0.03),
+            "recent_mi": yes_no(0.03),
+            "systolic_bp": rng.randint(100, 210),
+            "diastolic_bp": rng.randint(60, 125),
+            "glucose": rng.choice([45, 50, 110, 250, 400, 410]),
+            "anticoagulant_risk": yes_no(0.03),
+            "platelet_count": rng.choice([90, 100, 150, 250]),
+            "recent_surgery": yes_no(0.03),
+        }
+        for _ in range(count)
+    ]
+
+
+def legacy_generation_messages(patient_data: dict, scan_data: dict, eligibility_result: str, is_eligible: bool):
+    """The indented f-string prompts used before prompt_builder, kept as the baseline."""
+    intro = f"""
+        Patient Information:
+        - Age: {patient_data.get('age', 'N/A')} years
+        - Gender: {patient_data.get('gender', 'N/A')}
+        - Chief Complaint: {patient_data.get('chief_complaint', 'N/A')}
+        - Time since onset: {patient_data.get('time_since_onset', 'N/A')}
+        
+        Vital Signs:
+        - Blood Pressure: {patient_data.get('systolic_bp', 'N/A')}/{patient_data.get('diastolic_bp', 'N/A')} mmHg
+        - Heart Rate: {patient_data.get('heart_rate', 'N/A')} bpm
+        - Temperature: {patient_data.get('temperature', 'N/A')}°F
+        - Oxygen Saturation: {patient_data.get('oxygen_saturation', 'N/A')}%
+        - Glucose: {patient_data.get('glucose', 'N/A')} mg/dL
+        - INR: {patient_data.get('inr', 'N/A')}
+        
+        Scan Results:
+        - Imaging Confirmed: {scan_data.get('imaging_confirmed', 'N/A')}
+        - Diagnosis: {scan_data.get('prediction', 'N/A')}
+        - Eligibility Assessment: {eligibility_result}
+        """
+    if is_eligible:
+        task = """
+        Please provide a comprehensive treatment plan for this tPA-eligible stroke patient. Include:
+        1. Immediate interventions (first 24 hours)
+        2. tPA administration protocol and monitoring
+        3. Post-tPA care and monitoring
+        4. Secondary prevention measures
+        5. Rehabilitation planning
+        6. Follow-up schedule
+        7. Potential complications to watch for
+        
+        Format the response in clear sections with specific medical recommendations.
+        """
+    else:
+        task = """
+        This patient is NOT eligible for tPA therapy. Please provide a comprehensive alternative treatment plan including:
+        1. Immediate supportive care (first 24 hours)
+        2. Medical management strategies
+        3. Secondary prevention measures
+        4. Rehabilitation planning
+        5. Follow-up schedule
+        6. Alternative interventions if applicable
+        7. Monitoring parameters
+        
+        Format the response in clear sections with specific medical recommendations.
+        """
+    return [
+        {"role": "system", "content": "You are a stroke neurologist. Provide concise medical recommendations only."},
+        {"role": "user", "content": intro + "\n" + task},
+    ]
+
+
+def legacy_refine_messages(existing_plan: str, physician_notes: str):
+    prompt = f"""
+            Below is an existing treatment plan for a stroke patient:
+            
+            {existing_plan}
+            
+            The physician has provided the following additional notes and modifications:
+            
+            {physician_notes}
+            
+            Please refine and update the treatment plan incorporating the physician's notes while maintaining medical accuracy and evidence-based recommendations. 
+            Highlight any changes made and provide the updated comprehensive treatment plan.
+            """
+    return [
+        {"role": "system", "content": "You are an expert neurologist. Refine treatment plans based on physician input while maintaining medical accuracy."},
+        {"role": "user", "content": prompt},
+    ]
+
+
+def time_call(fn, repeat: int = 5) -> dict:
+    """Run fn repeat times and return timing statistics in milliseconds."""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return {
+        "min_ms": round(min(samples), 3),
+        "median_ms": round(statistics.median(samples), 3),
+        "max_ms": round(max(samples), 3),
+    }
+
+
+def call_each(fn, rows):
+    """Call fn on every row without keeping the results alive (avoids GC noise)."""
+    for row in rows:
+        fn(row)
+
+
+def bench_eligibility(rows: int) -> dict:
+    """Compiled rule table vs. the legacy hand-written chain, plus the batch path."""
+    data = random_eligibility_rows(rows)
+    rule_set = get_tpa_rule_set()
+
+    mismatches = sum(1 for row in data if rule_set.check(row) != legacy_check_tpa_eligibility(row))
+    if mismatches:
+        raise SystemExit(f"Compiled rule set disagrees with the legacy chain on {mismatches} rows")
+
+    check, evaluate = rule_set.check, rule_set.evaluate
+    columns = rule_set.build_columns(data)
+    return {
+        "rows": rows,
+        "rule_set_version": rule_set.version,
+        "legacy_chain": time_call(lambda: call_each(legacy_check_tpa_eligibility, data)),
+        "compiled_rule_set": time_call(lambda: call_each(check, data)),
+        "all_failures": time_call(lambda: call_each(evaluate, data)),
+        "batch_columnar": time_call(lambda: rule_set.check_batch(columns)),
+    }
+
+
+def random_patient_records(count: int, seed: int = 42):
+    """Patient / NIHSS stand-ins as loaded by /api/upload-scan, some vitals missing."""
+    rng = random.Random(seed)
+
+    def maybe(value):
+        return None if rng.random() < 0.2 else value
+
+    records = []
+    for _ in range(count):
+        patient = SimpleNamespace(
+            age=rng.randint(18, 95),
+            inr=maybe(rng.choice([0.9, 1.2, 1.8])),
+            heart_rate=maybe(rng.randint(50, 110)),
+            temperature=maybe(rng.choice([97.0, 98.6, 100.5])),
+            oxygen_saturation=maybe(rng.randint(92, 100)),
+            systolic_bp=maybe(rng.randint(100, 210)),
+            diastolic_bp=maybe(rng.randint(60, 125)),
+            glucose=maybe(rng.choice([45, 110, 250, 410])),
+            platelet_count=maybe(rng.choice([90, 150, 250])),
+        )
+        nihss = SimpleNamespace(total_score=rng.randint(0, 30))
+        records.append((patient, nihss))
+    return records
+
+
+def bench_upload_assembly(rows: int) -> dict:
+    """Steps 4-5 of /api/upload-scan: build the eligibility inputs and store the result on a scan."""
+    records = random_patient_records(rows)
+    scans = [SimpleNamespace() for _ in range(rows)]
+
+    def assemble():
+        for patient, nihss in records:
+            build_eligibility_data(patient, nihss)
+
+    def assemble_and_apply():
+        for scan, (patient, nihss) in zip(scans, records):
+            apply_eligibility(scan, build_eligibility_data(patient, nihss))
+
+    return {
+        "rows": rows,
+        "build_eligibility_data": time_call(assemble),
+        "build_and_apply_eligibility": time_call(assemble_and_apply),
+    }
+
+
+def random_plan_inputs(count: int, seed: int = 42):
+    """(patient_data, scan_data) as built by plan_inputs_for_scan, some vitals missing."""
+    rng = random.Random(seed)
+    rule_set = get_tpa_rule_set()
+    inputs = []
+    for row, (patient, nihss) in zip(random_eligibility_rows(count, seed), random_patient_records(count, seed)):
+        eligible, reason = rule_set.check(row)
+        patient_data = {
+            "name": "Benchmark Patient",
+            "age": patient.age,
+            "gender": rng.choice(["Male", "Female"]),
+            "chief_complaint": rng.choice(["Aphasia", "Left-sided weakness", "Facial droop", None]),
+            "time_since_onset": rng.choice(["1 hour", "3 hours", None]),
+            **{key: getattr(patient, key) for key in ("systolic_bp", "diastolic_bp", "heart_rate",
+                                                      "oxygen_saturation", "temperature", "glucose", "inr")},
+        }
+        scan_data = {"imaging_confirmed": True, "prediction": reason, "eligibility_result": reason, "eligible": eligible}
+        inputs.append((patient_data, scan_data, nihss.total_score))
+    return inputs
+
+
+def bench_prompts(cases: int = 500) -> dict:
+    """Prompt tokens of prompt_builder vs. the legacy templates, for generation and a second refinement."""
+    inputs = random_plan_inputs(cases)
+    legacy_generation = [count_message_tokens(legacy_generation_messages(p, s, s["eligibility_result"], s["eligible"]))
+                         for p, s, _ in inputs]
+    generation = [count_message_tokens(generation_messages(p, s, s["eligibility_result"], s["eligible"]))
+                  for p, s, _ in inputs]
+
+    # A plan already refined once carries the change log of that refinement
+    notes = "Patient has type 2 diabetes on metformin; tighten glucose monitoring and add a statin."
+    plans = [generate_rules_plan(p, s, nihss) + "\n\nChanges made:\n- Added glucose checks every 4 hours.\n"
+             "- Started atorvastatin 80 mg.\n- Moved the swallow screen before oral medication."
+             for p, s, nihss in inputs]
+    legacy_refine = [count_message_tokens(legacy_refine_messages(plan, notes)) for plan in plans]
+    refine = [count_message_tokens(refine_messages(plan, notes)) for plan in plans]
+
+    def reduction(before, after):
+        return round(100 * (1 - sum(after) / sum(before)), 1)
+
+    return {
+        "cases": cases,
+        "tokenizer": prompt_stats()["tokenizer"],
+        "generation_tokens_legacy": round(statistics.mean(legacy_generation), 1),
+        "generation_tokens": round(statistics.mean(generation), 1),
+        "generation_reduction_pct": reduction(legacy_generation, generation),
+        "refine_tokens_legacy": round(statistics.mean(legacy_refine), 1),
+        "refine_tokens": round(statistics.mean(refine), 1),
+        "refine_reduction_pct": reduction(legacy_refine, refine),
+        "build_generation_prompts": time_call(lambda: [
+            generation_messages(p, s, s["eligibility_result"], s["eligible"]) for p, s, _ in inputs
+        ]),
+    }
+
+
+def run_mixed_workload(url: str, profile: str, seconds: float, readers: int, writers: int) -> dict:
+    """Dashboard-style readers and upload-style writers on one SQLite file for a fixed time."""
+    from sqlalchemy import func
+    from sqlalchemy.exc import OperationalError
+    from sqlalchemy.orm import sessionmaker
+    from database import Base, create_database_engine, sqlite_settings
+    from models import Patient, StrokeScan
+
+    bench_engine = create_database_engine(url, sqlite_profile=profile, pragma_overrides={})
+    Base.metadata.create_all(bind=bench_engine)
+    Session = sessionmaker(bind=bench_engine, autoflush=False, autocommit=False)
+
+    db = Session()
+    patients = [Patient(name=f"Bench {i}", age=60, code=f"BENCH{i:04d}") for i in range(200)]
+    db.add_all(patients)
+    db.flush()
+    now = datetime.now()
+    db.add_all([StrokeScan(patient_id=patients[i % 200].id, prediction="Ischemic stroke", timestamp=now,
+                           eligible=i % 3 != 0, status="pending") for i in range(5000)])
+    db.commit()
+    patient_ids = [patient.id for patient in patients]
+    db.close()
+
+    counts = {"reads": 0, "writes": 0, "locked_errors": 0}
+    write_latencies = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def read_loop(seed):
+        rng = random.Random(seed)
+        while time.perf_counter() < deadline:
+            session = Session()
+            try:
+                session.query(StrokeScan.status, func.count()).group_by(StrokeScan.status).all()
+                session.query(StrokeScan).filter(StrokeScan.patient_id == rng.choice(patient_ids)).order_by(
+                    StrokeScan.timestamp.desc()).limit(20).all()
+                outcome = "reads"
+            except OperationalError:
+                outcome = "locked_errors"
+            finally:
+                session.close()
+            with lock:
+                counts[outcome] += 1
+
+    def write_loop(seed):
+        rng = random.Random(seed)
+        while time.perf_counter() < deadline:
+            session = Session()
+            start = time.perf_counter()
+            try:
+                # Upload a scan, then send it to the physician: two commits, as in the app
+                scan = StrokeScan(patient_id=rng.choice(patient_ids), prediction="Ischemic stroke",
+                                  timestamp=datetime.now(), eligible=True, status="pending")
+                session.add(scan)
+                session.commit()
+                scan.status = "ready_for_review"
+                session.commit()
+                outcome = "writes"
+            except OperationalError:
+                session.rollback()
+                outcome = "locked_errors"
+            finally:
+                session.close()
+            with lock:
+                counts[outcome] += 1
+                if outcome == "writes":
+                    write_latencies.append((time.perf_counter() - start) * 1000)
+
+    threads = [threading.Thread(target=read_loop, args=(i,)) for i in range(readers)]
+    threads += [threading.Thread(target=write_loop, args=(readers + i,)) for i in range(writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    settings = sqlite_settings(bench_engine)
+    bench_engine.dispose()
+    write_latencies.sort()
+    return {
+        "journal_mode": settings["journal_mode"],
+        "reads_per_s": round(counts["reads"] / seconds, 1),
+        "writes_per_s": round(counts["writes"] / seconds, 1),
+        "locked_errors": counts["locked_errors"],
+        "write_p95_ms": round(write_latencies[int(0.95 * (len(write_latencies) - 1))], 2) if write_latencies else None,
+    }
+
+
+def bench_sqlite_concurrency(seconds: float, readers: int = 6, writers: int = 3) -> dict:
+    """The same mixed read/write workload on SQLite's default settings and on the production profile."""
+    workspace = tempfile.mkdtemp(prefix="stroke-bench-")
+    try:
+        results = {"seconds": seconds, "reader_threads": readers, "writer_threads": writers}
+        for profile in ("default", "production"):
+            url = f"sqlite:///{os.path.join(workspace, profile + '.db')}"
+            for key, value in run_mixed_workload(url, profile, seconds, readers, writers).items():
+                results[f"{profile}_{key}"] = value
+        return results
+    finally:
+        shutil.rmtree(workspace, ignore_errors=True)
+
+
+def bench_upload_request(requests: int) -> dict:
+    """Full POST /api/upload-scan through TestClient against a temporary SQLite file."""
+    workspace = tempfile.mkdtemp(prefix="stroke-bench-")
+    work_dir = os.path.join(workspace, "backend")
+    os.makedirs(work_dir)
+    os.makedirs(os.path.join(workspace, "uploads"))
+    shutil.copytree(os.path.join(BACKEND_DIR, "..", "frontend"), os.path.join(workspace, "frontend"))
+
+    previous_dir = os.getcwd()
+    os.chdir(work_dir)  # uploads are written relative to the working directory
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+    from database import SessionLocal, create_database_engine
+    # The app's engine resolved stroke.db when database.py was imported; point every session at the workspace
+    bench_engine = create_database_engine(f"sqlite:///{os.path.join(work_dir, 'stroke.db')}")
+    app_engine = SessionLocal.kw["bind"]
+    SessionLocal.configure(bind=bench_engine)
+    try:
+        from fastapi.testclient import TestClient
+        import main
+
+        main.sync_model_schema(bench_engine)  # the startup handler's job; TestClient without a context skips it
+        client = TestClient(main.app)
+        code = "BENCH001"
+        client.post("/api/patients", json={
+            "name": "Benchmark Patient", "age": 64, "gender": "Female",
+            "time_since_onset": "1 hour", "consent_confirmed": True, "code": code,
+        }).raise_for_status()
+        client.put(f"/api/patients/{code}/vitals", json={
+            "chief_complaint": "Left-sided weakness", "systolic_bp": 160, "diastolic_bp": 90,
+            "heart_rate": 82, "oxygen_saturation": 97, "temperature": 98.4, "glucose": 140,
+            "platelet_count": 240, "inr": 1.1,
+        }).raise_for_status()
+        client.post(f"/api/patients/{code}/nihss", json={
+            "consciousness": 1, "gaze": 1, "visual": 1, "facial": 1, "motorArmLeft": 2,
+            "motorArmRight": 0, "motorLegLeft": 1, "motorLegRight": 0, "ataxia": 0, "sensory": 1,
+            "language": 1, "dysarthria": 1, "extinction": 0, "total_score": 10,
+        }).raise_for_status()
+
+        scan_bytes = os.urandom(256 * 1024)
+
+        def upload():
+            response = client.post(
+                "/api/upload-scan",
+                data={"patient_code": code},
+                files={"scan_file": ("scan.png", io.BytesIO(scan_bytes), "image/png")},
+            )
+            response.raise_for_status()
+
+        upload()  # warm-up: first request pays for route and query compilation
+        return {
+            "requests": requests,
+            "scan_bytes": len(scan_bytes),
+            "upload_scan": time_call(upload, repeat=requests),
+        }
+    finally:
+        SessionLocal.configure(bind=app_engine)
+        bench_engine.dispose()
+        os.chdir(previous_dir)
+        shutil.rmtree(workspace, ignore_errors=True)
+
+
+def environment_info() -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "schema_version": BENCHMARK_SCHEMA_VERSION,
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "git_commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+    }
+
+
+def print_results(name: str, results: dict):
+    print(f"\n{name}")
+    print("-" * 60)
+    if results is None:
+        print("skipped")
+        return
+    for key, value in results.items():
+        if isinstance(value, dict):
+            print(f"{key:<28} min {value['min_ms']:>9.3f} ms   median {value['median_ms']:>9.3f} ms")
+        else:
+            print(f"{key:<28} {value}")
+
+
+def run_benchmarks(rows: int = 100_000, uploads: int = 200, db_seconds: float = 5) -> dict:
+    """
+    Every benchmark section, keyed as in the --json output.  Sections turned off
+    (uploads or db_seconds of 0) are present as None, so the keys never change.
+    """
+    return {
+        "environment": environment_info(),
+        "tpa_eligibility": bench_eligibility(rows),
+        "upload_assembly": bench_upload_assembly(rows),
+        "prompt_tokens": bench_prompts(),
+        "sqlite_concurrency": bench_sqlite_concurrency(db_seconds) if db_seconds else None,
+        "upload_request": bench_upload_request(uploads) if uploads else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backend performance benchmarks")
+    parser.add_argument("--rows", type=int, default=100_000, help="eligibility rows per run")
+    parser.add_argument("--uploads", type=int, default=200, help="upload requests timed (0 to skip)")
+    parser.add_argument("--db-seconds", type=float, default=5, help="seconds per SQLite concurrency run (0 to skip)")
+    parser.add_argument("--json", metavar="PATH", help="also write the results to PATH as JSON")
+    args = parser.parse_args()
+
+    print("Stroke Detection System Benchmarks")
+    print("=" * 50)
+    results = run_benchmarks(args.rows, args.uploads, args.db_seconds)
+
+    for name, section in results.items():
+        print_results(name, section)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+Bulk treatment plan generation for the review queue
+
+Drafts a plan for every ready_for_review scan that has none, so physicians
+start a shift with the queue pre-filled.  Generations run concurrently under a
+concurrency cap and a rate limit, and finished plans are committed in batches,
+so a queue of hundreds of cases takes about as long as its slowest few calls.
+Upstream concurrency is also bounded by OPENAI_MAX_CONNECTIONS.
+
+Also available as POST /api/treatment-plan/bulk-generate.
+
+Usage:
+    python bulk_plans.py --concurrency 20 --batch-size 25
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+# Add the backend directory to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import httpx
+from sqlalchemy import exists
+
+from database import SessionLocal
+from models import Patient, StrokeScan, TreatmentPlan, TreatmentPlanJob
+from chatgpt_service import get_chatgpt_service, OpenAIAPIError, GENERATION_SETTINGS
+from llm_metrics import new_usage
+from treatment_plan_service import plan_inputs_for_scan, plan_type_for, hash_plan_inputs, usage_columns
+
+BULK_PLAN_CONCURRENCY = int(os.getenv("BULK_PLAN_CONCURRENCY", "20"))
+# Off by default: concurrency and OPENAI_MAX_CONNECTIONS already bound the upstream load
+BULK_PLAN_RATE_PER_SECOND = float(os.getenv("BULK_PLAN_RATE_PER_SECOND", "0"))  # 0 disables the limit
+BULK_PLAN_BATCH_SIZE = int(os.getenv("BULK_PLAN_BATCH_SIZE", "25"))
+BULK_PLAN_TIMEOUT_SECONDS = float(os.getenv("BULK_PLAN_TIMEOUT_SECONDS", "60"))
+BULK_PLAN_RUN_TTL_SECONDS = float(os.getenv("BULK_PLAN_RUN_TTL_SECONDS", "3600"))  # finished runs kept for polling
+
+
+class RateLimiter:
+    """Spaces call starts at least 1/rate seconds apart."""
+
+    def __init__(self, rate_per_second: float):
+        self.interval = 1.0 / rate_per_second if rate_per_second > 0 else 0.0
+        self._next_slot = 0.0
+
+    async def wait(self):
+        if not self.interval:
+            return
+        now = time.monotonic()
+        slot = max(now, self._next_slot)
+        self._next_slot = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+def load_review_queue(limit: int = None) -> List[Dict[str, Any]]:
+    """
+    Prompt inputs for every ready_for_review scan without a treatment plan or a
+    generation job in flight, oldest first.
+    """
+    db = SessionLocal()
+    try:
+        has_plan = exists().where(TreatmentPlan.scan_id == StrokeScan.id)
+        in_flight = exists().where(
+            TreatmentPlanJob.scan_id == StrokeScan.id,
+            TreatmentPlanJob.status.in_(("queued", "running"))
+        )
+        query = db.query(StrokeScan, Patient).join(Patient, Patient.id == StrokeScan.patient_id).filter(
+            StrokeScan.status == "ready_for_review", ~has_plan, ~in_flight
+        ).order_by(StrokeScan.timestamp)
+        if limit:
+            query = query.limit(limit)
+
+        queue = []
+        for scan, patient in query.all():
+            patient_data, scan_data = plan_inputs_for_scan(patient, scan)
+            queue.append({
+                "patient_id": patient.id,
+                "scan_id": scan.id,
+                "patient_data": patient_data,
+                "scan_data": scan_data,
+            })
+        return queue
+    finally:
+        db.close()
+
+
+def save_plan_batch(batch: List[Dict[str, Any]], created_by: str):
+    """Insert a batch of generated plans in one transaction."""
+    db = SessionLocal()
+    try:
+        now = datetime.now()
+        db.add_all([
+            TreatmentPlan(
+                patient_id=item["patient_id"],
+                scan_id=item["scan_id"],
+                plan_type=plan_type_for(item["scan_data"]["eligible"]),
+                ai_generated_plan=item["plan"],
+                status="draft",
+                created_by=created_by,
+                created_at=now,
+                updated_at=now,
+                source="bulk",
+                inputs_hash=hash_plan_inputs(item["patient_data"], item["scan_data"]),
+                **usage_columns(item.get("usage"))
+            )
+            for item in batch
+        ])
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+class BulkPlanRun:
+    """One pass over the review queue, with progress counters that are safe to read at any time."""
+
+    def __init__(self, concurrency: int = BULK_PLAN_CONCURRENCY, rate_per_second: float = BULK_PLAN_RATE_PER_SECOND,
+                 batch_size: int = BULK_PLAN_BATCH_SIZE, timeout_seconds: float = BULK_PLAN_TIMEOUT_SECONDS,
+                 created_by: str = "bulk-generation", limit: int = None):
+        self.id = uuid.uuid4().hex
+        self.concurrency = max(1, concurrency)
+        self.rate_per_second = rate_per_second
+        self.batch_size = max(1, batch_size)
+        self.timeout_seconds = timeout_seconds
+        self.created_by = created_by
+        self.limit = limit
+
+        self.status = "pending"
+        self.total = 0
+        self.generated = 0
+        self.saved = 0
+        self.failed = 0
+        self.cost_usd = 0.0
+        self.errors: List[str] = []
+        self.started_at: Optional[datetime] = None
+        self.finished_at: Optional[datetime] = None
+        self._started = None
+        self._slowest_call = 0.0
+
+    async def run(self, on_progress: Callable[["BulkPlanRun"], None] = None):
+        self.status = "running"
+        self.started_at = datetime.now()
+        self._started = time.perf_counter()
+        try:
+            queue = await asyncio.to_thread(load_review_queue, self.limit)
+            self.total = len(queue)
+
+            semaphore = asyncio.Semaphore(self.concurrency)
+            limiter = RateLimiter(self.rate_per_second)
+            pending: List[Dict[str, Any]] = []
+            service = get_chatgpt_service()
+
+            async def flush():
+                batch = pending[:]
+                del pending[:]
+                try:
+                    await asyncio.to_thread(save_plan_batch, batch, self.created_by)
+                    self.saved += len(batch)
+                except Exception as e:
+                    self.failed += len(batch)
+                    self._record_error(f"Saving {len(batch)} plan(s) failed: {e}")
+
+            async def generate(item):
+                async with semaphore:
+                    await limiter.wait()
+                    call_started = time.perf_counter()
+                    item["usage"] = new_usage(GENERATION_SETTINGS["model"])
+                    try:
+                        item["plan"] = await asyncio.wait_for(
+                            service.request_treatment_plan(
+                                item["patient_data"], item["scan_data"],
+                                item["scan_data"]["eligibility_result"], item["scan_data"]["eligible"],
+                                usage=item["usage"]
+                            ),
+                            timeout=self.timeout_seconds
+                        )
+                    except (OpenAIAPIError, httpx.HTTPError, asyncio.TimeoutError) as e:
+                        self.failed += 1
+                        self._record_error(f"Scan {item['scan_id']}: {str(e) or type(e).__name__}")
+                        if on_progress:
+                            on_progress(self)
+                        return
+                    finally:
+                        self._slowest_call = max(self._slowest_call, time.perf_counter() - call_started)
+
+                self.generated += 1
+                self.cost_usd += item["usage"]["cost_usd"] or 0.0
+                pending.append(item)
+                if len(pending) >= self.batch_size:
+                    await flush()
+                if on_progress:
+                    on_progress(self)
+
+            try:
+                await asyncio.gather(*(generate(item) for item in queue))
+            finally:
+                # Plans generated before a cancellation (server shutdown) are saved too
+                if pending:
+                    await flush()
+            self.status = "completed"
+        except asyncio.CancelledError:
+            self.status = "cancelled"
+            self._record_error("Bulk generation cancelled before it finished")
+            raise
+        except Exception as e:
+            self.status = "failed"
+            self._record_error(f"Bulk generation stopped: {e}")
+        finally:
+            self.finished_at = datetime.now()
+            if on_progress:
+                on_progress(self)
+
+    def _record_error(self, error: str):
+        # Keep the first few; a systematic failure would otherwise repeat hundreds of times
+        if len(self.errors) < 20:
+            self.errors.append(error)
+
+    def progress(self) -> Dict[str, Any]:
+        elapsed = time.perf_counter() - self._started if self._started else 0.0
+        return {
+            "run_id": self.id,
+            "status": self.status,
+            "total": self.total,
+            "generated": self.generated,
+            "saved": self.saved,
+            "failed": self.failed,
+            "remaining": max(self.total - self.generated - self.failed, 0),
+            "concurrency": self.concurrency,
+            "rate_per_second": self.rate_per_second,
+            "batch_size": self.batch_size,
+            "elapsed_seconds": round(elapsed, 2),
+            "slowest_call_seconds": round(self._slowest_call, 2),
+            "cost_usd": round(self.cost_usd, 6),
+            "errors": self.errors,
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Draft treatment plans for every ready_for_review scan without one")
+    parser.add_argument("--concurrency", type=int, default=BULK_PLAN_CONCURRENCY, help="simultaneous LLM calls")
+    parser.add_argument("--rate", type=float, default=BULK_PLAN_RATE_PER_SECOND,
+                        help="LLM calls started per second (0 for no limit)")
+    parser.add_argument("--batch-size", type=int, default=BULK_PLAN_BATCH_SIZE, help="plans committed per transaction")
+    parser.add_argument("--limit", type=int, default=None, help="only the oldest N scans")
+    parser.add_argument("--created-by", default="bulk-generation", help="username recorded on the drafts")
+    args = parser.parse_args()
+
+    bulk_run = BulkPlanRun(concurrency=args.concurrency, rate_per_second=args.rate,
+                           batch_size=args.batch_size, created_by=args.created_by, limit=args.limit)
+
+    def report(current: BulkPlanRun):
+        p = current.progress()
+        print(f"\r{p['generated'] + p['failed']}/{p['total']} done, {p['saved']} saved, "
+              f"{p['failed']} failed, {p['elapsed_seconds']:.1f}s", end="", flush=True)
+
+    async def run():
+        try:
+            await bulk_run.run(report)
+        finally:
+            await get_chatgpt_service().aclose()
+
+    print("Bulk Treatment Plan Generation")
+    print("=" * 60)
+    asyncio.run(run())
+    print()
+
+    p = bulk_run.progress()
+    print(f"status               {p['status']}")
+    print(f"scans in queue       {p['total']}")
+    print(f"plans saved          {p['saved']}")
+    print(f"failed               {p['failed']}")
+    print(f"estimated cost       ${p['cost_usd']:.4f}")
+    print(f"wall time            {p['elapsed_seconds']:.1f} s (slowest call {p['slowest_call_seconds']:.1f} s)")
+    for error in p["errors"]:
+        print(f"  ❌ {error}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,74 @@
+import asyncio
 import os
-import openai
-from typing import Dict, Any, Optional
-from datetime import datetime
+import time
+import httpx
+from typing import Dict, Any, AsyncIterator, List, Optional
 import json
+from plan_cache import get_plan_cache, normalize_plan_inputs, plan_cache_key
+from llm_resilience import CircuitBreaker, CircuitOpenError, LatencyTracker, hedged
+from llm_metrics import get_llm_metrics, new_usage, estimate_tokens, estimate_cost
+from prompt_builder import generation_messages, refine_messages
+
+# LLM_MOCK=true points the service at a local mock_llm_server.py instead of OpenAI
+LLM_MOCK = os.getenv("LLM_MOCK", "false").lower() in ("1", "true", "yes")
+MOCK_LLM_URL = os.getenv("MOCK_LLM_URL", "http://127.0.0.1:8765/v1")
+
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", MOCK_LLM_URL if LLM_MOCK else "https://api.openai.com/v1")
+OPENAI_TIMEOUT_SECONDS = float(os.getenv("OPENAI_TIMEOUT_SECONDS", "30"))
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "20"))
+
+# Resilience: total time budget per call (including any hedge), circuit breaker
+# thresholds, and optional hedging once a call runs past the given percentile
+LLM_DEADLINE_SECONDS = float(os.getenv("LLM_DEADLINE_SECONDS", "20"))
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_RESET_SECONDS = float(os.getenv("LLM_BREAKER_RESET_SECONDS", "30"))
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "false").lower() in ("1", "true", "yes")
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "0.95"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+LLM_HEDGE_MIN_DELAY_SECONDS = float(os.getenv("LLM_HEDGE_MIN_DELAY_SECONDS", "0.5"))
+
+# Bump when the prompt templates change so cached plans from older prompts are not reused
+PROMPT_VERSION = "2"
+
+GENERATION_SETTINGS = {
+    "model": "gpt-3.5-turbo",
+    "max_tokens": 300,    # keeps it short
+    "temperature": 0.1,   # keeps it clinical
+}
+REFINE_SETTINGS = {
+    "model": "gpt-3.5-turbo",
+    "max_tokens": 1500,
+    "temperature": 0.3,
+}
+
+
+class OpenAIAPIError(Exception):
+    """The API answered with a non-200 status or an unusable body."""
+
+    def __init__(self, message: str, status_code: int = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class LLMUnavailableError(OpenAIAPIError):
+    """
+    No answer within the deadline budget, or the circuit breaker is open.
+    Callers should report 503 and retry after retry_after seconds.
+    """
+
+    def __init__(self, message: str, retry_after: float = None):
+        super().__init__(message, status_code=503)
+        self.retry_after = retry_after
+
+
+def _is_upstream_failure(error: Exception) -> bool:
+    """Errors that say the upstream is unhealthy, as opposed to a bad request."""
+    if isinstance(error, httpx.HTTPError):
+        return True
+    if isinstance(error, OpenAIAPIError):
+        return error.status_code is None or error.status_code == 429 or error.status_code >= 500
+    return False
+
 
 class ChatGPTTreatmentPlanService:
     def __init__(self):
@@ -10,164 +76,379 @@ class ChatGPTTreatmentPlanService:
         self.api_key = os.getenv("OPENAI_API_KEY")
         if not self.api_key or self.api_key == "your_openai_api_key_here":
             self.api_key = None
-            print("Warning: OPENAI_API_KEY not configured. AI features will be disabled.")
-        else:
-            openai.api_key = self.api_key
-    
-    def generate_treatment_plan(self, patient_data: Dict[str, Any], scan_data: Dict[str, Any], 
-                              eligibility_result: str, is_eligible: bool) -> str:
+            if LLM_MOCK:
+                self.api_key = "mock"  # the mock server accepts any key
+            else:
+                print("Warning: OPENAI_API_KEY not configured. AI features will be disabled.")
+        if LLM_MOCK:
+            print(f"Using mock LLM server at {OPENAI_BASE_URL}")
+        self.base_url = OPENAI_BASE_URL.rstrip("/")
+        self._client: Optional[httpx.AsyncClient] = None
+        self._client_loop = None
+        
+        self.breaker = CircuitBreaker(LLM_BREAKER_FAILURES, LLM_BREAKER_RESET_SECONDS)
+        self.latencies = LatencyTracker()
+        self.hedges_started = 0
+        self.hedges_won = 0
+        self.deadlines_exceeded = 0
+
+    def _get_client(self) -> httpx.AsyncClient:
         """
-        Generate a comprehensive treatment plan using ChatGPT based on patient data and scan results.
+        One long-lived client per event loop, so every request reuses the same
+        keep-alive connection pool instead of opening a new TLS connection.
         """
-        if not self.api_key:
-            return "AI service is not configured. Please set OPENAI_API_KEY environment variable."
-        
-        try:
-            # Prepare the prompt based on eligibility
-            if is_eligible:
-                prompt = self._create_tpa_eligible_prompt(patient_data, scan_data, eligibility_result)
-            else:
-                prompt = self._create_not_eligible_prompt(patient_data, scan_data, eligibility_result)
-            
-            # Call OpenAI API
-            response = openai.ChatCompletion.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {
-                        "role": "system", 
-                        "content": "You are a stroke neurologist. Provide concise medical recommendations only."
-                    },
-                    {
-                        "role": "user", 
-                        "content": prompt
-                    }
-                ],
-                max_tokens=300,   # keeps it short
-                temperature=0.1   # keeps it clinical
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client.is_closed or self._client_loop is not loop:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers={"Authorization": f"Bearer {self.api_key}"},
+                timeout=httpx.Timeout(OPENAI_TIMEOUT_SECONDS, connect=5.0),
+                limits=httpx.Limits(
+                    max_connections=OPENAI_MAX_CONNECTIONS,
+                    max_keepalive_connections=OPENAI_MAX_CONNECTIONS,
+                ),
             )
+            self._client_loop = loop
+        return self._client
 
+    async def aclose(self):
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+        self._client = None
+        self._client_loop = None
 
-            
-            return response.choices[0].message.content.strip()
-            
-        except Exception as e:
-            return f"Error generating treatment plan: {str(e)}"
-    
-    def _create_tpa_eligible_prompt(self, patient_data: Dict[str, Any], scan_data: Dict[str, Any], 
-                                   eligibility_result: str) -> str:
-        """Create prompt for tPA eligible patients"""
-        prompt = f"""
-        Patient Information:
-        - Name: {patient_data.get('name', 'N/A')}
-        - Age: {patient_data.get('age', 'N/A')} years
-        - Gender: {patient_data.get('gender', 'N/A')}
-        - Chief Complaint: {patient_data.get('chief_complaint', 'N/A')}
-        - Time since onset: {patient_data.get('time_since_onset', 'N/A')}
+    def _before_call(self):
+        try:
+            self.breaker.before_call()
+        except CircuitOpenError as e:
+            raise LLMUnavailableError(str(e), retry_after=e.retry_after)
+
+    def _hedge_delay(self) -> Optional[float]:
+        if not LLM_HEDGE_ENABLED or self.breaker.state != "closed" or len(self.latencies) < LLM_HEDGE_MIN_SAMPLES:
+            return None
+        return max(self.latencies.percentile(LLM_HEDGE_PERCENTILE), LLM_HEDGE_MIN_DELAY_SECONDS)
+
+    def _deadline_exceeded(self, budget: float) -> LLMUnavailableError:
+        self.deadlines_exceeded += 1
+        self.breaker.record_failure()
+        return LLMUnavailableError(f"AI model did not respond within {budget:.0f}s")
+
+    def _fill_usage(self, usage: Dict[str, Any], messages: List[Dict[str, str]], content: str,
+                    api_usage: Optional[Dict[str, Any]], started: float):
+        usage["latency_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        if api_usage:
+            usage["prompt_tokens"] = api_usage.get("prompt_tokens", 0)
+            usage["completion_tokens"] = api_usage.get("completion_tokens", 0)
+        else:
+            usage["prompt_tokens"] = sum(estimate_tokens(message["content"]) for message in messages)
+            usage["completion_tokens"] = estimate_tokens(content)
+            usage["estimated"] = True
+        usage["cost_usd"] = estimate_cost(usage["model"], usage["prompt_tokens"], usage["completion_tokens"])
+
+    async def chat_completion(self, messages: List[Dict[str, str]], model: str,
+                              max_tokens: int, temperature: float, deadline: float = None,
+                              operation: str = "chat", usage: Dict[str, Any] = None) -> str:
+        """
+        Call the chat completions endpoint without blocking the event loop.
+        Raises httpx.HTTPError on network failures and OpenAIAPIError on API errors;
+        LLMUnavailableError when the circuit is open or the deadline budget
+        (LLM_DEADLINE_SECONDS by default) runs out.
         
-        Vital Signs:
-        - Blood Pressure: {patient_data.get('systolic_bp', 'N/A')}/{patient_data.get('diastolic_bp', 'N/A')} mmHg
-        - Heart Rate: {patient_data.get('heart_rate', 'N/A')} bpm
-        - Temperature: {patient_data.get('temperature', 'N/A')}°F
-        - Oxygen Saturation: {patient_data.get('oxygen_saturation', 'N/A')}%
-        - Glucose: {patient_data.get('glucose', 'N/A')} mg/dL
-        - INR: {patient_data.get('inr', 'N/A')}
+        Every call is recorded in the LLM metrics under operation; pass a dict
+        from llm_metrics.new_usage() as usage to get its tokens, latency and cost.
+        """
+        usage = new_usage(model) if usage is None else usage
+        budget = deadline or LLM_DEADLINE_SECONDS
+        started = time.perf_counter()
         
-        Scan Results:
-        - Imaging Confirmed: {scan_data.get('imaging_confirmed', 'N/A')}
-        - Diagnosis: {scan_data.get('prediction', 'N/A')}
-        - Eligibility Assessment: {eligibility_result}
+        async def attempt():
+            usage["attempts"] += 1
+            attempt_started = time.perf_counter()
+            try:
+                result = await self._post_chat_completion(messages, model, max_tokens, temperature)
+            except asyncio.CancelledError:
+                self.breaker.record_abandoned()
+                raise
+            except Exception as e:
+                # A bad request says nothing about upstream health, but must still release a half-open trial
+                if _is_upstream_failure(e):
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.record_abandoned()
+                raise
+            self.breaker.record_success()
+            self.latencies.record(time.perf_counter() - attempt_started)
+            return result
         
-        Please provide a comprehensive treatment plan for this tPA-eligible stroke patient. Include:
-        1. Immediate interventions (first 24 hours)
-        2. tPA administration protocol and monitoring
-        3. Post-tPA care and monitoring
-        4. Secondary prevention measures
-        5. Rehabilitation planning
-        6. Follow-up schedule
-        7. Potential complications to watch for
+        def hedge_started():
+            self.hedges_started += 1
         
-        Format the response in clear sections with specific medical recommendations.
-        """
-        return prompt
-    
-    def _create_not_eligible_prompt(self, patient_data: Dict[str, Any], scan_data: Dict[str, Any], 
-                                   eligibility_result: str) -> str:
-        """Create prompt for non-tPA eligible patients"""
-        prompt = f"""
-        Patient Information:
-        - Name: {patient_data.get('name', 'N/A')}
-        - Age: {patient_data.get('age', 'N/A')} years
-        - Gender: {patient_data.get('gender', 'N/A')}
-        - Chief Complaint: {patient_data.get('chief_complaint', 'N/A')}
-        - Time since onset: {patient_data.get('time_since_onset', 'N/A')}
+        def hedge_won():
+            self.hedges_won += 1
         
-        Vital Signs:
-        - Blood Pressure: {patient_data.get('systolic_bp', 'N/A')}/{patient_data.get('diastolic_bp', 'N/A')} mmHg
-        - Heart Rate: {patient_data.get('heart_rate', 'N/A')} bpm
-        - Temperature: {patient_data.get('temperature', 'N/A')}°F
-        - Oxygen Saturation: {patient_data.get('oxygen_saturation', 'N/A')}%
-        - Glucose: {patient_data.get('glucose', 'N/A')} mg/dL
-        - INR: {patient_data.get('inr', 'N/A')}
+        try:
+            self._before_call()
+            try:
+                content, api_usage = await asyncio.wait_for(
+                    hedged(attempt, self._hedge_delay(), hedge_started, hedge_won), timeout=budget
+                )
+            except asyncio.TimeoutError:
+                raise self._deadline_exceeded(budget)
+        except Exception:
+            get_llm_metrics().record_error(operation)
+            raise
         
-        Scan Results:
-        - Imaging Confirmed: {scan_data.get('imaging_confirmed', 'N/A')}
-        - Diagnosis: {scan_data.get('prediction', 'N/A')}
-        - Eligibility Assessment: {eligibility_result}
+        self._fill_usage(usage, messages, content, api_usage, started)
+        get_llm_metrics().record_request(operation, usage)
+        return content
+
+    async def _post_chat_completion(self, messages: List[Dict[str, str]], model: str,
+                                    max_tokens: int, temperature: float):
+        """One request; returns (content, usage block of the response)."""
+        response = await self._get_client().post("/chat/completions", json={
+            "model": model,
+            "messages": messages,
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+        })
+
+        if response.status_code != 200:
+            error_detail = "OpenAI API request failed"
+            try:
+                error_detail = response.json().get("error", {}).get("message", error_detail)
+            except ValueError:
+                pass
+            raise OpenAIAPIError(error_detail, response.status_code)
+
+        body = response.json()
+        if not body.get("choices"):
+            raise OpenAIAPIError("Invalid response from OpenAI API")
+        return body["choices"][0]["message"]["content"], body.get("usage")
+
+    async def stream_chat_completion(self, messages: List[Dict[str, str]], model: str,
+                                     max_tokens: int, temperature: float, deadline: float = None,
+                                     operation: str = "chat_stream",
+                                     usage: Dict[str, Any] = None) -> AsyncIterator[str]:
+        """
+        Stream a chat completion, yielding content fragments as they arrive.
+        Raises the same errors as chat_completion; the deadline budget covers
+        the whole stream.  Streams are not hedged.  usage works as in
+        chat_completion and also gets the time to first token.
+        """
+        usage = new_usage(model) if usage is None else usage
+        budget = deadline or LLM_DEADLINE_SECONDS
+        try:
+            self._before_call()
+        except LLMUnavailableError:
+            get_llm_metrics().record_error(operation)
+            raise
+        started = time.perf_counter()
+        ends_at = time.monotonic() + budget
+        api_usage, parts = {}, []
+        usage["attempts"] += 1
+        chunks = self._stream_chat_completion(messages, model, max_tokens, temperature, api_usage).__aiter__()
+        settled = False
+        try:
+            while True:
+                remaining = ends_at - time.monotonic()
+                if remaining <= 0:
+                    settled = True
+                    self.breaker.record_abandoned()
+                    get_llm_metrics().record_error(operation)
+                    raise self._deadline_exceeded(budget)
+                try:
+                    content = await asyncio.wait_for(chunks.__anext__(), timeout=remaining)
+                except StopAsyncIteration:
+                    break
+                except asyncio.TimeoutError:
+                    settled = True
+                    self.breaker.record_abandoned()
+                    get_llm_metrics().record_error(operation)
+                    raise self._deadline_exceeded(budget)
+                except Exception as e:
+                    settled = True
+                    get_llm_metrics().record_error(operation)
+                    if _is_upstream_failure(e):
+                        self.breaker.record_failure()
+                    else:
+                        self.breaker.record_abandoned()
+                    raise
+                if not parts:
+                    usage["ttft_ms"] = round((time.perf_counter() - started) * 1000, 1)
+                parts.append(content)
+                yield content
+            settled = True
+            self.breaker.record_success()
+            self._fill_usage(usage, messages, "".join(parts), api_usage, started)
+            get_llm_metrics().record_request(operation, usage)
+        finally:
+            if not settled:
+                # The consumer went away mid-stream
+                self.breaker.record_abandoned()
+            await chunks.aclose()
+
+    async def _stream_chat_completion(self, messages: List[Dict[str, str]], model: str,
+                                      max_tokens: int, temperature: float,
+                                      api_usage: Dict[str, Any]) -> AsyncIterator[str]:
+        """Yields content fragments; the usage block of the final chunk is copied into api_usage."""
+        async with self._get_client().stream("POST", "/chat/completions", json={
+            "model": model,
+            "messages": messages,
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            "stream": True,
+            "stream_options": {"include_usage": True},
+        }) as response:
+            if response.status_code != 200:
+                await response.aread()
+                error_detail = "OpenAI API request failed"
+                try:
+                    error_detail = response.json().get("error", {}).get("message", error_detail)
+                except ValueError:
+                    pass
+                raise OpenAIAPIError(error_detail, response.status_code)
+
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                try:
+                    chunk = json.loads(data)
+                except ValueError:
+                    raise OpenAIAPIError("Invalid response from OpenAI API")
+                if chunk.get("usage"):
+                    api_usage.update(chunk["usage"])
+                for choice in chunk.get("choices", []):
+                    content = choice.get("delta", {}).get("content")
+                    if content:
+                        yield content
+
+    async def request_treatment_plan(self, patient_data: Dict[str, Any], scan_data: Dict[str, Any],
+                                     eligibility_result: str, is_eligible: bool,
+                                     regenerate: bool = False, usage: Dict[str, Any] = None) -> str:
+        """
+        Generate a comprehensive treatment plan using ChatGPT based on patient data and scan results.
+        Plans are served from the plan cache when the normalized inputs match;
+        regenerate=True skips the lookup and replaces the cached plan.
+        Raises OpenAIAPIError or httpx.HTTPError; error text is never returned as a plan.
+        usage, if given, is filled in as by chat_completion.
+        """
+        if not self.api_key:
+            raise OpenAIAPIError("AI service is not configured. Please set OPENAI_API_KEY environment variable.")
+        
+        usage = new_usage(GENERATION_SETTINGS["model"]) if usage is None else usage
+        cache = get_plan_cache()
+        cache_key = self._plan_cache_key(patient_data, scan_data, eligibility_result, is_eligible)
+        if regenerate:
+            cache.record_bypass()
+        else:
+            cached_plan = await cache.aget(cache_key)
+            if cached_plan is not None:
+                usage["cached"] = True
+                get_llm_metrics().record_request("generate", usage)
+                return cached_plan
         
-        This patient is NOT eligible for tPA therapy. Please provide a comprehensive alternative treatment plan including:
-        1. Immediate supportive care (first 24 hours)
-        2. Medical management strategies
-        3. Secondary prevention measures
-        4. Rehabilitation planning
-        5. Follow-up schedule
-        6. Alternative interventions if applicable
-        7. Monitoring parameters
+        # Call OpenAI API
+        started = time.perf_counter()
+        content = await self.chat_completion(
+            messages=generation_messages(patient_data, scan_data, eligibility_result, is_eligible),
+            operation="generate", usage=usage, **GENERATION_SETTINGS
+        )
         
-        Format the response in clear sections with specific medical recommendations.
-        """
-        return prompt
+        plan = content.strip()
+        if not plan:
+            raise OpenAIAPIError("OpenAI API returned an empty treatment plan")
+        await cache.aput(cache_key, plan, (time.perf_counter() - started) * 1000)
+        return plan
     
-    def refine_treatment_plan(self, existing_plan: str, physician_notes: str) -> str:
+    def _plan_cache_key(self, patient_data: Dict[str, Any], scan_data: Dict[str, Any],
+                        eligibility_result: str, is_eligible: bool) -> str:
+        normalized = normalize_plan_inputs(patient_data, scan_data, eligibility_result, is_eligible)
+        return plan_cache_key(normalized, {**GENERATION_SETTINGS, "prompt_version": PROMPT_VERSION})
+    
+    async def refine_treatment_plan(self, existing_plan: str, physician_notes: str,
+                                    usage: Dict[str, Any] = None) -> str:
         """
         Refine an existing treatment plan based on physician input using ChatGPT.
+        Raises like request_treatment_plan.
         """
         if not self.api_key:
-            return "AI service is not configured. Please set OPENAI_API_KEY environment variable."
+            raise OpenAIAPIError("AI service is not configured. Please set OPENAI_API_KEY environment variable.")
         
-        try:
-            prompt = f"""
-            Below is an existing treatment plan for a stroke patient:
-            
-            {existing_plan}
-            
-            The physician has provided the following additional notes and modifications:
-            
-            {physician_notes}
-            
-            Please refine and update the treatment plan incorporating the physician's notes while maintaining medical accuracy and evidence-based recommendations. 
-            Highlight any changes made and provide the updated comprehensive treatment plan.
-            """
-            
-            response = openai.ChatCompletion.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {
-                        "role": "system", 
-                        "content": "You are an expert neurologist. Refine treatment plans based on physician input while maintaining medical accuracy."
-                    },
-                    {
-                        "role": "user", 
-                        "content": prompt
-                    }
-                ],
-                max_tokens=1500,
-                temperature=0.3
-            )
-            
-            return response.choices[0].message.content.strip()
-            
-        except Exception as e:
-            return f"Error refining treatment plan: {str(e)}"
+        content = await self.chat_completion(
+            messages=refine_messages(existing_plan, physician_notes),
+            operation="refine", usage=usage, **REFINE_SETTINGS
+        )
+        
+        refined_plan = content.strip()
+        if not refined_plan:
+            raise OpenAIAPIError("OpenAI API returned an empty treatment plan")
+        return refined_plan
+
+    async def stream_treatment_plan(self, patient_data: Dict[str, Any], scan_data: Dict[str, Any],
+                                    eligibility_result: str, is_eligible: bool,
+                                    regenerate: bool = False, usage: Dict[str, Any] = None) -> AsyncIterator[str]:
+        """
+        Streaming variant of request_treatment_plan; errors propagate to the caller.
+        A cached plan is yielded in one piece; a completed stream is cached.
+        """
+        if not self.api_key:
+            raise OpenAIAPIError("AI service is not configured. Please set OPENAI_API_KEY environment variable.")
+        
+        usage = new_usage(GENERATION_SETTINGS["model"]) if usage is None else usage
+        cache = get_plan_cache()
+        cache_key = self._plan_cache_key(patient_data, scan_data, eligibility_result, is_eligible)
+        if regenerate:
+            cache.record_bypass()
+        else:
+            cached_plan = await cache.aget(cache_key)
+            if cached_plan is not None:
+                usage["cached"] = True
+                get_llm_metrics().record_request("generate_stream", usage)
+                yield cached_plan
+                return
+        
+        started = time.perf_counter()
+        parts = []
+        async for content in self.stream_chat_completion(
+            messages=generation_messages(patient_data, scan_data, eligibility_result, is_eligible),
+            operation="generate_stream", usage=usage, **GENERATION_SETTINGS
+        ):
+            parts.append(content)
+            yield content
+        plan = "".join(parts).strip()
+        if plan:
+            await cache.aput(cache_key, plan, (time.perf_counter() - started) * 1000)
+
+    async def stream_refined_plan(self, existing_plan: str, physician_notes: str,
+                                  usage: Dict[str, Any] = None) -> AsyncIterator[str]:
+        """Streaming variant of refine_treatment_plan; errors propagate to the caller."""
+        if not self.api_key:
+            raise OpenAIAPIError("AI service is not configured. Please set OPENAI_API_KEY environment variable.")
+        async for content in self.stream_chat_completion(
+            messages=refine_messages(existing_plan, physician_notes),
+            operation="refine_stream", usage=usage, **REFINE_SETTINGS
+        ):
+            yield content
+
+    def resilience_stats(self) -> Dict[str, Any]:
+        def seconds(value):
+            return round(value, 3) if value is not None else None
+        
+        return {
+            "circuit_breaker": self.breaker.stats(),
+            "deadline_seconds": LLM_DEADLINE_SECONDS,
+            "deadlines_exceeded": self.deadlines_exceeded,
+            "latency_p50_s": seconds(self.latencies.percentile(0.50)),
+            "latency_p95_s": seconds(self.latencies.percentile(0.95)),
+            "latency_p99_s": seconds(self.latencies.percentile(0.99)),
+            "hedging_enabled": LLM_HEDGE_ENABLED,
+            "hedge_after_s": seconds(self._hedge_delay()),
+            "hedges_started": self.hedges_started,
+            "hedges_won": self.hedges_won,
+        }
 
 # Global instance - lazy loaded
 chatgpt_service = None
@@ -177,3 +458,9 @@ def get_chatgpt_service():
     if chatgpt_service is None:
         chatgpt_service = ChatGPTTreatmentPlanService()
     return chatgpt_service
+
+
+async def close_chatgpt_service():
+    """Close the shared HTTP connection pool (called on application shutdown)."""
+    if chatgpt_service is not None:
+        await chatgpt_service.aclose()
@@ -1,6 +1,7 @@
-from database import Base, engine
-import models
+from database import engine
+from migrations import sync_model_schema, run_migrations
 
 print("Creating all tables...")
-Base.metadata.create_all(bind=engine)
+sync_model_schema(engine)
+run_migrations(engine)
 print("Done!")
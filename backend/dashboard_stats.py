@@ -0,0 +1,340 @@
+"""
+Dashboard statistics
+The technician and physician dashboards read their numbers from the
+dashboardcounters table: a handful of primary-key lookups, however many
+patients and scans there are.
+
+Counters are kept current by session events on SessionLocal.  Every flush
+that inserts, changes or deletes patients and scans works out how the
+counters it affects change, and the changes are added to the counters just
+before the transaction commits, in that same transaction, so they commit or
+roll back with the rows they count.  Every upload updates the same few
+counter rows ("scans", today's day counters), so on PostgreSQL concurrent
+uploads queue on those row locks; writing them last holds the locks only for
+the commit itself rather than for the whole transaction.  Measured by
+test_dashboard_stats.py, four concurrent writers lose about as much upload
+throughput to the counters as a single writer does (the extra statements per
+write), so the waiting on the counter rows adds little.
+Counters for time windows are kept per day:
+
+    scans_day:<date>     scans whose timestamp falls on that day
+    reviewed_day:<date>  reviewed scans whose timestamp falls on that day
+    patients_day:<date>  patients whose latest scan falls on that day
+
+Writes that bypass the ORM (raw SQL, scripts using their own sessions) are
+not counted, so CounterReconciler recounts everything from the tables at
+startup and every DASHBOARD_RECONCILE_SECONDS.  Until the first recount has
+finished, and when DASHBOARD_COUNTERS is off, the stats come from a single
+aggregate query instead.
+"""
+
+import asyncio
+import os
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import and_, case, delete, distinct, event, func, inspect, or_, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from database import SessionLocal, engine
+from models import DashboardCounter, Patient, StrokeScan
+
+DASHBOARD_COUNTERS = os.getenv("DASHBOARD_COUNTERS", "true").lower() in ("1", "true", "yes")
+DASHBOARD_RECONCILE_SECONDS = float(os.getenv("DASHBOARD_RECONCILE_SECONDS", "3600"))
+
+# Scans and patients with activity in the last RECENT_DAYS days (plus today) count as recent
+RECENT_DAYS = 7
+
+# Set by each recount; counters are only read once it exists
+RECONCILED_AT = "reconciled_at"
+DAY_PREFIXES = ("scans_day:", "reviewed_day:", "patients_day:")
+
+counters = DashboardCounter.__table__
+UPSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+
+def dashboard_windows(now: Optional[datetime] = None):
+    """Start of today and of the recent-activity window (midnight RECENT_DAYS days ago)."""
+    today = (now or datetime.now()).replace(hour=0, minute=0, second=0, microsecond=0)
+    return today, today - timedelta(days=RECENT_DAYS)
+
+
+def scan_counter_names(eligible, status, timestamp) -> list:
+    """Counters a scan in this state adds one to."""
+    names = ["scans"]
+    if eligible is True:
+        names.append("scans_eligible")
+    elif eligible is False:
+        names.append("scans_not_eligible")
+    if status:
+        names.append(f"status:{status}")
+    if timestamp:
+        names.append(f"scans_day:{timestamp.date()}")
+        if status == "reviewed":
+            names.append(f"reviewed_day:{timestamp.date()}")
+    return names
+
+
+def _stats_from_counters(values: dict, days: list, today: datetime) -> dict:
+    return {
+        "total_patients": values.get("patients", 0),
+        "total_scans": values.get("scans", 0),
+        "eligible_scans": values.get("scans_eligible", 0),
+        "not_eligible_scans": values.get("scans_not_eligible", 0),
+        "sent_to_doctor_scans": values.get("status:ready_for_review", 0),
+        "recent_patients": sum(values.get(f"patients_day:{day}", 0) for day in days),
+        "recent_scans": sum(values.get(f"scans_day:{day}", 0) for day in days),
+        "reviewed_today": values.get(f"reviewed_day:{today.date()}", 0),
+    }
+
+
+def counter_stats(db, now: Optional[datetime] = None) -> Optional[dict]:
+    """Stats from the counters, or None while they have never been reconciled."""
+    today, week_ago = dashboard_windows(now)
+    days = [(week_ago + timedelta(days=i)).date() for i in range(RECENT_DAYS + 1)]
+    names = ["patients", "scans", "scans_eligible", "scans_not_eligible", "status:ready_for_review",
+             f"reviewed_day:{today.date()}", RECONCILED_AT]
+    names += [f"{prefix}:{day}" for prefix in ("scans_day", "patients_day") for day in days]
+    values = dict(db.execute(select(counters.c.name, counters.c.value).where(counters.c.name.in_(names))).all())
+    if RECONCILED_AT not in values:
+        return None
+    return _stats_from_counters(values, days, today)
+
+
+def aggregate_stats(db, now: Optional[datetime] = None) -> dict:
+    """The same stats counted from the tables in one query."""
+    today, week_ago = dashboard_windows(now)
+    recent = StrokeScan.timestamp >= week_ago
+    row = db.execute(select(
+        select(func.count(Patient.id)).scalar_subquery(),
+        func.count(StrokeScan.id),
+        func.count(case((StrokeScan.eligible == True, 1))),
+        func.count(case((StrokeScan.eligible == False, 1))),
+        func.count(case((StrokeScan.status == "ready_for_review", 1))),
+        func.count(distinct(case((recent, StrokeScan.patient_id)))),
+        func.count(case((recent, 1))),
+        func.count(case((and_(StrokeScan.status == "reviewed", StrokeScan.timestamp >= today), 1))),
+    )).one()
+    fields = ("total_patients", "total_scans", "eligible_scans", "not_eligible_scans", "sent_to_doctor_scans",
+              "recent_patients", "recent_scans", "reviewed_today")
+    return dict(zip(fields, row))
+
+
+def dashboard_stats(db, now: Optional[datetime] = None) -> dict:
+    """Stats for both dashboards: from the counters when they are ready, otherwise aggregated."""
+    if DASHBOARD_COUNTERS:
+        stats = counter_stats(db, now)
+        if stats is not None:
+            return stats
+    return aggregate_stats(db, now)
+
+
+def add_to_counters(conn, deltas: dict):
+    """Add each delta to its counter, creating missing counters, in the caller's transaction."""
+    rows = [{"name": name, "value": value} for name, value in sorted(deltas.items()) if value]
+    if not rows:
+        return
+    stmt = UPSERTS[conn.dialect.name](counters)
+    # Sorted rows lock counters in the same order in every transaction, so concurrent writers cannot deadlock
+    conn.execute(stmt.on_conflict_do_update(index_elements=["name"],
+                                            set_={"value": counters.c.value + stmt.excluded.value}), rows)
+
+
+# ---------- Incremental maintenance ----------
+
+SCAN_COLUMNS = (StrokeScan.id, StrokeScan.patient_id, StrokeScan.eligible, StrokeScan.status, StrokeScan.timestamp)
+
+
+def _scan_rows(conn, ids) -> dict:
+    if not ids:
+        return {}
+    return {row.id: row for row in conn.execute(select(*SCAN_COLUMNS).where(StrokeScan.id.in_(ids)))}
+
+
+def _latest_scans(conn, patient_ids, excluding=()) -> dict:
+    query = select(StrokeScan.patient_id, func.max(StrokeScan.timestamp)).where(
+        StrokeScan.patient_id.in_(patient_ids)).group_by(StrokeScan.patient_id)
+    if excluding:
+        query = query.where(StrokeScan.id.not_in(excluding))
+    return dict(conn.execute(query).all())
+
+
+@event.listens_for(SessionLocal, "before_flush")
+def remember_scans_before_flush(session, flush_context, instances):
+    """Read the stored state of the scans this flush changes or deletes, before it is overwritten."""
+    changed = [obj for obj in session.dirty if isinstance(obj, StrokeScan) and session.is_modified(obj)]
+    changed += [obj for obj in session.deleted if isinstance(obj, StrokeScan)]
+    ids = [inspect(obj).identity[0] for obj in changed if inspect(obj).identity]
+    session.info["dashboard_scans_before"] = _scan_rows(session.connection(), ids) if ids else {}
+
+
+@event.listens_for(SessionLocal, "after_flush")
+def count_flushed_changes(session, flush_context):
+    before = session.info.pop("dashboard_scans_before", {})
+    new_scans = [obj.id for obj in session.new if isinstance(obj, StrokeScan)]
+    patients = sum(isinstance(obj, Patient) for obj in session.new) - \
+        sum(isinstance(obj, Patient) for obj in session.deleted)
+    if not (before or new_scans or patients):
+        return
+
+    conn = session.connection()
+    deleted = {inspect(obj).identity[0] for obj in session.deleted if isinstance(obj, StrokeScan)}
+    after = _scan_rows(conn, [scan_id for scan_id in [*before, *new_scans] if scan_id not in deleted])
+    deltas = Counter({"patients": patients})
+    moved = set()
+    for scan_id in set(before) | set(after):
+        old, new = before.get(scan_id), after.get(scan_id)
+        if old is not None:
+            deltas.subtract(scan_counter_names(old.eligible, old.status, old.timestamp))
+        if new is not None:
+            deltas.update(scan_counter_names(new.eligible, new.status, new.timestamp))
+        if old is None or new is None or (old.patient_id, old.timestamp) != (new.patient_id, new.timestamp):
+            moved.update(row.patient_id for row in (old, new) if row is not None and row.patient_id is not None)
+
+    if moved:
+        # A patient's latest scan before this flush: its other scans, plus the flushed ones as they were
+        flushed = set(before) | set(after)
+        latest_before = _latest_scans(conn, moved, excluding=flushed)
+        for row in before.values():
+            if row.patient_id in moved and row.timestamp and \
+                    (latest_before.get(row.patient_id) is None or row.timestamp > latest_before[row.patient_id]):
+                latest_before[row.patient_id] = row.timestamp
+        latest_after = _latest_scans(conn, moved)
+        for patient_id in moved:
+            old_latest, new_latest = latest_before.get(patient_id), latest_after.get(patient_id)
+            old_day = old_latest.date() if old_latest else None
+            new_day = new_latest.date() if new_latest else None
+            if old_day != new_day:
+                if old_day:
+                    deltas[f"patients_day:{old_day}"] -= 1
+                if new_day:
+                    deltas[f"patients_day:{new_day}"] += 1
+
+    session.info.setdefault("dashboard_deltas", Counter()).update(deltas)
+
+
+@event.listens_for(SessionLocal, "before_commit")
+def write_counted_changes(session):
+    """Add the transaction's counter changes last, so the counter rows stay locked only for the commit."""
+    session.flush()  # the commit's own flush would run after this hook
+    deltas = session.info.pop("dashboard_deltas", None)
+    if deltas:
+        add_to_counters(session.connection(), deltas)
+
+
+@event.listens_for(SessionLocal, "after_transaction_end")
+def forget_counted_changes(session, transaction):
+    # Rolled back or closed without committing: the changes were never written
+    if transaction.parent is None:
+        session.info.pop("dashboard_deltas", None)
+
+
+# ---------- Reconciliation ----------
+
+def count_from_tables(conn, now: Optional[datetime] = None) -> dict:
+    """Every counter, counted from the tables; day counters only from the start of the recent window."""
+    _, week_ago = dashboard_windows(now)
+    values = Counter({"patients": conn.execute(select(func.count(Patient.id))).scalar()})
+    for eligible, status, count in conn.execute(
+            select(StrokeScan.eligible, StrokeScan.status, func.count()).group_by(StrokeScan.eligible, StrokeScan.status)):
+        for name in scan_counter_names(eligible, status, None):
+            values[name] += count
+    for status, timestamp in conn.execute(
+            select(StrokeScan.status, StrokeScan.timestamp).where(StrokeScan.timestamp >= week_ago)):
+        values.update(name for name in scan_counter_names(None, status, timestamp)
+                      if name.startswith(DAY_PREFIXES))
+    latest = func.max(StrokeScan.timestamp)
+    for (timestamp,) in conn.execute(select(latest).where(StrokeScan.patient_id.is_not(None))
+                                     .group_by(StrokeScan.patient_id).having(latest >= week_ago)):
+        values[f"patients_day:{timestamp.date()}"] += 1
+    return dict(values)
+
+
+def _read_snapshot(bind, now: Optional[datetime] = None):
+    """The stored counters and a recount from the tables, both read from one snapshot."""
+    with bind.connect() as conn:
+        if conn.dialect.name == "sqlite":
+            # pysqlite opens no transaction for reads; without one each SELECT sees a later state
+            conn.exec_driver_sql("BEGIN")
+        else:
+            conn.execution_options(isolation_level="REPEATABLE READ")
+        stored = dict(conn.execute(select(counters.c.name, counters.c.value)).all())
+        counted = count_from_tables(conn, now)
+        conn.rollback()
+    return stored, counted
+
+
+def reconcile_counters(bind=engine, now: Optional[datetime] = None) -> dict:
+    """
+    Correct the counters that disagree with a fresh count from the tables.
+
+    Returns the counters that had drifted, as name: (stored, counted).
+    The count runs in a read snapshot, so writers are never blocked by it.
+    Each counter a writer commits after the snapshot already includes that
+    write, so only the difference seen in the snapshot is added on top, in a
+    short transaction, and no concurrent change is counted twice or lost.
+    """
+    stored, counted = _read_snapshot(bind, now)
+    # Day counters from before the window are never read; dropping them is not drift
+    oldest_day = str(dashboard_windows(now)[1].date())
+    expired = [name for name in stored if name.startswith(DAY_PREFIXES) and name.split(":", 1)[1] < oldest_day]
+    drift = {
+        name: (stored.get(name, 0), counted.get(name, 0))
+        for name in set(stored) | set(counted)
+        if name != RECONCILED_AT and name not in expired and stored.get(name, 0) != counted.get(name, 0)
+    }
+
+    with bind.begin() as conn:
+        add_to_counters(conn, {name: value - stored_value for name, (stored_value, value) in drift.items()})
+        if expired:
+            conn.execute(delete(counters).where(or_(*(
+                and_(counters.c.name.startswith(prefix), counters.c.name < prefix + oldest_day)
+                for prefix in DAY_PREFIXES))))
+        stmt = UPSERTS[conn.dialect.name](counters).values(name=RECONCILED_AT, value=int(time.time()))
+        conn.execute(stmt.on_conflict_do_update(index_elements=["name"], set_={"value": stmt.excluded.value}))
+    return drift
+
+
+class CounterReconciler:
+    """Recounts the dashboard counters at startup and then every interval_seconds."""
+
+    def __init__(self, interval_seconds: float = DASHBOARD_RECONCILE_SECONDS):
+        self.interval_seconds = interval_seconds
+        self.last_run: Optional[datetime] = None
+        self.last_drift: dict = {}
+        self._task = None
+
+    def start(self):
+        if not DASHBOARD_COUNTERS or self._task is not None:
+            return
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                self.last_drift = await asyncio.to_thread(reconcile_counters)
+                self.last_run = datetime.now()
+                if self.last_drift:
+                    print(f"Dashboard counters: corrected {len(self.last_drift)} drifted counter(s)")
+            except Exception as e:
+                print(f"Warning: dashboard counter reconciliation failed: {e}")
+            await asyncio.sleep(self.interval_seconds)
+
+
+# Global instance - lazy loaded
+counter_reconciler = None
+
+def get_counter_reconciler() -> CounterReconciler:
+    global counter_reconciler
+    if counter_reconciler is None:
+        counter_reconciler = CounterReconciler()
+    return counter_reconciler
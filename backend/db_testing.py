@@ -0,0 +1,57 @@
+"""
+Helpers shared by the database tests
+Temporary databases for a test, pointing SessionLocal (and with it the
+counter and eligibility hooks) at them, and emptying a server database again
+afterwards.
+"""
+
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+from database import SessionLocal, create_database_engine
+
+
+def is_postgresql_url(database_url: str) -> bool:
+    return (database_url or "").startswith(("postgresql", "postgres://"))
+
+
+def drop_tables(database_url: str):
+    """Leave a server database empty again; SQLite files go with the workspace."""
+    if database_url.startswith("sqlite"):
+        return
+    from sqlalchemy import create_engine, MetaData
+    engine = create_engine(database_url)
+    metadata = MetaData()
+    metadata.reflect(bind=engine)
+    metadata.drop_all(bind=engine)
+    engine.dispose()
+
+
+@contextmanager
+def temporary_database(prefix: str = "stroke-test-", database_url: str = None):
+    """
+    Engine on a new SQLite file in a temporary directory, or on database_url
+    (which should be an empty server database; its tables are dropped afterwards).
+    """
+    workspace = tempfile.mkdtemp(prefix=prefix)
+    bind = create_database_engine(database_url or f"sqlite:///{os.path.join(workspace, 'stroke.db')}")
+    try:
+        yield bind
+    finally:
+        bind.dispose()
+        shutil.rmtree(workspace, ignore_errors=True)
+        if database_url:
+            drop_tables(database_url)
+
+
+@contextmanager
+def sessions_bound_to(bind):
+    """Point SessionLocal at bind for the duration, then back at the app's engine."""
+    original_bind = SessionLocal.kw["bind"]
+    SessionLocal.configure(bind=bind)
+    try:
+        yield
+    finally:
+        SessionLocal.configure(bind=original_bind)
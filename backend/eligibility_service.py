@@ -0,0 +1,135 @@
+import hashlib
+import json
+from typing import Any, Dict, Optional
+
+from sqlalchemy.orm import Session
+
+from models import Patient, StrokeScan, NIHSSAssessment
+from tpa_eligibility import TPARuleSet, get_tpa_rule_set
+
+# Scans in these statuses carry a physician decision and are never re-evaluated
+FINAL_SCAN_STATUSES = ("reviewed", "approved_tpa", "rejected")
+
+# Eligibility input field -> (Patient attribute it is derived from, default when not recorded)
+PATIENT_ELIGIBILITY_FIELDS = {
+    "age": ("age", None),
+    "inr": ("inr", 1.0),
+    "heart_rate": ("heart_rate", 80),
+    "temperature": ("temperature", 98.6),
+    "oxygen_saturation": ("oxygen_saturation", 98),
+    "systolic_bp": ("systolic_bp", 120),
+    "diastolic_bp": ("diastolic_bp", 80),
+    "glucose": ("glucose", 100),
+    "platelet_count": ("platelet_count", 250),
+}
+
+
+def patient_eligibility_inputs(patient: Patient, nihss_assessment: Optional[NIHSSAssessment] = None) -> Dict[str, Any]:
+    """
+    The eligibility inputs derived from the patient record (and NIHSS assessment, if
+    given), with the same defaults build_eligibility_data uses for unrecorded values.
+    """
+    data = {}
+    for field, (attribute, default) in PATIENT_ELIGIBILITY_FIELDS.items():
+        value = getattr(patient, attribute)
+        data[field] = value if default is None else value or default
+    if nihss_assessment is not None:
+        data["nhiss_score"] = nihss_assessment.total_score
+    return data
+
+
+def build_eligibility_data(patient: Patient, nihss_assessment: NIHSSAssessment) -> Dict[str, Any]:
+    """
+    Assemble tPA eligibility inputs from the stored patient record and NIHSS assessment.
+    Fields the UI does not collect yet use safe defaults.
+    """
+    time_since_onset_hours = 2.0  # Placeholder — update when needed
+
+    data = {
+        "hours_since_onset": time_since_onset_hours,
+        "imaging_confirmed": "yes",   # Default now (because UI removed it)
+        "consent": "yes",
+        "respiratory_rate": 16,
+
+        "recent_trauma": "no",
+        "recent_stroke_or_injury": "no",
+        "intracranial_issue": "no",
+        "recent_mi": "no",
+        "anticoagulant_risk": "no",
+        "recent_surgery": "no",
+    }
+    data.update(patient_eligibility_inputs(patient, nihss_assessment))
+    return data
+
+
+def hash_eligibility_inputs(data: Dict[str, Any]) -> str:
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def apply_eligibility(scan: StrokeScan, data: Dict[str, Any], rule_set: Optional[TPARuleSet] = None) -> StrokeScan:
+    """
+    Run every criterion on data and store the inputs, their hash and the result on the scan.
+    """
+    rule_set = rule_set or get_tpa_rule_set()
+    failures = rule_set.evaluate(data)
+    _store_result(scan, data, failures, rule_set)
+    return scan
+
+
+def _store_result(scan: StrokeScan, data: Dict[str, Any], failures: list, rule_set: TPARuleSet):
+    scan.eligible, scan.eligibility_result = rule_set.summarize(failures)
+    scan.eligibility_failures = failures
+    scan.eligibility_inputs = data
+    scan.eligibility_inputs_hash = hash_eligibility_inputs(data)
+    scan.eligibility_rules_version = rule_set.version
+
+
+def reevaluate_scan(scan: StrokeScan, updates: Dict[str, Any], rule_set: Optional[TPARuleSet] = None) -> bool:
+    """
+    Merge updated inputs into the scan's stored eligibility inputs and refresh the result.
+
+    Unchanged inputs (same hash, same rule version) are skipped entirely; otherwise
+    only the criteria reading a changed field are re-run.  Returns True when the
+    stored result was refreshed.
+    """
+    if not scan.eligibility_inputs:
+        # Scans assessed before inputs were stored cannot be rebuilt faithfully
+        return False
+
+    rule_set = rule_set or get_tpa_rule_set()
+    previous = scan.eligibility_inputs
+    data = dict(previous)
+    data.update(updates)
+
+    if (scan.eligibility_rules_version == rule_set.version and
+            scan.eligibility_inputs_hash == hash_eligibility_inputs(data)):
+        return False
+
+    if scan.eligibility_rules_version != rule_set.version or scan.eligibility_failures is None:
+        failures = rule_set.evaluate(data)
+    else:
+        changed_fields = [field for field in data if previous.get(field) != data[field]]
+        failures = rule_set.reevaluate(data, scan.eligibility_failures, changed_fields)
+
+    _store_result(scan, data, failures, rule_set)
+    return True
+
+
+def reevaluate_patient_scans(db: Session, patient: Patient,
+                             nihss_assessment: Optional[NIHSSAssessment] = None) -> int:
+    """
+    Refresh eligibility on the patient's open scans after vitals or NIHSS changes.
+
+    The patient-derived inputs are rebuilt exactly as build_eligibility_data
+    builds them, so a cleared vital falls back to its default and the result
+    matches a fresh evaluation.  The caller commits.
+    """
+    updates = patient_eligibility_inputs(patient, nihss_assessment)
+
+    rule_set = get_tpa_rule_set()
+    scans = db.query(StrokeScan).filter(
+        StrokeScan.patient_id == patient.id,
+        StrokeScan.status.is_(None) | StrokeScan.status.notin_(FINAL_SCAN_STATUSES)
+    ).all()
+
+    return sum(1 for scan in scans if reevaluate_scan(scan, updates, rule_set))
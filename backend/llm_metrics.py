@@ -0,0 +1,159 @@
+import json
+import os
+import threading
+from typing import Any, Dict, Optional
+
+from prompt_builder import count_tokens
+
+# USD per 1K tokens as (prompt, completion).  Override or extend with
+# LLM_PRICES='{"gpt-4o": [0.0025, 0.01]}'.
+DEFAULT_PRICES = {
+    "gpt-3.5-turbo": (0.0005, 0.0015),
+    "gpt-4o-mini": (0.00015, 0.0006),
+    "gpt-4o": (0.0025, 0.01),
+}
+LLM_PRICES = {**DEFAULT_PRICES, **{model: tuple(price) for model, price in json.loads(os.getenv("LLM_PRICES", "{}")).items()}}
+
+# Histogram bucket upper bounds in seconds; the last bucket is open-ended
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30)
+
+
+def estimate_tokens(text: str) -> int:
+    """Local token count for when the API does not report usage."""
+    return count_tokens(text)
+
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int) -> Optional[float]:
+    prices = LLM_PRICES.get(model)
+    if prices is None:
+        return None
+    return round((prompt_tokens * prices[0] + completion_tokens * prices[1]) / 1000, 6)
+
+
+def new_usage(model: str) -> Dict[str, Any]:
+    """Usage record for one logical LLM request; filled in by ChatGPTTreatmentPlanService."""
+    return {
+        "model": model,
+        "prompt_tokens": 0,
+        "completion_tokens": 0,
+        "cost_usd": 0.0,
+        "latency_ms": None,
+        "ttft_ms": None,
+        "attempts": 0,
+        "cached": False,
+        "estimated": False,
+    }
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, seconds: float):
+        index = next((i for i, bound in enumerate(self.buckets) if seconds <= bound), len(self.buckets))
+        self.counts[index] += 1
+        self.total += 1
+        self.sum += seconds
+
+    def quantile(self, fraction: float) -> Optional[float]:
+        """Upper bound of the bucket holding the given quantile (None past the last bound)."""
+        if not self.total:
+            return None
+        rank, seen = fraction * self.total, 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return self.buckets[i] if i < len(self.buckets) else None
+        return None
+
+    def snapshot(self) -> Dict[str, Any]:
+        labels = [f"le_{bound}" for bound in self.buckets] + ["le_inf"]
+        return {
+            "count": self.total,
+            "mean_s": round(self.sum / self.total, 3) if self.total else None,
+            "p50_le_s": self.quantile(0.50),
+            "p95_le_s": self.quantile(0.95),
+            "p99_le_s": self.quantile(0.99),
+            "buckets": dict(zip(labels, self.counts)),
+        }
+
+
+class LLMMetrics:
+    """Per-operation latency histograms and token, cost, error and retry counters since startup."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._operations: Dict[str, Dict[str, Any]] = {}
+
+    def _operation(self, name: str) -> Dict[str, Any]:
+        if name not in self._operations:
+            self._operations[name] = {
+                "requests": 0,
+                "errors": 0,
+                "cache_hits": 0,
+                "retries": 0,
+                "upstream_attempts": 0,
+                "prompt_tokens": 0,
+                "completion_tokens": 0,
+                "cost_usd": 0.0,
+                "latency": Histogram(),
+                "ttft": Histogram(),
+            }
+        return self._operations[name]
+
+    def record_request(self, operation: str, usage: Dict[str, Any]):
+        with self._lock:
+            op = self._operation(operation)
+            op["requests"] += 1
+            if usage.get("cached"):
+                op["cache_hits"] += 1
+                return
+            op["upstream_attempts"] += usage.get("attempts") or 0
+            op["prompt_tokens"] += usage.get("prompt_tokens") or 0
+            op["completion_tokens"] += usage.get("completion_tokens") or 0
+            op["cost_usd"] += usage.get("cost_usd") or 0.0
+            if usage.get("latency_ms") is not None:
+                op["latency"].observe(usage["latency_ms"] / 1000)
+            if usage.get("ttft_ms") is not None:
+                op["ttft"].observe(usage["ttft_ms"] / 1000)
+
+    def record_error(self, operation: str):
+        with self._lock:
+            op = self._operation(operation)
+            op["requests"] += 1
+            op["errors"] += 1
+
+    def record_retry(self, operation: str):
+        with self._lock:
+            self._operation(operation)["retries"] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            operations = {}
+            for name, op in self._operations.items():
+                upstream = op["requests"] - op["cache_hits"] - op["errors"]
+                operations[name] = {
+                    **{key: value for key, value in op.items() if key not in ("latency", "ttft")},
+                    "cost_usd": round(op["cost_usd"], 6),
+                    "avg_prompt_tokens": round(op["prompt_tokens"] / upstream, 1) if upstream > 0 else None,
+                    "latency": op["latency"].snapshot(),
+                    "ttft": op["ttft"].snapshot(),
+                }
+            return {
+                "operations": operations,
+                "total_cost_usd": round(sum(op["cost_usd"] for op in self._operations.values()), 6),
+                "prices_per_1k_tokens": {model: list(price) for model, price in LLM_PRICES.items()},
+            }
+
+
+# Global instance - lazy loaded
+llm_metrics = None
+
+def get_llm_metrics() -> LLMMetrics:
+    global llm_metrics
+    if llm_metrics is None:
+        llm_metrics = LLMMetrics()
+    return llm_metrics
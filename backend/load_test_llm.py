@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+Load test for the AI treatment plan endpoints
+Starts mock_llm_server.py and the backend in a temporary workspace, then fires
+concurrent requests at each endpoint that calls the LLM.  With a non-blocking
+client the wall time of a burst stays close to one LLM round trip instead of
+growing with the number of requests; the streaming endpoints are measured by
+time to first token.
+
+Usage:
+    python load_test_llm.py --concurrency 20 --latency 1.0
+    python load_test_llm.py --latency-dist lognormal --jitter 0.5 --error-rate 0.02 --seed 7
+"""
+
+import argparse
+import asyncio
+import io
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_up(url: str, timeout: float = 20.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(url, timeout=1.0)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise SystemExit(f"Server at {url} did not start within {timeout:.0f}s")
+
+
+def create_workspace() -> str:
+    """Empty backend/ and uploads/ plus a copy of the frontend, so the repo's databases stay untouched."""
+    workspace = tempfile.mkdtemp(prefix="stroke-load-")
+    os.makedirs(os.path.join(workspace, "backend"))
+    os.makedirs(os.path.join(workspace, "uploads"))
+    shutil.copytree(os.path.join(BACKEND_DIR, "..", "frontend"), os.path.join(workspace, "frontend"))
+    return workspace
+
+
+def start_servers(workspace: str, latency: float, ttft: float, job_workers: int, mock_args: list = ()):
+    """
+    Mock LLM plus the backend pointed at it; returns (processes, backend_url, mock_url).
+    mock_args are extra mock_llm_server.py options, e.g. ["--error-rate", "0.05"].
+    """
+    mock_port, app_port = free_port(), free_port()
+    mock = subprocess.Popen([
+        sys.executable, os.path.join(BACKEND_DIR, "mock_llm_server.py"),
+        "--port", str(mock_port), "--latency", str(latency), "--ttft", str(ttft), *mock_args,
+    ])
+
+    env = dict(os.environ,
+               LLM_MOCK="true",
+               MOCK_LLM_URL=f"http://127.0.0.1:{mock_port}/v1",
+               PLAN_JOB_WORKERS=str(job_workers))
+    env.pop("OPENAI_BASE_URL", None)
+    backend = subprocess.Popen([
+        sys.executable, "-m", "uvicorn", "main:app", "--app-dir", BACKEND_DIR,
+        "--port", str(app_port), "--log-level", "warning",
+    ], cwd=os.path.join(workspace, "backend"), env=env)
+
+    backend_url = f"http://127.0.0.1:{app_port}"
+    mock_url = f"http://127.0.0.1:{mock_port}"
+    wait_until_up(f"{mock_url}/docs")
+    wait_until_up(f"{backend_url}/docs")
+    return [mock, backend], backend_url, mock_url
+
+
+def stop_servers(processes: list, workspace: str):
+    for process in processes:
+        process.terminate()
+        process.wait()
+    shutil.rmtree(workspace, ignore_errors=True)
+
+
+def create_scan(client: httpx.Client, code: str) -> int:
+    """Patient with vitals, NIHSS and an uploaded scan; returns the scan id."""
+    client.post("/api/patients", json={
+        "name": "Load Test", "age": 66, "gender": "Male",
+        "time_since_onset": "1 hour", "consent_confirmed": True, "code": code,
+    }).raise_for_status()
+    client.put(f"/api/patients/{code}/vitals", json={
+        "chief_complaint": "Aphasia", "systolic_bp": 150, "diastolic_bp": 85,
+        "heart_rate": 78, "oxygen_saturation": 97, "temperature": 98.6, "glucose": 130,
+        "platelet_count": 220, "inr": 1.0,
+    }).raise_for_status()
+    client.post(f"/api/patients/{code}/nihss", json={
+        "consciousness": 1, "gaze": 1, "visual": 0, "facial": 1, "motorArmLeft": 1,
+        "motorArmRight": 0, "motorLegLeft": 1, "motorLegRight": 0, "ataxia": 0, "sensory": 1,
+        "language": 2, "dysarthria": 1, "extinction": 0, "total_score": 9,
+    }).raise_for_status()
+    response = client.post("/api/upload-scan", data={"patient_code": code},
+                           files={"scan_file": ("scan.png", io.BytesIO(b"scan"), "image/png")})
+    response.raise_for_status()
+    return response.json()["scan_id"]
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    index = min(int(round(fraction * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+async def burst(base_url: str, requests: list) -> dict:
+    """Send (method, path, json) requests concurrently and time each one."""
+    async with httpx.AsyncClient(base_url=base_url, timeout=120.0,
+                                 limits=httpx.Limits(max_connections=len(requests))) as client:
+        async def timed(method, path, body):
+            start = time.perf_counter()
+            response = await client.request(method, path, json=body)
+            return time.perf_counter() - start, response
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*(timed(*request) for request in requests))
+        wall = time.perf_counter() - start
+
+    failures = [response for _, response in results if response.status_code != 200]
+    latencies = sorted(elapsed for elapsed, _ in results)
+    return {
+        "requests": len(requests),
+        "failed": len(failures),
+        "wall_s": wall,
+        "p50_s": percentile(latencies, 0.50),
+        "p95_s": percentile(latencies, 0.95),
+        "max_s": latencies[-1],
+        # Sum of per-request times over wall time: ~1 when serialized, ~N when fully overlapped
+        "overlap": sum(latencies) / wall if wall else 0,
+        "responses": [response for _, response in results],
+    }
+
+
+async def job_burst(base_url: str, requests: list) -> dict:
+    """Queue generation jobs concurrently (202 + job id), then poll each until it finishes."""
+    async with httpx.AsyncClient(base_url=base_url, timeout=120.0,
+                                 limits=httpx.Limits(max_connections=len(requests))) as client:
+        async def run_job(path, body):
+            start = time.perf_counter()
+            response = await client.post(path, json=body)
+            if response.status_code != 202:
+                return time.perf_counter() - start, None
+            status_url = response.json()["status_url"]
+            while True:
+                job = (await client.get(status_url)).json()
+                if job["status"] in ("succeeded", "failed"):
+                    return time.perf_counter() - start, job
+                await asyncio.sleep(0.1)
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*(run_job(*request) for request in requests))
+        wall = time.perf_counter() - start
+
+    latencies = sorted(elapsed for elapsed, _ in results)
+    return {
+        "requests": len(requests),
+        "failed": sum(1 for _, job in results if not job or job["status"] != "succeeded"),
+        "wall_s": wall,
+        "p50_s": percentile(latencies, 0.50),
+        "p95_s": percentile(latencies, 0.95),
+        "max_s": latencies[-1],
+        "overlap": sum(latencies) / wall if wall else 0,
+        "treatment_plan_ids": [job["treatment_plan_id"] for _, job in results
+                               if job and job["status"] == "succeeded"],
+    }
+
+
+async def stream_burst(base_url: str, requests: list) -> dict:
+    """POST to SSE endpoints concurrently; time to first token and to the final event."""
+    async with httpx.AsyncClient(base_url=base_url, timeout=120.0,
+                                 limits=httpx.Limits(max_connections=len(requests))) as client:
+        async def timed(path, body):
+            start = time.perf_counter()
+            first_token, final_event = None, None
+            async with client.stream("POST", path, json=body) as response:
+                event = None
+                async for line in response.aiter_lines():
+                    if line.startswith("event:"):
+                        event = line[len("event:"):].strip()
+                    elif line.startswith("data:"):
+                        if event is None and first_token is None:
+                            first_token = time.perf_counter() - start
+                        if event in ("done", "error"):
+                            final_event = event
+                        event = None
+            return first_token, time.perf_counter() - start, final_event
+
+        results = await asyncio.gather(*(timed(*request) for request in requests))
+
+    ttfts = sorted(ttft for ttft, _, final in results if final == "done")
+    totals = sorted(total for ttft, total, final in results if final == "done")
+    return {
+        "requests": len(requests),
+        "failed": sum(1 for _, _, final in results if final != "done"),
+        "ttft_p50_s": percentile(ttfts, 0.50) if ttfts else None,
+        "ttft_p95_s": percentile(ttfts, 0.95) if ttfts else None,
+        "ttft_max_s": ttfts[-1] if ttfts else None,
+        "total_p50_s": percentile(totals, 0.50) if totals else None,
+    }
+
+
+def print_stream_burst(name: str, result: dict):
+    print(f"\n{name}")
+    print("-" * 60)
+    print(f"requests             {result['requests']} ({result['failed']} failed)")
+    if result["ttft_p50_s"] is not None:
+        print(f"ttft p50/p95/max     {result['ttft_p50_s']:.2f} s / {result['ttft_p95_s']:.2f} s / "
+              f"{result['ttft_max_s']:.2f} s")
+        print(f"complete p50         {result['total_p50_s']:.2f} s")
+
+
+def print_burst(name: str, result: dict, latency: float):
+    print(f"\n{name}")
+    print("-" * 60)
+    print(f"requests             {result['requests']} ({result['failed']} failed)")
+    print(f"wall time            {result['wall_s']:.2f} s "
+          f"(serialized would be ~{result['requests'] * latency:.1f} s)")
+    print(f"latency p50/p95/max  {result['p50_s']:.2f} s / {result['p95_s']:.2f} s / {result['max_s']:.2f} s")
+    print(f"overlap factor       {result['overlap']:.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent load test of the AI endpoints against a mock LLM")
+    parser.add_argument("--concurrency", type=int, default=20, help="requests per burst")
+    parser.add_argument("--latency", type=float, default=1.0, help="mock LLM response time in seconds")
+    parser.add_argument("--ttft", type=float, default=0.2, help="mock LLM time to first streamed token")
+    parser.add_argument("--latency-dist", default="fixed", help="mock LLM latency distribution (see mock_llm_server.py)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="spread of the mock latency distribution")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of mock LLM calls failing with a 500")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="share of mock LLM calls throttled with a 429")
+    parser.add_argument("--seed", type=int, default=1, help="mock LLM random seed, for repeatable runs")
+    parser.add_argument("--job-workers", type=int, default=20,
+                        help="PLAN_JOB_WORKERS for the backend (caps concurrent queued generations)")
+    args = parser.parse_args()
+
+    workspace = create_workspace()
+    processes, base_url, _ = start_servers(workspace, args.latency, args.ttft, args.job_workers, [
+        "--latency-dist", args.latency_dist, "--jitter", str(args.jitter), "--error-rate", str(args.error_rate),
+        "--throttle-rate", str(args.throttle_rate), "--seed", str(args.seed),
+    ])
+    try:
+        with httpx.Client(base_url=base_url, timeout=30.0) as client:
+            scan_ids = [create_scan(client, f"LOAD{i:04d}") for i in range(args.concurrency)]
+
+        print("AI Endpoint Load Test")
+        print("=" * 60)
+        print(f"mock LLM latency {args.latency:.2f} s ({args.latency_dist}, jitter {args.jitter}), "
+              f"{args.concurrency} concurrent requests per endpoint")
+        if args.error_rate or args.throttle_rate:
+            print(f"mock LLM error rate {args.error_rate:.0%}, throttle rate {args.throttle_rate:.0%}")
+
+        result = asyncio.run(burst(base_url, [
+            ("POST", "/api/generate-treatment", {
+                "name": "Load Test", "age": 66, "nhiss_score": 9, "systolic_bp": 150,
+                "diastolic_bp": 85, "glucose": 130, "oxygen_saturation": 97,
+                "symptoms": "Aphasia and right facial droop",
+            })
+            for _ in range(args.concurrency)
+        ]))
+        print_burst("POST /api/generate-treatment", result, args.latency)
+
+        # Distinct regenerate requests so the plan cache does not answer them
+        result = asyncio.run(job_burst(base_url, [
+            ("/api/treatment-plan/generate",
+             {"patient_code": f"LOAD{i:04d}", "scan_id": scan_id, "physician_username": "loadtest",
+              "regenerate": True})
+            for i, scan_id in enumerate(scan_ids)
+        ]))
+        print_burst(f"POST /api/treatment-plan/generate + job polling ({args.job_workers} workers)",
+                    result, args.latency)
+        plan_ids = result["treatment_plan_ids"]
+
+        result = asyncio.run(burst(base_url, [
+            ("POST", f"/api/treatment-plan/{plan_id}/refine", {"physician_notes": "Add BP target < 180/105."})
+            for plan_id in plan_ids
+        ]))
+        print_burst("POST /api/treatment-plan/{id}/refine", result, args.latency)
+
+        result = asyncio.run(stream_burst(base_url, [
+            ("/api/treatment-plan/generate/stream",
+             {"patient_code": f"LOAD{i:04d}", "scan_id": scan_id, "physician_username": "loadtest",
+              "regenerate": True})
+            for i, scan_id in enumerate(scan_ids)
+        ]))
+        print_stream_burst("POST /api/treatment-plan/generate/stream", result)
+
+        result = asyncio.run(stream_burst(base_url, [
+            (f"/api/treatment-plan/{plan_id}/refine/stream", {"physician_notes": "Add BP target < 180/105."})
+            for plan_id in plan_ids
+        ]))
+        print_stream_burst("POST /api/treatment-plan/{id}/refine/stream", result)
+    finally:
+        stop_servers(processes, workspace)
+
+
+if __name__ == "__main__":
+    main()
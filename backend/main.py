@@ -6,9 +6,9 @@ from sqlalchemy.orm import Session
 from datetime import datetime
 import os
 import shutil
+import asyncio
 from dotenv import load_dotenv
-from openai import OpenAI
-from tpa_eligibility import check_tpa_eligibility
+from eligibility_service import build_eligibility_data, apply_eligibility, reevaluate_patient_scans
 
 # Load environment variables
 try:
@@ -17,23 +17,19 @@ except Exception as e:
     print(f"Warning: Could not load .env file: {e}")
     print("Continuing without .env file...")
     
-openai_api_key = os.getenv("OPENAI_API_KEY")
-if not openai_api_key:
-    print("OPENAI_API_KEY not found in environment variables!")
-
-client = OpenAI(api_key=openai_api_key)
-
 # Import database and models
-from database import Base, engine, get_db
+from database import engine, get_db
 import models  # this line ensures all models are registered
+from migrations import sync_model_schema, start_migrations
 from auth import router as auth_router
-from upload_router import router as upload_router
+from upload_router import router as upload_router, stop_bulk_plan_runs
+from chatgpt_service import close_chatgpt_service
+from dashboard_stats import get_counter_reconciler
+from plan_jobs import get_plan_worker_pool, get_pregeneration_worker_pool, pregenerate_plan
+from treatment_plan_service import plan_inputs_for_scan, discard_pregenerated_plans
 
 app = FastAPI()
 
-# ✅ Create tables after models are imported
-Base.metadata.create_all(bind=engine)
-
 # Helper function to get current user from session (imported from auth module)
 def get_current_user_from_session(request: Request):
     """Get current user from session cookie"""
@@ -92,6 +88,33 @@ app.mount("/uploads", StaticFiles(directory="../uploads"), name="uploads")
 app.include_router(auth_router)
 app.include_router(upload_router)
 
+@app.on_event("startup")
+async def prepare_database():
+    # New tables and nullable columns are metadata-only changes the code needs at once;
+    # versioned migrations (index builds, backfills) run as configured by MIGRATIONS_ON_STARTUP
+    await asyncio.to_thread(sync_model_schema, engine)
+    await asyncio.to_thread(start_migrations, engine)
+
+@app.on_event("startup")
+async def start_counter_reconciler():
+    # Recount the dashboard counters now (filling them on first start) and then periodically
+    get_counter_reconciler().start()
+
+@app.on_event("startup")
+async def start_plan_workers():
+    # Start the treatment plan job workers and resume jobs left unfinished by a restart
+    get_plan_worker_pool().start()
+    get_pregeneration_worker_pool().start()
+
+@app.on_event("shutdown")
+async def shutdown_llm_client():
+    await get_plan_worker_pool().stop()
+    await get_pregeneration_worker_pool().stop()
+    await stop_bulk_plan_runs()
+    await get_counter_reconciler().stop()
+    # Release the pooled keep-alive connections to the OpenAI API
+    await close_chatgpt_service()
+
 # ---------- Frontend Page Routes ----------
 @app.get("/")
 def serve_home():
@@ -276,13 +299,19 @@ def update_patient_vitals(patient_code: str, vitals_data: PatientVitalsUpdate, d
         patient.glucose = vitals_data.glucose
         patient.platelet_count = vitals_data.platelet_count
         patient.inr = vitals_data.inr
+
+        # Keep stored eligibility of open scans in line with the corrected vitals
+        reevaluated_scans = reevaluate_patient_scans(db, patient)
+        # Speculative treatment plan drafts were written for the old vitals
+        discard_pregenerated_plans(db, patient_id=patient.id)
         
         db.commit()
         db.refresh(patient)
         
         return {
             "message": "Patient vitals updated successfully",
-            "patient_code": patient.code
+            "patient_code": patient.code,
+            "reevaluated_scans": reevaluated_scans
         }
         
     except HTTPException:
@@ -320,6 +349,8 @@ def save_nihss_assessment(patient_code: str, nihss_data: NIHSSAssessment, db: Se
         )
         
         db.add(nihss_assessment)
+        reevaluated_scans = reevaluate_patient_scans(db, patient, nihss_assessment)
+        discard_pregenerated_plans(db, patient_id=patient.id)
         db.commit()
         db.refresh(nihss_assessment)
         
@@ -327,7 +358,8 @@ def save_nihss_assessment(patient_code: str, nihss_data: NIHSSAssessment, db: Se
             "message": "NIHSS assessment saved successfully",
             "patient_code": patient.code,
             "nihss_id": nihss_assessment.id,
-            "total_score": nihss_assessment.total_score
+            "total_score": nihss_assessment.total_score,
+            "reevaluated_scans": reevaluated_scans
         }
         
     except HTTPException:
@@ -416,56 +448,31 @@ async def upload_scan_and_check_eligibility(
             shutil.copyfileobj(scan_file.file, buffer)
 
         # 4. Prepare data for tPA eligibility check
-        time_since_onset_hours = 2.0  # Placeholder — update when needed
+        eligibility_data = build_eligibility_data(patient, nihss_assessment)
 
-        eligibility_data = {
-            "age": patient.age,
-            "hours_since_onset": time_since_onset_hours,
-            "imaging_confirmed": "yes",   # Default now (because UI removed it)
-            "consent": "yes",
-
-            "nhiss_score": nihss_assessment.total_score,
-            "inr": patient.inr or 1.0,
-            "heart_rate": patient.heart_rate or 80,
-            "respiratory_rate": 16,
-            "temperature": patient.temperature or 98.6,
-            "oxygen_saturation": patient.oxygen_saturation or 98,
-
-            "recent_trauma": "no",
-            "recent_stroke_or_injury": "no",
-            "intracranial_issue": "no",
-            "recent_mi": "no",
-
-            "systolic_bp": patient.systolic_bp or 120,
-            "diastolic_bp": patient.diastolic_bp or 80,
-            "glucose": patient.glucose or 100,
-            "anticoagulant_risk": "no",
-            "platelet_count": patient.platelet_count or 250,
-            "recent_surgery": "no",
-        }
-
-        # 5. Run tPA eligibility logic
-        is_eligible, reason = check_tpa_eligibility(eligibility_data)
-
-        # 6. Save scan record in database
+        # 5. Save scan record and run tPA eligibility logic
+        #    (every criterion, so all failures are reported at once)
         stroke_scan = models.StrokeScan(
             patient_id=patient.id,
             image_path=file_path,
             prediction="Ischemic Stroke",      # since imaging_confirmed is removed
             timestamp=datetime.now(),
-            doctor_comment="Scan uploaded",    # no scan_type/imaging_confirmed anymore
-            eligibility_result=reason,
-            eligible=is_eligible
+            doctor_comment="Scan uploaded"     # no scan_type/imaging_confirmed anymore
         )
+        apply_eligibility(stroke_scan, eligibility_data)
+        is_eligible = stroke_scan.eligible
+        reason = stroke_scan.eligibility_result
+        eligibility_failures = stroke_scan.eligibility_failures
 
         db.add(stroke_scan)
         db.commit()
         db.refresh(stroke_scan)
 
-        # 7. Return response to frontend
+        # 6. Return response to frontend
         return {
             "eligible": is_eligible,
             "reason": reason,
+            "failures": eligibility_failures,
             "scan_id": stroke_scan.id,
             "patient_code": patient.code,
             "message": "Scan uploaded and tPA eligibility assessed successfully"
@@ -553,12 +560,21 @@ async def send_to_doctor(
             # Update the scan with technician notes and mark as ready for review
             latest_scan.technician_notes = technician_notes
             latest_scan.status = "ready_for_review"
+            patient_id, scan_id = patient.id, latest_scan.id
+            patient_data, scan_data = plan_inputs_for_scan(patient, latest_scan)
             db.commit()
+
+            # Draft a treatment plan in the background so it is waiting when the physician opens the case
+            try:
+                pregenerate_plan(db, patient_id, scan_id, patient_data, scan_data)
+            except Exception as e:
+                db.rollback()
+                print(f"Could not start treatment plan pre-generation for scan {scan_id}: {e}")
             
             return {
                 "message": "Case sent to doctor successfully",
                 "patient_code": patient_code,
-                "scan_id": latest_scan.id,
+                "scan_id": scan_id,
                 "status": "ready_for_review"
             }
         else:
@@ -617,6 +633,8 @@ def get_patient_scans(patient_code: str, db: Session = Depends(get_db)):
                 "doctor_comment": scan.doctor_comment,
                 "eligibility_result": scan.eligibility_result,
                 "eligible": scan.eligible,
+                "eligibility_failures": scan.eligibility_failures or [],
+                "eligibility_rules_version": scan.eligibility_rules_version,
                 "technician_notes": scan.technician_notes,
                 "status": scan.status
             })
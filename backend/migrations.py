@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+"""
+Online schema migrations
+Schema changes never drop data and never hold a table for long:
+
+1. Additive changes (new model tables, new nullable columns) are applied by
+   sync_model_schema at startup.  Both are metadata-only, so they are instant
+   even on tables with millions of rows.
+2. Everything else is a versioned migration, run once per database and
+   recorded in schema_migrations.  Indexes are built CONCURRENTLY on
+   PostgreSQL, and backfills update rows in primary-key batches, each in its
+   own short transaction, so the table stays writable throughout.
+
+Versioned migrations run while the app is serving (MIGRATIONS_ON_STARTUP,
+"background" by default), so each must leave the schema usable by the
+current code both before and after it runs.
+
+Usage:
+    python migrations.py              # apply pending migrations
+    python migrations.py --dry-run    # list pending changes and estimated rows touched
+    python migrations.py --status
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, func, inspect, select, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.schema import CreateIndex
+
+# Add the backend directory to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from database import Base, engine, add_missing_columns
+import models  # registers the model tables and their indexes on Base.metadata
+
+# Rows updated per backfill transaction, and the pause between them that lets queued writers in
+MIGRATION_BATCH_SIZE = int(os.getenv("MIGRATION_BATCH_SIZE", "5000"))
+MIGRATION_BATCH_PAUSE_SECONDS = float(os.getenv("MIGRATION_BATCH_PAUSE_SECONDS", "0.05"))
+# "background" (run after startup while serving), "blocking" (before serving) or "off"
+MIGRATIONS_ON_STARTUP = os.getenv("MIGRATIONS_ON_STARTUP", "background").lower()
+
+# PostgreSQL advisory lock held while migrating, so app workers starting together take turns
+MIGRATION_LOCK_ID = 4_721_001
+
+migrations_metadata = MetaData()
+schema_migrations = Table(
+    "schema_migrations", migrations_metadata,
+    Column("version", Integer, primary_key=True),
+    Column("name", String, nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+    Column("rows_touched", Integer),
+)
+
+
+def model_index(name: str):
+    """The Index declared in models.py under this name."""
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            if index.name == name:
+                return index
+    raise KeyError(f"No index named {name} in models.py")
+
+
+def estimated_rows(bind, table_name: str) -> int:
+    """Row count of a table; PostgreSQL's planner estimate when it has one, to avoid a full count."""
+    with bind.connect() as conn:
+        if bind.dialect.name == "postgresql":
+            estimate = conn.execute(text("SELECT reltuples FROM pg_class WHERE relname = :name"),
+                                    {"name": table_name}).scalar()
+            if estimate is not None and estimate >= 0:
+                return int(estimate)
+        return conn.execute(text(f"SELECT COUNT(*) FROM {table_name}")).scalar()
+
+
+# -----------------------------
+# ADDITIVE SCHEMA SYNC
+# -----------------------------
+def missing_schema(bind):
+    """(tables, "table.column" names) in models.py that the database does not have yet."""
+    inspector = inspect(bind)
+    tables, columns = [], []
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            tables.append(table.name)
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        columns += [f"{table.name}.{column.name}" for column in table.columns if column.name not in existing]
+    return tables, columns
+
+
+def sync_model_schema(bind=engine):
+    """Create missing tables (with their indexes) and add missing columns as nullable."""
+    Base.metadata.create_all(bind=bind)
+    add_missing_columns(bind)
+
+
+# -----------------------------
+# MIGRATION STEPS
+# -----------------------------
+def invalid_postgresql_indexes(bind) -> set:
+    """Indexes left unusable by an interrupted CREATE INDEX CONCURRENTLY."""
+    if bind.dialect.name != "postgresql":
+        return set()
+    with bind.connect() as conn:
+        return set(conn.execute(text(
+            "SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE NOT i.indisvalid"
+        )).scalars())
+
+
+class CreateIndexes:
+    """
+    Create model indexes that do not exist yet.  PostgreSQL builds them
+    CONCURRENTLY, outside a transaction, so writes continue meanwhile.
+    SQLite has no concurrent build: writers wait (up to busy_timeout) while
+    each index is built, which takes seconds per million rows.
+    """
+
+    def __init__(self, *names):
+        self.names = names
+
+    def _missing(self, bind):
+        inspector = inspect(bind)
+        invalid = invalid_postgresql_indexes(bind)
+        for name in self.names:
+            index = model_index(name)
+            # A missing table gets its indexes from sync_model_schema when it is created
+            if inspector.has_table(index.table.name) and (name in invalid or name not in {
+                    existing["name"] for existing in inspector.get_indexes(index.table.name)}):
+                yield index
+
+    def plan(self, bind):
+        return [(f"create index {index.name} on {index.table.name}", estimated_rows(bind, index.table.name))
+                for index in self._missing(bind)]
+
+    def apply(self, bind) -> int:
+        rows = 0
+        for index in list(self._missing(bind)):
+            rows += estimated_rows(bind, index.table.name)
+            statement = CreateIndex(index, if_not_exists=True).compile(dialect=bind.dialect).string
+            if bind.dialect.name == "postgresql":
+                statement = statement.replace("CREATE INDEX", "CREATE INDEX CONCURRENTLY", 1)
+                with bind.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                    conn.exec_driver_sql(f"DROP INDEX CONCURRENTLY IF EXISTS {index.name}")  # only if invalid
+                    conn.exec_driver_sql(statement)
+            else:
+                with bind.begin() as conn:
+                    conn.exec_driver_sql(statement)
+        return rows
+
+
+class Backfill:
+    """
+    Fill NULLs of a column (typically one just added by sync_model_schema)
+    with a value, one primary-key batch per transaction.  Rows already
+    filled no longer match, so an interrupted backfill simply resumes.
+    """
+
+    def __init__(self, model, column: str, value):
+        self.table = model.__table__
+        self.column = self.table.c[column]
+        self.value = value
+
+    def plan(self, bind):
+        inspector = inspect(bind)
+        if not inspector.has_table(self.table.name):
+            return []
+        if self.column.name not in {column["name"] for column in inspector.get_columns(self.table.name)}:
+            rows = estimated_rows(bind, self.table.name)  # the column is not added yet: every row is NULL
+        else:
+            with bind.connect() as conn:
+                rows = conn.execute(select(func.count()).select_from(self.table).where(self.column.is_(None))).scalar()
+        return [(f"backfill {self.table.name}.{self.column.name} = {self.value!r} where NULL", rows)] if rows else []
+
+    def apply(self, bind, batch_size: int = None) -> int:
+        batch_size = batch_size or MIGRATION_BATCH_SIZE
+        key = self.table.primary_key.columns.values()[0]
+        total, last = 0, None
+        while True:
+            with bind.begin() as conn:
+                batch = select(key).where(self.column.is_(None)).order_by(key).limit(batch_size)
+                if last is not None:
+                    batch = batch.where(key > last)
+                ids = conn.execute(batch).scalars().all()
+                if not ids:
+                    return total
+                conn.execute(self.table.update().where(key.in_(ids)).values({self.column: self.value}))
+            total += len(ids)
+            last = ids[-1]
+            time.sleep(MIGRATION_BATCH_PAUSE_SECONDS)
+
+
+# -----------------------------
+# MIGRATIONS
+# -----------------------------
+# (version, name, steps) in the order they run; never renumber or edit an applied one
+MIGRATIONS = [
+    (1, "hot query indexes", [
+        CreateIndexes(
+            "ix_patients_linked_user_id",
+            "ix_strokescans_patient_id_timestamp",
+            "ix_strokescans_status_timestamp",
+            "ix_strokescans_eligible",
+            "ix_strokescans_timestamp",
+            "ix_nihssassessments_patient_id_timestamp",
+            "ix_treatmentplans_patient_id_created_at",
+            "ix_treatmentplans_scan_id",
+            "ix_treatmentplanjobs_scan_id_status",
+        ),
+    ]),
+    # Columns added by sync_model_schema start out NULL on existing rows
+    (2, "defaults for plan source and job flags", [
+        Backfill(models.TreatmentPlan, "source", "physician"),
+        Backfill(models.TreatmentPlanJob, "speculative", False),
+        Backfill(models.TreatmentPlanJob, "regenerate", False),
+        CreateIndexes("ix_treatmentplanjobs_speculative"),  # add_missing_columns adds the column only
+    ]),
+]
+
+
+@contextmanager
+def migration_lock(bind):
+    if bind.dialect.name != "postgresql":
+        yield
+        return
+    with bind.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("SELECT pg_advisory_lock(:id)"), {"id": MIGRATION_LOCK_ID})
+        try:
+            yield
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": MIGRATION_LOCK_ID})
+
+
+def applied_versions(bind=engine) -> set:
+    migrations_metadata.create_all(bind)
+    add_missing_columns(bind, migrations_metadata)
+    with bind.connect() as conn:
+        return set(conn.execute(select(schema_migrations.c.version)).scalars())
+
+
+def pending_changes(bind=engine) -> list:
+    """Dry run: (version or None for the schema sync, name, [(change, estimated rows)]) still to apply."""
+    tables, columns = missing_schema(bind)
+    changes = []
+    if tables or columns:
+        changes.append((None, "model schema sync",
+                        [(f"create table {name}", 0) for name in tables] +
+                        [(f"add nullable column {name}", 0) for name in columns]))
+    done = set()
+    if inspect(bind).has_table("schema_migrations"):
+        with bind.connect() as conn:
+            done = set(conn.execute(select(schema_migrations.c.version)).scalars())
+    for version, name, steps in MIGRATIONS:
+        if version not in done:
+            # Steps of a pending migration are estimated against the current data, before earlier steps run
+            changes.append((version, name, [change for step in steps for change in step.plan(bind)]))
+    return changes
+
+
+def run_migrations(bind=engine) -> list:
+    """Apply pending versioned migrations in order; returns the versions applied."""
+    applied = []
+    with migration_lock(bind):
+        done = applied_versions(bind)
+        for version, name, steps in MIGRATIONS:
+            if version in done:
+                continue
+            started = time.perf_counter()
+            rows = sum(step.apply(bind) for step in steps)
+            try:
+                with bind.begin() as conn:
+                    conn.execute(schema_migrations.insert().values(
+                        version=version, name=name, applied_at=datetime.now(), rows_touched=rows))
+            except IntegrityError:
+                pass  # another app worker applied it at the same time; steps are idempotent
+            print(f"Migration {version} ({name}): {rows} rows in {time.perf_counter() - started:.1f}s")
+            applied.append(version)
+    return applied
+
+
+# Startup migrations: "idle" → "running" → "done" | "failed"
+migration_state = {"status": "idle", "applied": [], "error": None}
+
+
+def _run_startup_migrations(bind):
+    migration_state["status"] = "running"
+    try:
+        migration_state["applied"] = run_migrations(bind)
+        migration_state["status"] = "done"
+    except Exception as e:
+        migration_state.update(status="failed", error=str(e))
+        print(f"Warning: schema migrations failed: {e}")
+
+
+def start_migrations(bind=engine):
+    """Apply pending migrations as configured by MIGRATIONS_ON_STARTUP."""
+    if MIGRATIONS_ON_STARTUP == "off":
+        return
+    if MIGRATIONS_ON_STARTUP == "blocking":
+        _run_startup_migrations(bind)
+        return
+    threading.Thread(target=_run_startup_migrations, args=(bind,), name="schema-migrations", daemon=True).start()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply or list schema migrations")
+    parser.add_argument("--dry-run", action="store_true", help="list pending changes and estimated rows touched")
+    parser.add_argument("--status", action="store_true", help="list migrations without applying any")
+    args = parser.parse_args()
+
+    if args.dry_run:
+        changes = pending_changes(engine)
+        for version, name, steps in changes:
+            print(f"{'schema' if version is None else f'{version:>6}'}  {name}")
+            for description, rows in steps or [("nothing to change", 0)]:
+                print(f"          {description}  (~{rows:,} rows)")
+        total = sum(rows for _, _, steps in changes for _, rows in steps)
+        print(f"{len(changes)} pending, ~{total:,} rows touched" if changes else "Schema is up to date")
+        return
+
+    if not args.status:
+        sync_model_schema(engine)
+        run_migrations(engine)
+
+    done = applied_versions(engine)
+    for version, name, _ in MIGRATIONS:
+        print(f"{'applied' if version in done else 'pending':<8} {version:>4}  {name}")
+
+
+if __name__ == "__main__":
+    main()
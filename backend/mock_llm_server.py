@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the OpenAI chat completions API
+Answers POST /v1/chat/completions so the backend can be load tested without
+network access or API cost.  Response times are drawn from a configurable
+distribution, a share of requests can fail with 500s or be throttled with 429s,
+and requests with "stream": true get server-sent chunks: the first token after
+--ttft seconds, the rest spread evenly over the remaining response time.
+
+GET /mock/stats counts what was served; GET and PUT /mock/config read and
+change the settings while the server runs.  Pass --seed for repeatable runs.
+
+Usage:
+    python mock_llm_server.py --port 8765 --latency 1.0 --ttft 0.2
+    python mock_llm_server.py --latency-dist lognormal --latency 1.0 --jitter 0.5 \
+        --error-rate 0.02 --throttle-rate 0.05 --max-rpm 600 --seed 42
+    LLM_MOCK=true uvicorn main:app
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from collections import deque
+
+import uvicorn
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse, StreamingResponse
+
+LATENCY_DISTRIBUTIONS = ("fixed", "uniform", "normal", "lognormal", "exponential")
+
+app = FastAPI()
+app.state.config = {
+    "latency": 1.0,          # median seconds per complete response
+    "latency_dist": "fixed",
+    "jitter": 0.0,           # spread: +/- range (uniform), sigma in seconds (normal), sigma of log (lognormal)
+    "ttft": 0.2,             # seconds before the first streamed token
+    "error_rate": 0.0,       # share of requests answered with a 500
+    "throttle_rate": 0.0,    # share of requests answered with a 429
+    "max_rpm": 0,            # 429 once more requests than this arrive within a minute (0 = no limit)
+    "max_concurrent": 0,     # 429 while this many requests are in flight (0 = no limit)
+    "retry_after": 1,        # Retry-After seconds sent with 429s
+}
+app.state.random = random.Random()
+app.state.recent = deque()
+app.state.in_flight = 0
+app.state.stats = {"completions": 0, "streamed": 0, "errors": 0, "throttled": 0}
+
+MOCK_PLAN = (
+    "1. Immediate interventions: maintain airway, continuous cardiac monitoring, "
+    "neurological checks every 15 minutes.\n"
+    "2. Blood pressure: keep below 180/105 mmHg for the first 24 hours.\n"
+    "3. Monitoring: repeat CT if neurological status worsens; glucose 140-180 mg/dL.\n"
+    "4. Secondary prevention: antiplatelet therapy, high-intensity statin, "
+    "screen for atrial fibrillation.\n"
+    "5. Rehabilitation: swallow screen before oral intake, early mobilisation, "
+    "physiotherapy and speech therapy referral.\n"
+    "6. Follow-up: stroke clinic review within 2 weeks of discharge."
+)
+
+
+def mock_tokens(text: str):
+    """Split text into word-sized tokens that concatenate back to the original."""
+    tokens, current = [], ""
+    for char in text:
+        current += char
+        if char in " \n":
+            tokens.append(current)
+            current = ""
+    if current:
+        tokens.append(current)
+    return tokens
+
+
+def sample_latency(config: dict, rng: random.Random) -> float:
+    """One response time in seconds from the configured distribution."""
+    median, jitter, dist = config["latency"], config["jitter"], config["latency_dist"]
+    if dist == "uniform":
+        value = rng.uniform(median - jitter, median + jitter)
+    elif dist == "normal":
+        value = rng.gauss(median, jitter)
+    elif dist == "lognormal":
+        # Median stays at --latency; the tail grows with jitter (sigma of the underlying normal)
+        value = median * rng.lognormvariate(0, jitter)
+    elif dist == "exponential":
+        value = rng.expovariate(1 / median) if median > 0 else 0
+    else:
+        value = median
+    return max(value, 0.0)
+
+
+def error_response(status_code: int, message: str, error_type: str, headers: dict = None) -> JSONResponse:
+    """Error body in the shape the OpenAI API uses."""
+    return JSONResponse(
+        status_code=status_code,
+        content={"error": {"message": message, "type": error_type, "param": None, "code": error_type}},
+        headers=headers,
+    )
+
+
+def throttled(config: dict) -> bool:
+    now = time.monotonic()
+    recent = app.state.recent
+    while recent and now - recent[0] > 60:
+        recent.popleft()
+    recent.append(now)
+    if config["max_rpm"] and len(recent) > config["max_rpm"]:
+        return True
+    if config["max_concurrent"] and app.state.in_flight >= config["max_concurrent"]:
+        return True
+    return app.state.random.random() < config["throttle_rate"]
+
+
+def mock_usage(request: dict, content: str) -> dict:
+    """Word counts stand in for token counts."""
+    prompt_tokens = sum(len(message.get("content", "").split()) for message in request.get("messages", []))
+    completion_tokens = len(content.split())
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+
+
+async def stream_completion(completion_id: str, model: str, latency: float, ttft: float, usage: dict = None):
+    tokens = mock_tokens(MOCK_PLAN)
+    gap = max(latency - ttft, 0) / max(len(tokens) - 1, 1)
+
+    def chunk(delta: dict, finish_reason=None) -> str:
+        return "data: " + json.dumps({
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }) + "\n\n"
+
+    def usage_chunk() -> str:
+        # Sent last, with no choices, when the request asked for stream_options.include_usage
+        return "data: " + json.dumps({
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [],
+            "usage": usage,
+        }) + "\n\n"
+
+    app.state.in_flight += 1
+    try:
+        await asyncio.sleep(ttft)
+        yield chunk({"role": "assistant", "content": ""})
+        for i, token in enumerate(tokens):
+            if i:
+                await asyncio.sleep(gap)
+            yield chunk({"content": token})
+        yield chunk({}, finish_reason="stop")
+        if usage:
+            yield usage_chunk()
+        yield "data: [DONE]\n\n"
+    finally:
+        app.state.in_flight -= 1
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: dict):
+    config = app.state.config
+    stats = app.state.stats
+    stats["completions"] += 1
+
+    if throttled(config):
+        stats["throttled"] += 1
+        return error_response(429, "Rate limit reached for requests", "rate_limit_exceeded",
+                              headers={"Retry-After": str(config["retry_after"])})
+
+    latency = sample_latency(config, app.state.random)
+    if app.state.random.random() < config["error_rate"]:
+        stats["errors"] += 1
+        # Real outages tend to fail after part of the usual wait rather than instantly
+        await asyncio.sleep(latency * app.state.random.random())
+        return error_response(500, "The server had an error while processing your request", "server_error")
+
+    completion_id = f"chatcmpl-mock-{uuid.uuid4().hex[:12]}"
+    model = request.get("model", "mock")
+    if request.get("stream"):
+        stats["streamed"] += 1
+        ttft = min(config["ttft"], latency)
+        usage = mock_usage(request, MOCK_PLAN) if (request.get("stream_options") or {}).get("include_usage") else None
+        return StreamingResponse(stream_completion(completion_id, model, latency, ttft, usage),
+                                 media_type="text/event-stream")
+
+    app.state.in_flight += 1
+    try:
+        await asyncio.sleep(latency)
+    finally:
+        app.state.in_flight -= 1
+
+    content = MOCK_PLAN
+    return {
+        "id": completion_id,
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }
+        ],
+        "usage": mock_usage(request, content),
+    }
+
+
+@app.get("/mock/stats")
+def mock_stats():
+    return {**app.state.stats, "in_flight": app.state.in_flight}
+
+
+@app.get("/mock/config")
+def get_mock_config():
+    return app.state.config
+
+
+@app.put("/mock/config")
+def update_mock_config(changes: dict):
+    """Change settings between load test phases; unknown keys are rejected."""
+    unknown = set(changes) - set(app.state.config)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown settings: {', '.join(sorted(unknown))}")
+    if changes.get("latency_dist", "fixed") not in LATENCY_DISTRIBUTIONS:
+        raise HTTPException(status_code=400, detail=f"latency_dist must be one of {', '.join(LATENCY_DISTRIBUTIONS)}")
+    app.state.config.update(changes)
+    return app.state.config
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock OpenAI chat completions server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=1.0, help="median seconds per complete response")
+    parser.add_argument("--latency-dist", choices=LATENCY_DISTRIBUTIONS, default="fixed",
+                        help="distribution response times are drawn from")
+    parser.add_argument("--jitter", type=float, default=0.0,
+                        help="spread: +/- range (uniform), sigma in seconds (normal), log-sigma (lognormal)")
+    parser.add_argument("--ttft", type=float, default=0.2, help="seconds before the first streamed token")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests failing with a 500")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="share of requests throttled with a 429")
+    parser.add_argument("--max-rpm", type=int, default=0, help="requests per minute before 429s (0 = no limit)")
+    parser.add_argument("--max-concurrent", type=int, default=0,
+                        help="requests in flight before 429s (0 = no limit)")
+    parser.add_argument("--seed", type=int, default=None, help="seed for repeatable latencies and failures")
+    args = parser.parse_args()
+
+    app.state.config.update({
+        "latency": args.latency,
+        "latency_dist": args.latency_dist,
+        "jitter": args.jitter,
+        "ttft": args.ttft,
+        "error_rate": args.error_rate,
+        "throttle_rate": args.throttle_rate,
+        "max_rpm": args.max_rpm,
+        "max_concurrent": args.max_concurrent,
+    })
+    app.state.random.seed(args.seed)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
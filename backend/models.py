@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, ForeignKey, JSON, Index
 from sqlalchemy.orm import relationship
 from database import Base
 
@@ -45,6 +45,11 @@ class Patient(Base):
     # Relationship to scans
     scans = relationship("StrokeScan", back_populates="patient")
 
+    # Secondary indexes are created on existing databases by migrations.py
+    __table_args__ = (
+        Index("ix_patients_linked_user_id", "linked_user_id"),
+    )
+
 
 # -----------------------------
 # STROKE SCAN
@@ -61,6 +66,10 @@ class StrokeScan(Base):
     doctor_comment = Column(String)  # physician written comment
     eligibility_result = Column(String)  # detailed explanation for tPA eligibility
     eligible = Column(Boolean)  # True or False for tPA eligibility
+    eligibility_failures = Column(JSON)  # every failing tPA criterion (see evaluate_tpa_criteria)
+    eligibility_rules_version = Column(String)  # version of tpa_rules.json used for the assessment
+    eligibility_inputs = Column(JSON)  # inputs the assessment ran on, for incremental re-evaluation
+    eligibility_inputs_hash = Column(String)  # sha256 of eligibility_inputs; unchanged inputs are skipped
 
     technician_notes = Column(String)
     status = Column(String, default="pending")  
@@ -73,6 +82,13 @@ class StrokeScan(Base):
     # Relationship to treatment plan
     treatment_plan = relationship("TreatmentPlan", back_populates="scan", uselist=False)
 
+    __table_args__ = (
+        Index("ix_strokescans_patient_id_timestamp", "patient_id", "timestamp"),  # a patient's scans, newest first
+        Index("ix_strokescans_status_timestamp", "status", "timestamp"),  # review queues and "reviewed today"
+        Index("ix_strokescans_eligible", "eligible"),
+        Index("ix_strokescans_timestamp", "timestamp"),  # recent activity on the dashboard
+    )
+
 
 # -----------------------------
 # NIHSS ASSESSMENT
@@ -101,6 +117,10 @@ class NIHSSAssessment(Base):
 
     patient = relationship("Patient")
 
+    __table_args__ = (
+        Index("ix_nihssassessments_patient_id_timestamp", "patient_id", "timestamp"),  # latest assessment
+    )
+
 
 # -----------------------------
 # TREATMENT PLAN (NEW UPDATED)
@@ -129,6 +149,71 @@ class TreatmentPlan(Base):
     created_at = Column(DateTime)
     updated_at = Column(DateTime)
 
+    source = Column(String, default="physician")  # "physician", "speculative" (pre-generated), "bulk", "rules" (template fallback) or "retrieved" (copied from a similar approved plan)
+    inputs_hash = Column(String)          # sha256 of the prompt inputs the plan was generated from
+    pregeneration_outcome = Column(String)
+    # speculative drafts only: waiting → used (claimed by a physician) | discarded
+
+    # LLM usage; tokens and cost include later refinements
+    llm_model = Column(String)
+    prompt_tokens = Column(Integer)
+    completion_tokens = Column(Integer)
+    llm_cost_usd = Column(Float)
+    llm_latency_ms = Column(Float)        # upstream time of the generation (0 when served from the cache)
+    llm_ttft_ms = Column(Float)           # time to first token, streamed generations only
+    llm_attempts = Column(Integer)        # upstream requests made, including retries and hedges
+
     # Relationships
     patient = relationship("Patient")
     scan = relationship("StrokeScan", back_populates="treatment_plan")
+
+    __table_args__ = (
+        Index("ix_treatmentplans_patient_id_created_at", "patient_id", "created_at"),
+        Index("ix_treatmentplans_scan_id", "scan_id"),
+    )
+
+
+# -----------------------------
+# TREATMENT PLAN GENERATION JOB
+# -----------------------------
+class TreatmentPlanJob(Base):
+    __tablename__ = "treatmentplanjobs"
+    id = Column(String, primary_key=True)  # uuid4 hex, returned to the client for polling
+
+    patient_id = Column(Integer, ForeignKey("patients.id"))
+    scan_id = Column(Integer, ForeignKey("strokescans.id"))
+    requested_by = Column(String)         # physician username
+    regenerate = Column(Boolean, default=False)  # bypass the plan cache
+    speculative = Column(Boolean, default=False, index=True)  # pre-generation started by send-to-doctor
+    inputs_hash = Column(String)          # prompt inputs at enqueue time; a mismatch cancels speculative jobs
+
+    status = Column(String, default="queued", index=True)
+    # queued → waiting for a worker
+    # running → a worker is generating the plan
+    # succeeded → treatment_plan_id is set
+    # failed → error explains why (after all attempts)
+    # cancelled → speculative job whose case changed before it finished
+    progress = Column(String)             # current step, shown while polling
+    attempts = Column(Integer, default=0)
+    error = Column(String)
+
+    treatment_plan_id = Column(Integer, ForeignKey("treatmentplans.id"), nullable=True)
+
+    created_at = Column(DateTime)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+
+    __table_args__ = (
+        Index("ix_treatmentplanjobs_scan_id_status", "scan_id", "status"),  # in-flight job for a scan
+    )
+
+
+# -----------------------------
+# DASHBOARD COUNTERS
+# -----------------------------
+class DashboardCounter(Base):
+    __tablename__ = "dashboardcounters"
+    name = Column(String, primary_key=True)  # e.g. "scans", "status:reviewed", "scans_day:2025-01-31"
+    value = Column(Integer, nullable=False, default=0)
+    # Maintained by dashboard_stats.py on every flush that adds or changes
+    # patients and scans, and recounted periodically from the tables
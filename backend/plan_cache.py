@@ -0,0 +1,212 @@
+import asyncio
+import hashlib
+import json
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from sqlalchemy import create_engine, select, delete, MetaData, Table, Column, String, Text, Float
+
+PLAN_CACHE_URL = os.getenv("PLAN_CACHE_URL", "sqlite:///plan_cache.db")
+PLAN_CACHE_TTL_SECONDS = float(os.getenv("PLAN_CACHE_TTL_SECONDS", str(24 * 3600)))
+PLAN_CACHE_MAX_ENTRIES = int(os.getenv("PLAN_CACHE_MAX_ENTRIES", "512"))
+
+# Vitals are rounded down to these bucket widths before keying, so patients with
+# near-identical values share a plan.  0 keys on the exact value.  Override with
+# PLAN_CACHE_BUCKETS='{"glucose": 20, "age": 0}'.
+DEFAULT_BUCKETS = {
+    "age": 1,
+    "systolic_bp": 5,
+    "diastolic_bp": 5,
+    "heart_rate": 5,
+    "temperature": 0.2,
+    "oxygen_saturation": 1,
+    "glucose": 10,
+    "inr": 0.1,
+}
+PLAN_CACHE_BUCKETS = {**DEFAULT_BUCKETS, **json.loads(os.getenv("PLAN_CACHE_BUCKETS", "{}"))}
+
+# Free-text inputs compared case- and whitespace-insensitively
+TEXT_FIELDS = ("gender", "chief_complaint", "time_since_onset")
+
+cache_metadata = MetaData()
+plan_cache_entries = Table(
+    "plan_cache", cache_metadata,
+    Column("key", String(64), primary_key=True),
+    Column("plan", Text, nullable=False),
+    Column("generation_ms", Float),
+    Column("created_at", Float, index=True),
+)
+
+
+def _bucket(value, width):
+    if value is None or not width:
+        return value
+    # The epsilon keeps exact multiples (e.g. 0.3 / 0.1) from landing one bucket low
+    return round(math.floor(float(value) / width + 1e-9) * width, 6)
+
+
+def _normalize_text(value):
+    if value is None:
+        return None
+    return " ".join(str(value).lower().split()) or None
+
+
+def normalize_plan_inputs(patient_data: Dict[str, Any], scan_data: Dict[str, Any],
+                          eligibility_result: str, is_eligible: bool,
+                          buckets: Optional[Dict[str, float]] = None) -> Dict[str, Any]:
+    """
+    The clinically relevant prompt inputs in canonical form.
+    The patient name and any other identifying field is deliberately left out.
+    """
+    buckets = PLAN_CACHE_BUCKETS if buckets is None else buckets
+    normalized = {field: _bucket(patient_data.get(field), width) for field, width in buckets.items()}
+    for field in TEXT_FIELDS:
+        normalized[field] = _normalize_text(patient_data.get(field))
+    normalized.update({
+        "eligible": bool(is_eligible),
+        "eligibility_result": _normalize_text(eligibility_result),
+        "prediction": _normalize_text(scan_data.get("prediction")),
+        "imaging_confirmed": _normalize_text(scan_data.get("imaging_confirmed")),
+    })
+    return normalized
+
+
+def plan_cache_key(normalized_inputs: Dict[str, Any], settings: Dict[str, Any]) -> str:
+    """Hash of the normalized inputs plus the model settings and prompt version."""
+    payload = json.dumps({"inputs": normalized_inputs, "settings": settings}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class PlanCache:
+    """
+    Two-tier cache for generated treatment plans.
+
+    An in-memory LRU with TTL answers repeat requests in this process; misses
+    fall through to a SQLite-backed table that survives restarts.  Async
+    callers use aget/aput, which keep the blocking SQLite I/O (and its lock
+    waits) off the event loop.
+    """
+
+    def __init__(self, database_url: str = PLAN_CACHE_URL, max_entries: int = PLAN_CACHE_MAX_ENTRIES,
+                 ttl_seconds: float = PLAN_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._memory = OrderedDict()  # key -> (plan, generation_ms, created_at)
+        self._lock = threading.Lock()
+        self._engine = create_engine(database_url)
+        cache_metadata.create_all(self._engine)
+
+        self.memory_hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.saved_ms = 0.0
+
+    def get(self, key: str) -> Optional[str]:
+        plan = self.get_from_memory(key)
+        if plan is not None:
+            return plan
+        return self._get_persistent(key, time.time())
+
+    async def aget(self, key: str) -> Optional[str]:
+        """Like get, for the event loop: only the SQLite tier runs in a worker thread."""
+        plan = self.get_from_memory(key)
+        if plan is not None:
+            return plan
+        return await asyncio.to_thread(self._get_persistent, key, time.time())
+
+    def get_from_memory(self, key: str) -> Optional[str]:
+        """The in-memory tier only; a miss here is not counted, since the persistent tier is asked next."""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                plan, generation_ms, created_at = entry
+                if now - created_at <= self.ttl_seconds:
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    self.saved_ms += generation_ms or 0
+                    return plan
+                del self._memory[key]
+        return None
+
+    def _get_persistent(self, key: str, now: float) -> Optional[str]:
+        with self._engine.connect() as conn:
+            row = conn.execute(
+                select(plan_cache_entries).where(plan_cache_entries.c.key == key)
+            ).first()
+
+        with self._lock:
+            if row is None or now - row.created_at > self.ttl_seconds:
+                self.misses += 1
+                return None
+            self._remember(key, row.plan, row.generation_ms, row.created_at)
+            self.persistent_hits += 1
+            self.saved_ms += row.generation_ms or 0
+            return row.plan
+
+    def put(self, key: str, plan: str, generation_ms: float):
+        now = time.time()
+        with self._lock:
+            self._remember(key, plan, generation_ms, now)
+        self._put_persistent(key, plan, generation_ms, now)
+
+    async def aput(self, key: str, plan: str, generation_ms: float):
+        """Like put, for the event loop: the plan is in memory at once, the SQLite write runs in a worker thread."""
+        now = time.time()
+        with self._lock:
+            self._remember(key, plan, generation_ms, now)
+        await asyncio.to_thread(self._put_persistent, key, plan, generation_ms, now)
+
+    def _put_persistent(self, key: str, plan: str, generation_ms: float, now: float):
+        with self._engine.begin() as conn:
+            conn.execute(delete(plan_cache_entries).where(
+                (plan_cache_entries.c.key == key) |
+                (plan_cache_entries.c.created_at < now - self.ttl_seconds)
+            ))
+            conn.execute(plan_cache_entries.insert().values(
+                key=key, plan=plan, generation_ms=generation_ms, created_at=now
+            ))
+
+    def record_bypass(self):
+        with self._lock:
+            self.bypassed += 1
+
+    def _remember(self, key, plan, generation_ms, created_at):
+        self._memory[key] = (plan, generation_ms, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            hits = self.memory_hits + self.persistent_hits
+            lookups = hits + self.misses
+            return {
+                "lookups": lookups,
+                "hits": hits,
+                "memory_hits": self.memory_hits,
+                "persistent_hits": self.persistent_hits,
+                "misses": self.misses,
+                "regenerate_bypasses": self.bypassed,
+                "hit_rate": round(hits / lookups, 4) if lookups else None,
+                "saved_latency_ms": round(self.saved_ms, 1),
+                "memory_entries": len(self._memory),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "buckets": PLAN_CACHE_BUCKETS,
+            }
+
+
+# Global instance - lazy loaded
+plan_cache = None
+
+def get_plan_cache() -> PlanCache:
+    global plan_cache
+    if plan_cache is None:
+        plan_cache = PlanCache()
+    return plan_cache
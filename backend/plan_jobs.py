@@ -0,0 +1,431 @@
+import asyncio
+import os
+import threading
+import uuid
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+import httpx
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from models import Patient, StrokeScan, TreatmentPlanJob
+from chatgpt_service import get_chatgpt_service, OpenAIAPIError, LLMUnavailableError, GENERATION_SETTINGS
+from llm_metrics import get_llm_metrics, new_usage
+from rules_plan import generate_rules_plan, rules_plan_extras, PLAN_RULES_FALLBACK_ENABLED
+from treatment_plan_service import (
+    plan_inputs_for_scan, plan_type_for, create_treatment_plan, hash_plan_inputs, discard_pregenerated_plans
+)
+
+# Concurrent jobs, i.e. the cap on simultaneous upstream LLM calls from jobs
+PLAN_JOB_WORKERS = int(os.getenv("PLAN_JOB_WORKERS", "4"))
+PLAN_JOB_TIMEOUT_SECONDS = float(os.getenv("PLAN_JOB_TIMEOUT_SECONDS", "60"))
+PLAN_JOB_MAX_ATTEMPTS = int(os.getenv("PLAN_JOB_MAX_ATTEMPTS", "3"))
+PLAN_JOB_RETRY_DELAY_SECONDS = float(os.getenv("PLAN_JOB_RETRY_DELAY_SECONDS", "2"))
+
+# Speculative drafts generated when a case is sent to the physician.  They run
+# on their own small pool so they never hold up a physician who is waiting.
+PLAN_PREGENERATION_ENABLED = os.getenv("PLAN_PREGENERATION_ENABLED", "false").lower() in ("1", "true", "yes")
+PLAN_PREGENERATION_WORKERS = int(os.getenv("PLAN_PREGENERATION_WORKERS", "2"))
+
+FINAL_JOB_STATUSES = ("succeeded", "failed", "cancelled")
+
+# Upstream failures worth another attempt; anything else fails the job at once
+RETRYABLE_ERRORS = (OpenAIAPIError, httpx.HTTPError, asyncio.TimeoutError)
+
+# Makes the look-up-then-enqueue in join_or_enqueue_plan_job atomic within the process
+_enqueue_lock = threading.Lock()
+jobs_joined = 0
+
+
+def enqueue_plan_job(db: Session, patient_id: int, scan_id: int, requested_by: str,
+                     regenerate: bool = False, speculative: bool = False, inputs_hash: str = None) -> str:
+    """
+    Persist a generation job and hand it to the worker pool; returns the job id.
+    The session holds no DB connection afterwards.
+    """
+    job_id = uuid.uuid4().hex
+    job = TreatmentPlanJob(
+        id=job_id,
+        patient_id=patient_id,
+        scan_id=scan_id,
+        requested_by=requested_by,
+        regenerate=regenerate,
+        speculative=speculative,
+        inputs_hash=inputs_hash,
+        status="queued",
+        progress="Waiting for a worker",
+        attempts=0,
+        created_at=datetime.now()
+    )
+    db.add(job)
+    db.commit()
+
+    pool = get_pregeneration_worker_pool() if speculative else get_plan_worker_pool()
+    pool.submit(job_id)
+    return job_id
+
+
+def join_or_enqueue_plan_job(db: Session, patient_id: int, scan_id: int, requested_by: str,
+                             inputs_hash: str, regenerate: bool = False) -> Tuple[str, bool]:
+    """
+    Single-flight for generation jobs: a request for a scan that already has a
+    queued or running job with the same inputs shares that job (and the one plan
+    it saves) instead of paying for another LLM call.
+    Returns (job_id, joined).
+    """
+    global jobs_joined
+    with _enqueue_lock:
+        in_flight = db.query(TreatmentPlanJob.id).filter(
+            TreatmentPlanJob.scan_id == scan_id,
+            TreatmentPlanJob.inputs_hash == inputs_hash,
+            TreatmentPlanJob.regenerate == regenerate,
+            func.coalesce(TreatmentPlanJob.speculative, False) == False,
+            TreatmentPlanJob.status.in_(("queued", "running"))
+        ).order_by(TreatmentPlanJob.created_at).first()
+        if in_flight:
+            db.commit()
+            jobs_joined += 1
+            return in_flight.id, True
+
+        job_id = enqueue_plan_job(db, patient_id, scan_id, requested_by,
+                                  regenerate=regenerate, inputs_hash=inputs_hash)
+        return job_id, False
+
+
+def pregenerate_plan(db: Session, patient_id: int, scan_id: int,
+                     patient_data: Dict[str, Any], scan_data: Dict[str, Any]) -> Optional[str]:
+    """
+    Start a speculative draft for a case that was just sent to the physician,
+    replacing any earlier draft for the same scan.  Returns the job id, or None
+    when pre-generation is switched off.
+    """
+    if not PLAN_PREGENERATION_ENABLED:
+        return None
+
+    discard_pregenerated_plans(db, scan_id=scan_id)
+    return enqueue_plan_job(db, patient_id, scan_id, "pre-generation",
+                            speculative=True, inputs_hash=hash_plan_inputs(patient_data, scan_data))
+
+
+def record_pregenerated_job(db: Session, patient_id: int, scan_id: int, requested_by: str,
+                            treatment_plan_id: int) -> str:
+    """A job that is finished on arrival because a speculative draft answered it."""
+    job_id = uuid.uuid4().hex
+    now = datetime.now()
+    db.add(TreatmentPlanJob(
+        id=job_id,
+        patient_id=patient_id,
+        scan_id=scan_id,
+        requested_by=requested_by,
+        regenerate=False,
+        status="succeeded",
+        progress="Done (pre-generated draft)",
+        attempts=0,
+        treatment_plan_id=treatment_plan_id,
+        created_at=now,
+        started_at=now,
+        finished_at=now
+    ))
+    db.commit()
+    return job_id
+
+
+def plan_job_status(job: TreatmentPlanJob) -> Dict[str, Any]:
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "progress": job.progress,
+        "attempts": job.attempts,
+        "max_attempts": PLAN_JOB_MAX_ATTEMPTS,
+        "error": job.error,
+        "treatment_plan_id": job.treatment_plan_id,
+        "speculative": bool(job.speculative),
+        "patient_id": job.patient_id,
+        "scan_id": job.scan_id,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+class PlanWorkerPool:
+    """
+    Fixed number of asyncio workers draining an in-process queue of job ids.
+
+    The jobs table is the source of truth: a worker claims a job by moving it
+    from queued to running, and jobs left queued or running when the process
+    stopped are picked up again when the pool starts.  A speculative pool only
+    takes pre-generation jobs and a regular pool only the others.
+    """
+
+    def __init__(self, workers: int = PLAN_JOB_WORKERS, timeout_seconds: float = PLAN_JOB_TIMEOUT_SECONDS,
+                 max_attempts: int = PLAN_JOB_MAX_ATTEMPTS, retry_delay_seconds: float = PLAN_JOB_RETRY_DELAY_SECONDS,
+                 speculative: bool = False):
+        self.workers = max(1, workers)
+        self.speculative = speculative
+        self.timeout_seconds = timeout_seconds
+        self.max_attempts = max_attempts
+        self.retry_delay_seconds = retry_delay_seconds
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks = []
+        self._loop = None
+
+    def start(self):
+        """Start the workers on the running event loop and resume unfinished jobs."""
+        loop = asyncio.get_running_loop()
+        if self._loop is loop and self._tasks:
+            return
+        self._loop = loop
+        self._queue = asyncio.Queue()
+        self._tasks = [loop.create_task(self._worker()) for _ in range(self.workers)]
+        self._resume_unfinished_jobs()
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._loop = None
+
+    def submit(self, job_id: str):
+        self.start()
+        self._queue.put_nowait(job_id)
+
+    def _resume_unfinished_jobs(self):
+        db = SessionLocal()
+        try:
+            jobs = db.query(TreatmentPlanJob).filter(
+                TreatmentPlanJob.status.in_(("queued", "running")),
+                func.coalesce(TreatmentPlanJob.speculative, False) == self.speculative
+            ).order_by(TreatmentPlanJob.created_at).all()
+            for job in jobs:
+                if job.status == "running":
+                    # Interrupted by a restart; the attempt it was on does not count
+                    job.status = "queued"
+                    job.attempts = max((job.attempts or 1) - 1, 0)
+                    job.progress = "Waiting for a worker (resumed after restart)"
+            db.commit()
+            for job in jobs:
+                self._queue.put_nowait(job.id)
+            if jobs:
+                kind = "speculative treatment plan" if self.speculative else "treatment plan"
+                print(f"Resumed {len(jobs)} unfinished {kind} job(s)")
+        finally:
+            db.close()
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+            except Exception as e:
+                print(f"Treatment plan job {job_id} crashed: {e}")
+                await asyncio.to_thread(self._finish, job_id, "failed", f"Internal error: {str(e)}")
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job_id: str):
+        # Database work runs in threads: a blocking pool checkout on the event
+        # loop would stall every request, including the ones holding connections
+        context = await asyncio.to_thread(self._claim, job_id)
+        if context is None:
+            return
+
+        usage = new_usage(GENERATION_SETTINGS["model"])
+        try:
+            plan = await asyncio.wait_for(
+                get_chatgpt_service().request_treatment_plan(
+                    context["patient_data"], context["scan_data"],
+                    context["scan_data"]["eligibility_result"], context["scan_data"]["eligible"],
+                    regenerate=context["regenerate"], usage=usage
+                ),
+                timeout=self.timeout_seconds
+            )
+        except RETRYABLE_ERRORS as e:
+            if isinstance(e, asyncio.TimeoutError):
+                error = f"AI model did not respond within {self.timeout_seconds:.0f}s"
+            else:
+                error = str(e) or type(e).__name__
+            if self._falls_back_to_rules(context, e):
+                treatment_plan_id = await asyncio.to_thread(self._save_rules_plan, context)
+                await asyncio.to_thread(self._finish, job_id, "succeeded", f"{error}; saved a rules-based draft instead",
+                                        treatment_plan_id, "Done (rules-based draft)")
+                return
+            # While the circuit breaker is open, retrying before it half-opens is pointless
+            await self._retry_or_fail(job_id, context["attempts"], error,
+                                      e.retry_after if isinstance(e, LLMUnavailableError) else None)
+            return
+
+        # Calls made by earlier, failed attempts of this job count towards the plan
+        usage["attempts"] += context["attempts"] - 1
+        treatment_plan_id = await asyncio.to_thread(self._save_plan, job_id, context, plan, usage)
+        if treatment_plan_id is None:
+            await asyncio.to_thread(self._finish, job_id, "cancelled", "Case changed while the draft was generated")
+            return
+        await asyncio.to_thread(self._finish, job_id, "succeeded", None, treatment_plan_id)
+
+    def _claim(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Move a queued job to running and load its inputs.  Returns None when
+        another worker has it already or the job failed on missing data.
+        """
+        db = SessionLocal()
+        try:
+            claimed = db.query(TreatmentPlanJob).filter(
+                TreatmentPlanJob.id == job_id, TreatmentPlanJob.status == "queued"
+            ).update({
+                TreatmentPlanJob.status: "running",
+                TreatmentPlanJob.attempts: TreatmentPlanJob.attempts + 1,
+                TreatmentPlanJob.started_at: datetime.now(),
+                TreatmentPlanJob.progress: "Loading patient data",
+            }, synchronize_session=False)
+            db.commit()
+            if not claimed:
+                return None
+
+            job = db.query(TreatmentPlanJob).filter(TreatmentPlanJob.id == job_id).first()
+            patient = db.query(Patient).filter(Patient.id == job.patient_id).first()
+            scan = db.query(StrokeScan).filter(StrokeScan.id == job.scan_id).first()
+            if not patient or not scan:
+                self._finish(job_id, "failed", "Patient or scan no longer exists")
+                return None
+
+            patient_data, scan_data = plan_inputs_for_scan(patient, scan)
+            if job.speculative and hash_plan_inputs(patient_data, scan_data) != job.inputs_hash:
+                self._finish(job_id, "cancelled", "Case changed before the draft was generated")
+                return None
+
+            context = {
+                "patient_data": patient_data,
+                "scan_data": scan_data,
+                "patient_id": patient.id,
+                "scan_id": scan.id,
+                "attempts": job.attempts,
+                "regenerate": bool(job.regenerate),
+                "requested_by": job.requested_by,
+                "speculative": bool(job.speculative),
+                "inputs_hash": job.inputs_hash,
+                "rules_extras": rules_plan_extras(db, scan),
+            }
+            self._set_progress(db, job_id, "Waiting for the AI model")
+            return context
+        finally:
+            db.close()
+
+    def _save_plan(self, job_id: str, context: Dict[str, Any], plan: str,
+                   usage: Dict[str, Any] = None) -> Optional[int]:
+        """Store the plan; returns None instead when a speculative draft went stale."""
+        db = SessionLocal()
+        try:
+            self._set_progress(db, job_id, "Saving treatment plan")
+            if context["speculative"]:
+                job = db.query(TreatmentPlanJob).filter(TreatmentPlanJob.id == job_id).first()
+                patient = db.query(Patient).filter(Patient.id == context["patient_id"]).first()
+                scan = db.query(StrokeScan).filter(StrokeScan.id == context["scan_id"]).first()
+                if job.status != "running" or not patient or not scan or \
+                        hash_plan_inputs(*plan_inputs_for_scan(patient, scan)) != context["inputs_hash"]:
+                    return None
+
+            treatment_plan = create_treatment_plan(
+                db, context["patient_id"], context["scan_id"],
+                plan_type_for(context["scan_data"]["eligible"]), plan, context["requested_by"],
+                source="speculative" if context["speculative"] else "physician",
+                inputs_hash=context["inputs_hash"],
+                usage=usage
+            )
+            return treatment_plan.id
+        finally:
+            db.close()
+
+    def _falls_back_to_rules(self, context: Dict[str, Any], error: Exception) -> bool:
+        """
+        Physician jobs get a rules-based draft instead of waiting out retries when
+        the AI model is unavailable, missed its deadline or is out of attempts.
+        """
+        if not PLAN_RULES_FALLBACK_ENABLED or context["speculative"]:
+            return False
+        return isinstance(error, (LLMUnavailableError, asyncio.TimeoutError)) \
+            or context["attempts"] >= self.max_attempts or not get_chatgpt_service().api_key
+
+    def _save_rules_plan(self, context: Dict[str, Any]) -> int:
+        db = SessionLocal()
+        try:
+            plan = generate_rules_plan(context["patient_data"], context["scan_data"], **context["rules_extras"])
+            treatment_plan = create_treatment_plan(
+                db, context["patient_id"], context["scan_id"],
+                plan_type_for(context["scan_data"]["eligible"]), plan, context["requested_by"],
+                source="rules", inputs_hash=context["inputs_hash"]
+            )
+            return treatment_plan.id
+        finally:
+            db.close()
+
+    async def _retry_or_fail(self, job_id: str, attempts: int, error: str, retry_after: float = None):
+        if attempts >= self.max_attempts:
+            await asyncio.to_thread(self._finish, job_id, "failed", f"Failed after {attempts} attempt(s): {error}")
+            return
+
+        get_llm_metrics().record_retry("generate")
+        delay = max(self.retry_delay_seconds * 2 ** (attempts - 1), retry_after or 0)
+        await asyncio.to_thread(self._mark_for_retry, job_id, attempts, delay, error)
+        self._loop.call_later(delay, self._queue.put_nowait, job_id)
+
+    def _mark_for_retry(self, job_id: str, attempts: int, delay: float, error: str):
+        db = SessionLocal()
+        try:
+            db.query(TreatmentPlanJob).filter(
+                TreatmentPlanJob.id == job_id, TreatmentPlanJob.status == "running"
+            ).update({
+                TreatmentPlanJob.status: "queued",
+                TreatmentPlanJob.error: error,
+                TreatmentPlanJob.progress: f"Retrying in {delay:.0f}s (attempt {attempts} of {self.max_attempts} failed)",
+            }, synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+    def _set_progress(self, db: Session, job_id: str, progress: str):
+        db.query(TreatmentPlanJob).filter(TreatmentPlanJob.id == job_id).update(
+            {TreatmentPlanJob.progress: progress}, synchronize_session=False
+        )
+        db.commit()
+
+    def _finish(self, job_id: str, status: str, error: str = None, treatment_plan_id: int = None,
+                progress: str = None):
+        db = SessionLocal()
+        try:
+            # A job cancelled while it ran keeps its cancelled status
+            db.query(TreatmentPlanJob).filter(
+                TreatmentPlanJob.id == job_id, TreatmentPlanJob.status.in_(("queued", "running"))
+            ).update({
+                TreatmentPlanJob.status: status,
+                TreatmentPlanJob.error: error,
+                TreatmentPlanJob.treatment_plan_id: treatment_plan_id,
+                TreatmentPlanJob.progress: progress or {"succeeded": "Done", "cancelled": "Cancelled (case changed)"}.get(status, "Failed"),
+                TreatmentPlanJob.finished_at: datetime.now(),
+            }, synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+
+# Global instance - lazy loaded
+plan_worker_pool = None
+
+def get_plan_worker_pool() -> PlanWorkerPool:
+    global plan_worker_pool
+    if plan_worker_pool is None:
+        plan_worker_pool = PlanWorkerPool()
+    return plan_worker_pool
+
+
+# Global instance - lazy loaded
+pregeneration_worker_pool = None
+
+def get_pregeneration_worker_pool() -> PlanWorkerPool:
+    global pregeneration_worker_pool
+    if pregeneration_worker_pool is None:
+        pregeneration_worker_pool = PlanWorkerPool(workers=PLAN_PREGENERATION_WORKERS, speculative=True)
+    return pregeneration_worker_pool
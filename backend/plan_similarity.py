@@ -0,0 +1,189 @@
+"""
+Nearest approved treatment plans for a new case
+
+Each approved plan is indexed by a feature vector built from its case:
+vitals and NIHSS scaled around clinical reference values, tPA eligibility,
+the failed eligibility criteria and the ICD code.  Vectors are unit length
+and held in one NumPy matrix, so a cosine k-nearest-neighbour lookup is a
+single matrix-vector product.  The index is built from the database on first
+use and updated as plans are approved or un-approved.  It lives in process
+memory; each server process keeps its own copy.
+"""
+
+import os
+import threading
+import zlib
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from models import Patient, StrokeScan, TreatmentPlan
+from rules_plan import rules_plan_extras
+from tpa_eligibility import get_tpa_rule_set
+
+# Plan statuses that count as physician-approved
+APPROVED_PLAN_STATUSES = ("approved", "implemented")
+
+# Numeric feature -> (reference value, scale); missing values sit at the reference
+NUMERIC_FEATURES = {
+    "age": (65, 15),
+    "systolic_bp": (150, 25),
+    "diastolic_bp": (85, 15),
+    "heart_rate": (80, 15),
+    "oxygen_saturation": (96, 3),
+    "temperature": (98.6, 1.5),
+    "glucose": (130, 50),
+    "inr": (1.1, 0.4),
+    "platelet_count": (250, 80),
+    "nihss_score": (8, 6),
+}
+
+# Relative weight of each block of features in the cosine similarity
+SIMILARITY_WEIGHTS = {
+    "numeric": float(os.getenv("PLAN_SIMILARITY_NUMERIC_WEIGHT", "1.0")),
+    "eligibility": float(os.getenv("PLAN_SIMILARITY_ELIGIBILITY_WEIGHT", "2.0")),
+    "criteria": float(os.getenv("PLAN_SIMILARITY_CRITERIA_WEIGHT", "1.0")),
+    "icd": float(os.getenv("PLAN_SIMILARITY_ICD_WEIGHT", "1.5")),
+}
+
+# ICD codes are hashed into this many columns: the category (e.g. "I63") and the full code
+ICD_BUCKETS = 32
+
+
+def _icd_columns(icd_code: Optional[str]) -> np.ndarray:
+    columns = np.zeros(ICD_BUCKETS, dtype=np.float32)
+    if not icd_code:
+        return columns
+    code = icd_code.strip().upper()
+    for part, weight in ((code[:3], 1.0), (code, 0.5)):
+        columns[zlib.crc32(part.encode("utf-8")) % ICD_BUCKETS] += weight
+    return columns
+
+
+def case_features(case: Dict[str, Any], eligible: bool, failed_criteria: Sequence[str],
+                  icd_code: Optional[str], criterion_ids: Sequence[str]) -> np.ndarray:
+    """Unit-length feature vector for one case; all-zero blocks simply do not contribute."""
+    numeric = np.array([
+        np.clip(((case.get(name) if case.get(name) is not None else center) - center) / scale, -4, 4)
+        for name, (center, scale) in NUMERIC_FEATURES.items()
+    ], dtype=np.float32)
+    eligibility = np.array([1.0 if eligible else -1.0], dtype=np.float32)
+    failed = set(failed_criteria)
+    criteria = np.array([1.0 if criterion in failed else 0.0 for criterion in criterion_ids], dtype=np.float32)
+
+    vector = np.concatenate([
+        numeric * SIMILARITY_WEIGHTS["numeric"] / np.sqrt(len(NUMERIC_FEATURES)),
+        eligibility * SIMILARITY_WEIGHTS["eligibility"],
+        criteria * SIMILARITY_WEIGHTS["criteria"],
+        _icd_columns(icd_code) * SIMILARITY_WEIGHTS["icd"],
+    ])
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def scan_case(db: Session, patient: Patient, scan: StrokeScan) -> Tuple[Dict[str, Any], bool, List[str]]:
+    """(numeric case values, eligible, failed criterion ids) for a scan."""
+    extras = rules_plan_extras(db, scan)
+    case = {name: getattr(patient, name, None) for name in NUMERIC_FEATURES if name != "nihss_score"}
+    case["nihss_score"] = extras["nihss_score"]
+    return case, bool(scan.eligible), extras["exclusions"]
+
+
+class PlanSimilarityIndex:
+    """
+    Approved plans as rows of a unit-vector matrix.  Rows are added and
+    removed in place (removal swaps in the last row); the matrix doubles
+    its capacity when full.
+    """
+
+    def __init__(self, criterion_ids: Sequence[str]):
+        self.criterion_ids = tuple(criterion_ids)
+        self.dimensions = len(NUMERIC_FEATURES) + 1 + len(self.criterion_ids) + ICD_BUCKETS
+        self._lock = threading.Lock()
+        self._matrix = np.zeros((64, self.dimensions), dtype=np.float32)
+        self._plan_ids: List[int] = []
+        self._rows: Dict[int, int] = {}
+        self.loaded = False
+
+    def __len__(self):
+        return len(self._plan_ids)
+
+    def vector(self, db: Session, patient: Patient, scan: StrokeScan, icd_code: Optional[str] = None) -> np.ndarray:
+        case, eligible, failed = scan_case(db, patient, scan)
+        return case_features(case, eligible, failed, icd_code, self.criterion_ids)
+
+    def upsert(self, plan_id: int, vector: np.ndarray):
+        with self._lock:
+            row = self._rows.get(plan_id)
+            if row is None:
+                row = len(self._plan_ids)
+                if row == len(self._matrix):
+                    self._matrix = np.concatenate([self._matrix, np.zeros_like(self._matrix)])
+                self._plan_ids.append(plan_id)
+                self._rows[plan_id] = row
+            self._matrix[row] = vector
+
+    def remove(self, plan_id: int):
+        with self._lock:
+            row = self._rows.pop(plan_id, None)
+            if row is None:
+                return
+            last = len(self._plan_ids) - 1
+            if row != last:
+                moved = self._plan_ids[last]
+                self._matrix[row] = self._matrix[last]
+                self._plan_ids[row] = moved
+                self._rows[moved] = row
+            self._plan_ids.pop()
+
+    def query(self, vector: np.ndarray, k: int = 5, exclude: Sequence[int] = ()) -> List[Tuple[int, float]]:
+        """Up to k (plan id, cosine similarity) pairs, most similar first."""
+        with self._lock:
+            count = len(self._plan_ids)
+            if not count or k <= 0:
+                return []
+            scores = self._matrix[:count] @ vector
+            for plan_id in exclude:
+                row = self._rows.get(plan_id)
+                if row is not None:
+                    scores[row] = -np.inf
+            k = min(k, count)
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [(self._plan_ids[row], float(scores[row])) for row in top if np.isfinite(scores[row])]
+
+    def rebuild(self, db: Session):
+        """Index every approved plan from scratch."""
+        rows = db.query(TreatmentPlan, StrokeScan, Patient).join(
+            StrokeScan, StrokeScan.id == TreatmentPlan.scan_id
+        ).join(Patient, Patient.id == TreatmentPlan.patient_id).filter(
+            TreatmentPlan.status.in_(APPROVED_PLAN_STATUSES)
+        ).all()
+        vectors = [(plan.id, self.vector(db, patient, scan, plan.icd_code)) for plan, scan, patient in rows]
+
+        matrix = np.zeros((max(64, len(vectors)), self.dimensions), dtype=np.float32)
+        for row, (_, vector) in enumerate(vectors):
+            matrix[row] = vector
+        with self._lock:
+            self._matrix = matrix
+            self._plan_ids = [plan_id for plan_id, _ in vectors]
+            self._rows = {plan_id: row for row, plan_id in enumerate(self._plan_ids)}
+            self.loaded = True
+
+    def ensure_loaded(self, db: Session):
+        if not self.loaded:
+            self.rebuild(db)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"approved_plans": len(self), "dimensions": self.dimensions, "loaded": self.loaded}
+
+
+# Global instance - lazy loaded
+plan_similarity_index = None
+
+def get_plan_similarity_index() -> PlanSimilarityIndex:
+    global plan_similarity_index
+    if plan_similarity_index is None:
+        plan_similarity_index = PlanSimilarityIndex([criterion["id"] for criterion in get_tpa_rule_set().criteria])
+    return plan_similarity_index
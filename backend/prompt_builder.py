@@ -0,0 +1,224 @@
+"""
+Prompt construction for the treatment plan service
+
+The generation prompts share their patient, vitals and scan sections and
+differ only in the task list, so both are assembled from the same pieces,
+compiled once at import.  Unrecorded values are left out rather than sent as
+"N/A", and no indentation whitespace reaches the model.
+
+Refine prompts are held to REFINE_PROMPT_TOKEN_BUDGET tokens.  The change
+log a previous refinement appended to the plan is dropped first; if the
+prompt is still too long, the physician notes and then the tail of the plan
+are truncated at line boundaries.
+
+Tokens are counted with tiktoken when it is installed and its encoding can be
+loaded, otherwise with a local approximation of the GPT tokenizer.
+"""
+
+import os
+import re
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import tiktoken
+except ImportError:  # optional; the approximation below is used instead
+    tiktoken = None
+
+REFINE_PROMPT_TOKEN_BUDGET = int(os.getenv("REFINE_PROMPT_TOKEN_BUDGET", "2500"))
+
+# Each chat message costs a few tokens of framing on top of its content
+MESSAGE_OVERHEAD_TOKENS = 4
+
+GENERATION_SYSTEM_PROMPT = "You are a stroke neurologist. Provide concise medical recommendations only."
+REFINE_SYSTEM_PROMPT = "You are an expert neurologist. Refine treatment plans based on physician input while maintaining medical accuracy."
+
+# Refined plans end with this section; it is stripped before the plan is refined again
+CHANGE_LOG_HEADING = "Changes made:"
+
+# (patient_data key, format) in prompt order; values that are None are skipped
+_PATIENT_FIELDS = (
+    ("age", "{}-year-old"),
+    ("gender", "{}"),
+    ("chief_complaint", "chief complaint {}"),
+    ("time_since_onset", "onset {} ago"),
+)
+_VITAL_FIELDS = (
+    ("heart_rate", "HR {} bpm"),
+    ("temperature", "temp {}°F"),
+    ("oxygen_saturation", "SpO2 {}%"),
+    ("glucose", "glucose {} mg/dL"),
+    ("inr", "INR {}"),
+)
+
+_TASKS = {
+    True: (
+        "Write a treatment plan for this tPA-eligible stroke patient covering:",
+        ("Immediate interventions (first 24 hours)", "tPA administration protocol and monitoring",
+         "Post-tPA care and monitoring", "Secondary prevention", "Rehabilitation planning",
+         "Follow-up schedule", "Complications to watch for"),
+    ),
+    False: (
+        "This patient is NOT eligible for tPA. Write an alternative treatment plan covering:",
+        ("Immediate supportive care (first 24 hours)", "Medical management", "Secondary prevention",
+         "Rehabilitation planning", "Follow-up schedule", "Alternative interventions if applicable",
+         "Monitoring parameters"),
+    ),
+}
+# Task sections are fixed text, so they are joined once here
+_TASK_TEXT = {
+    eligible: "\n".join([intro] + [f"{number}. {item}" for number, item in enumerate(items, 1)]
+                        + ["Use clear sections with specific recommendations."])
+    for eligible, (intro, items) in _TASKS.items()
+}
+
+_REFINE_INSTRUCTIONS = (
+    "Update the plan to incorporate the physician's notes, keeping it accurate and evidence-based. "
+    f"Return the full updated plan, then a final section headed \"{CHANGE_LOG_HEADING}\" listing what changed."
+)
+
+
+# -----------------------------
+# TOKEN COUNTING
+# -----------------------------
+_encoding = None
+_encoding_lock = threading.Lock()
+# Words (with their leading space), numbers in groups of up to three digits, other symbols
+_APPROXIMATE_TOKEN = re.compile(r" ?[A-Za-z]+| ?\d{1,3}| ?[^\sA-Za-z\d]+|\s+")
+
+
+def _tiktoken_encoding():
+    """The cl100k_base encoding, or None when tiktoken is missing or cannot fetch it (offline)."""
+    global _encoding
+    if _encoding is None:
+        with _encoding_lock:
+            if _encoding is None:
+                try:
+                    _encoding = tiktoken.get_encoding("cl100k_base") if tiktoken is not None else False
+                except Exception:
+                    _encoding = False
+    return _encoding or None
+
+
+def count_tokens(text: str) -> int:
+    """Tokens in text for the GPT-3.5/4 tokenizer (exact with tiktoken, approximate without)."""
+    if not text:
+        return 0
+    encoding = _tiktoken_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    # Long words split into several tokens, roughly one per four letters after the first six
+    return sum(1 + max(len(piece) - 6, 0) // 4 for piece in _APPROXIMATE_TOKEN.findall(text))
+
+
+def count_message_tokens(messages: List[Dict[str, str]]) -> int:
+    return sum(count_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS for message in messages)
+
+
+def truncate_to_tokens(text: str, budget: int, marker: str) -> Tuple[str, bool]:
+    """Leading whole lines of text that fit in budget tokens, plus marker when anything was cut."""
+    if count_tokens(text) <= budget:
+        return text, False
+    kept, used = [], count_tokens(marker) + 1
+    for line in text.split("\n"):
+        cost = count_tokens(line) + 1
+        if used + cost > budget:
+            break
+        kept.append(line)
+        used += cost
+    return "\n".join(kept + [marker]), True
+
+
+# -----------------------------
+# PROMPTS
+# -----------------------------
+def compact(text: str) -> str:
+    """Trim trailing spaces, and collapse runs of blank lines to one."""
+    lines = [line.rstrip() for line in text.strip().split("\n")]
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(lines))
+
+
+def _fields(data: Dict[str, Any], fields) -> List[str]:
+    return [fmt.format(data[key]) for key, fmt in fields if data.get(key) is not None]
+
+
+def generation_prompt(patient_data: Dict[str, Any], scan_data: Dict[str, Any],
+                      eligibility_result: str, is_eligible: bool) -> str:
+    """User prompt for a new treatment plan; the patient name is never included."""
+    vitals = _fields(patient_data, _VITAL_FIELDS)
+    if patient_data.get("systolic_bp") is not None and patient_data.get("diastolic_bp") is not None:
+        vitals.insert(0, f"BP {patient_data['systolic_bp']}/{patient_data['diastolic_bp']} mmHg")
+
+    scan = [f"imaging confirmed: {scan_data.get('imaging_confirmed', 'N/A')}"]
+    # Scans from /api/upload-scan store the eligibility result as the diagnosis too
+    if scan_data.get("prediction") and scan_data["prediction"] != eligibility_result:
+        scan.append(f"diagnosis: {scan_data['prediction']}")
+
+    return "\n".join([
+        "Patient: " + ", ".join(_fields(patient_data, _PATIENT_FIELDS)),
+        "Vitals: " + ", ".join(vitals),
+        "Scan: " + "; ".join(scan),
+        f"tPA assessment: {eligibility_result}",
+        "",
+        _TASK_TEXT[bool(is_eligible)],
+    ])
+
+
+def generation_messages(patient_data: Dict[str, Any], scan_data: Dict[str, Any],
+                        eligibility_result: str, is_eligible: bool) -> List[Dict[str, str]]:
+    return [
+        {"role": "system", "content": GENERATION_SYSTEM_PROMPT},
+        {"role": "user", "content": generation_prompt(patient_data, scan_data, eligibility_result, is_eligible)},
+    ]
+
+
+def strip_change_log(plan: str) -> str:
+    """The plan without the change log a previous refinement appended."""
+    match = re.search(rf"^[#*\s]*{re.escape(CHANGE_LOG_HEADING.rstrip(':'))}\b.*", plan,
+                      flags=re.IGNORECASE | re.MULTILINE | re.DOTALL)
+    return plan[:match.start()].rstrip() if match else plan
+
+
+# Refine prompts built and how often each reduction was needed, since startup
+_refine_stats = {"prompts": 0, "change_logs_stripped": 0, "notes_truncated": 0, "plans_truncated": 0}
+_refine_stats_lock = threading.Lock()
+
+
+def refine_messages(existing_plan: str, physician_notes: str,
+                    budget: Optional[int] = None) -> List[Dict[str, str]]:
+    """Refine prompt for existing_plan, held to budget tokens (REFINE_PROMPT_TOKEN_BUDGET by default)."""
+    budget = budget or REFINE_PROMPT_TOKEN_BUDGET
+    plan = compact(existing_plan or "")
+    stripped = strip_change_log(plan)
+    notes = compact(physician_notes or "")
+
+    def build(plan_text: str, notes_text: str) -> List[Dict[str, str]]:
+        return [
+            {"role": "system", "content": REFINE_SYSTEM_PROMPT},
+            {"role": "user", "content": "\n\n".join([
+                "Existing treatment plan:", plan_text, "Physician notes:", notes_text, _REFINE_INSTRUCTIONS
+            ])},
+        ]
+
+    fixed = count_message_tokens(build("", ""))
+    # Notes are the newest context: they may use up to half of what is left
+    notes, notes_cut = truncate_to_tokens(notes, max((budget - fixed) // 2, 0), "[notes truncated]")
+    plan_budget = budget - fixed - count_tokens(notes)
+    plan_text, plan_cut = truncate_to_tokens(stripped, max(plan_budget, 0),
+                                             "[remainder of the plan omitted to fit the prompt budget]")
+
+    with _refine_stats_lock:
+        _refine_stats["prompts"] += 1
+        _refine_stats["change_logs_stripped"] += stripped != plan
+        _refine_stats["notes_truncated"] += notes_cut
+        _refine_stats["plans_truncated"] += plan_cut
+    return build(plan_text, notes)
+
+
+def prompt_stats() -> Dict[str, Any]:
+    with _refine_stats_lock:
+        return {
+            "tokenizer": "tiktoken" if _tiktoken_encoding() is not None else "approximate",
+            "refine_token_budget": REFINE_PROMPT_TOKEN_BUDGET,
+            "refine": dict(_refine_stats),
+        }
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Retrospective cohort re-screening for tPA eligibility
+
+Answers "how many past patients would have been eligible under these rules"
+without touching the live application: scans are streamed read-only from the
+database in fixed-size chunks, screened with the batch evaluator and written to
+a separate results database with bulk inserts.
+
+Usage:
+    python rescreen_cohort.py --rules new_rules.json
+    python rescreen_cohort.py --database-url sqlite:///stroke.db --chunk-size 20000 \
+        --results-url sqlite:///rescreen_results.db
+"""
+
+import argparse
+import os
+import sys
+import time
+import uuid
+from datetime import datetime
+
+# Add the backend directory to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import (create_engine, select, func, and_, MetaData, Table, Column,
+                        Integer, String, Boolean, DateTime)
+
+from database import DATABASE_URL, create_database_engine
+from models import Patient, StrokeScan, NIHSSAssessment
+from eligibility_service import build_eligibility_data
+from tpa_eligibility import RULES_PATH, load_rule_set
+
+results_metadata = MetaData()
+rescreen_runs = Table(
+    "rescreen_runs", results_metadata,
+    Column("run_id", String, primary_key=True),
+    Column("rules_version", String),
+    Column("source_url", String),
+    Column("started_at", DateTime),
+    Column("finished_at", DateTime),
+    Column("scans_screened", Integer),
+    Column("scans_skipped", Integer),
+    Column("eligible", Integer),
+    Column("decisions_changed", Integer),
+)
+rescreen_results = Table(
+    "rescreen_results", results_metadata,
+    Column("id", Integer, primary_key=True),
+    Column("run_id", String, index=True),
+    Column("scan_id", Integer),
+    Column("patient_id", Integer),
+    Column("eligible", Boolean),
+    Column("reason", String),
+    Column("previously_eligible", Boolean),
+)
+
+
+def build_cohort_query():
+    """Every scan with its patient and the patient's latest NIHSS score."""
+    ranked_nihss = select(
+        NIHSSAssessment.patient_id,
+        NIHSSAssessment.total_score,
+        func.row_number().over(
+            partition_by=NIHSSAssessment.patient_id,
+            order_by=(NIHSSAssessment.timestamp.desc(), NIHSSAssessment.id.desc())
+        ).label("nihss_rank")
+    ).subquery()
+
+    # Column labels match the Patient/NIHSSAssessment attribute names so a row
+    # can be passed to build_eligibility_data directly
+    return select(
+        StrokeScan.id.label("scan_id"),
+        StrokeScan.patient_id,
+        StrokeScan.eligible.label("previously_eligible"),
+        StrokeScan.eligibility_inputs,
+        Patient.age,
+        Patient.inr,
+        Patient.heart_rate,
+        Patient.temperature,
+        Patient.oxygen_saturation,
+        Patient.systolic_bp,
+        Patient.diastolic_bp,
+        Patient.glucose,
+        Patient.platelet_count,
+        ranked_nihss.c.total_score,
+    ).join(
+        Patient, Patient.id == StrokeScan.patient_id
+    ).outerjoin(
+        ranked_nihss, and_(ranked_nihss.c.patient_id == Patient.id, ranked_nihss.c.nihss_rank == 1)
+    ).order_by(StrokeScan.id)
+
+
+def row_inputs(row):
+    """Stored inputs of the original assessment, else inputs rebuilt from the patient record."""
+    if row.eligibility_inputs:
+        return row.eligibility_inputs
+    if row.total_score is None or row.age is None:
+        return None
+    return build_eligibility_data(row, row)
+
+
+def rescreen(database_url: str, results_url: str, rules_path: str, chunk_size: int):
+    rule_set = load_rule_set(rules_path)
+    run_id = uuid.uuid4().hex
+    print(f"Run {run_id}: screening with rule set version {rule_set.version}")
+
+    source = create_database_engine(database_url)
+    results = create_engine(results_url)
+    results_metadata.create_all(results)
+
+    totals = {"screened": 0, "skipped": 0, "eligible": 0, "changed": 0}
+    started_at = datetime.now()
+    started = time.perf_counter()
+
+    with source.connect() as conn:
+        stream = conn.execution_options(stream_results=True, yield_per=chunk_size).execute(build_cohort_query())
+
+        for chunk in stream.partitions(chunk_size):
+            rows, inputs = [], []
+            for row in chunk:
+                data = row_inputs(row)
+                if data is None:
+                    totals["skipped"] += 1
+                    continue
+                rows.append(row)
+                inputs.append(data)
+            if not rows:
+                continue
+
+            eligible, reasons = rule_set.check_batch(inputs)
+            records = [
+                {
+                    "run_id": run_id,
+                    "scan_id": row.scan_id,
+                    "patient_id": row.patient_id,
+                    "eligible": bool(is_eligible),
+                    "reason": reason,
+                    "previously_eligible": row.previously_eligible,
+                }
+                for row, is_eligible, reason in zip(rows, eligible, reasons)
+            ]
+            with results.begin() as out:
+                out.execute(rescreen_results.insert(), records)
+
+            totals["screened"] += len(records)
+            totals["eligible"] += int(eligible.sum())
+            totals["changed"] += sum(1 for record in records
+                                     if record["previously_eligible"] is not None
+                                     and record["previously_eligible"] != record["eligible"])
+
+            elapsed = time.perf_counter() - started
+            print(f"  {totals['screened']:>10,} scans screened  "
+                  f"({totals['screened'] / elapsed:,.0f} rows/s)")
+
+    with results.begin() as out:
+        out.execute(rescreen_runs.insert(), {
+            "run_id": run_id,
+            "rules_version": rule_set.version,
+            "source_url": source.url.render_as_string(hide_password=True),
+            "started_at": started_at,
+            "finished_at": datetime.now(),
+            "scans_screened": totals["screened"],
+            "scans_skipped": totals["skipped"],
+            "eligible": totals["eligible"],
+            "decisions_changed": totals["changed"],
+        })
+
+    elapsed = time.perf_counter() - started
+    print("\n" + "=" * 60)
+    print(f"Rule set version:     {rule_set.version}")
+    print(f"Scans screened:       {totals['screened']:,}")
+    print(f"Skipped (no inputs):  {totals['skipped']:,}")
+    print(f"Eligible:             {totals['eligible']:,}")
+    print(f"Decision changed:     {totals['changed']:,}")
+    print(f"Elapsed:              {elapsed:.2f} s "
+          f"({totals['screened'] / elapsed if elapsed else 0:,.0f} rows/s)")
+    print(f"Results:              {results_url} (run_id={run_id})")
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-screen past scans for tPA eligibility")
+    parser.add_argument("--database-url", default=DATABASE_URL, help="database to read scans from")
+    parser.add_argument("--results-url", default="sqlite:///rescreen_results.db",
+                        help="separate database the results are written to")
+    parser.add_argument("--rules", default=RULES_PATH, help="rule table to screen against")
+    parser.add_argument("--chunk-size", type=int, default=10_000, help="rows fetched and inserted per batch")
+    args = parser.parse_args()
+
+    if args.results_url == args.database_url:
+        parser.error("--results-url must differ from --database-url")
+
+    rescreen(args.database_url, args.results_url, args.rules, args.chunk_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""
+Template-based treatment plan drafts
+
+Builds a structured plan from the eligibility result, vitals and NIHSS score
+without calling the AI model, in well under a millisecond.  Used as an instant
+first draft and as the fallback when the AI model is not configured, the
+circuit breaker is open or a call misses its deadline.  Plans are saved with
+source "rules" so physicians can tell which path produced them.
+
+The same inputs always give the same text.
+"""
+
+import os
+from typing import Any, Dict, List, Optional, Sequence
+
+from models import NIHSSAssessment, StrokeScan
+
+# Fall back to a rules-based draft when the AI model cannot answer
+PLAN_RULES_FALLBACK_ENABLED = os.getenv("PLAN_RULES_FALLBACK_ENABLED", "true").lower() == "true"
+
+# Bump when the templates below change
+RULES_PLAN_VERSION = "1"
+
+RULES_PLAN_HEADER = (
+    f"RULES-BASED DRAFT (generated from protocol templates v{RULES_PLAN_VERSION}, not by the AI model). "
+    "Review and adapt before use."
+)
+
+# Exclusion criterion id (tpa_rules.json) -> what the alternative care plan should address
+EXCLUSION_GUIDANCE = {
+    "onset_window": "Outside the thrombolysis window: assess for mechanical thrombectomy (up to 24 h with perfusion imaging).",
+    "inr": "Elevated INR: review anticoagulant history; consider reversal only if haemorrhage is confirmed.",
+    "anticoagulant_risk": "Anticoagulant use: document last dose and check anti-Xa / thrombin time where available.",
+    "platelet_count": "Low platelet count: repeat full blood count and review for underlying cause before antiplatelets.",
+    "blood_pressure": "Blood pressure above the thrombolysis threshold: see blood pressure targets below.",
+    "glucose": "Glucose outside the safe range: correct and reassess neurology, as glycaemic derangement can mimic stroke.",
+    "recent_surgery": "Recent surgery or organ biopsy: liaise with the operating team about bleeding risk.",
+    "recent_trauma": "Recent head or spinal trauma: exclude traumatic haemorrhage on imaging.",
+    "recent_stroke_or_injury": "Recent stroke or head injury: compare with prior imaging for haemorrhagic transformation.",
+    "intracranial_issue": "Intracranial haemorrhage, tumour or malformation: neurosurgical consultation.",
+    "recent_mi": "Recent myocardial infarction: cardiology review and ECG monitoring.",
+    "nihss_score": "Minor deficit (low NIHSS): dual antiplatelet therapy for 21 days if non-disabling.",
+    "imaging_confirmed": "Ischaemic stroke not confirmed: complete CT/MRI before further stroke-specific treatment.",
+    "consent": "Consent not obtained: revisit with patient or representative if treatment remains time-critical.",
+    "age": "Under 18: involve paediatric neurology.",
+}
+
+
+def nihss_severity(score: Optional[int]) -> str:
+    if score is None:
+        return "not recorded"
+    if score == 0:
+        return "no stroke symptoms"
+    if score <= 4:
+        return "minor stroke"
+    if score <= 15:
+        return "moderate stroke"
+    if score <= 20:
+        return "moderate to severe stroke"
+    return "severe stroke"
+
+
+def _value(data: Dict[str, Any], key: str, unit: str = "") -> str:
+    value = data.get(key)
+    return "not recorded" if value is None else f"{value}{unit}"
+
+
+def _vital_actions(patient_data: Dict[str, Any]) -> List[str]:
+    """Corrections for out-of-range vitals, in the order they should be addressed."""
+    actions = []
+    oxygen = patient_data.get("oxygen_saturation")
+    if oxygen is not None and oxygen < 94:
+        actions.append(f"SpO2 {oxygen}%: supplemental oxygen to keep saturation above 94%.")
+    glucose = patient_data.get("glucose")
+    if glucose is not None and glucose < 60:
+        actions.append(f"Glucose {glucose} mg/dL: correct hypoglycaemia now and recheck in 15 minutes.")
+    elif glucose is not None and glucose > 180:
+        actions.append(f"Glucose {glucose} mg/dL: insulin to a target of 140-180 mg/dL.")
+    temperature = patient_data.get("temperature")
+    if temperature is not None and temperature > 99.5:
+        actions.append(f"Temperature {temperature}°F: antipyretics and look for a source of infection.")
+    heart_rate = patient_data.get("heart_rate")
+    if heart_rate is not None and (heart_rate < 60 or heart_rate > 100):
+        actions.append(f"Heart rate {heart_rate} bpm: 12-lead ECG; screen for atrial fibrillation.")
+    return actions
+
+
+def _blood_pressure_plan(patient_data: Dict[str, Any], eligible: bool) -> List[str]:
+    systolic, diastolic = patient_data.get("systolic_bp"), patient_data.get("diastolic_bp")
+    recorded = systolic is not None and diastolic is not None
+    lines = [f"Current reading {_value(patient_data, 'systolic_bp')}/{_value(patient_data, 'diastolic_bp')} mmHg."]
+    if eligible:
+        if recorded and (systolic > 185 or diastolic > 110):
+            lines.append("Above the thrombolysis threshold: IV labetalol or nicardipine now.")
+        lines += ["Before thrombolysis: lower to below 185/110 mmHg and hold there.",
+                  "For 24 hours after thrombolysis: keep below 180/105 mmHg."]
+    else:
+        lines.append("Permissive hypertension: treat only above 220/120 mmHg, lowering by no more than 15% in 24 hours.")
+        if recorded and (systolic > 220 or diastolic > 120):
+            lines.append("Reading is above 220/120 mmHg: start IV antihypertensive therapy.")
+    return lines
+
+
+def generate_rules_plan(patient_data: Dict[str, Any], scan_data: Dict[str, Any],
+                        nihss_score: Optional[int] = None, exclusions: Sequence[str] = ()) -> str:
+    """
+    Treatment plan text for the inputs used by the AI prompt (see plan_inputs_for_scan),
+    plus the NIHSS total and the ids of failed tPA criteria when known.
+    """
+    eligible = bool(scan_data.get("eligible"))
+    sections = [RULES_PLAN_HEADER, ""]
+
+    sections += [
+        "1. Summary",
+        f"- Diagnosis: {scan_data.get('prediction') or 'not recorded'}",
+        f"- tPA assessment: {scan_data.get('eligibility_result') or 'not recorded'}",
+        f"- NIHSS: {nihss_score if nihss_score is not None else 'not recorded'} ({nihss_severity(nihss_score)})",
+        f"- Age {_value(patient_data, 'age')}, onset {_value(patient_data, 'time_since_onset')}",
+        "",
+        "2. Immediate interventions (first 24 hours)",
+        "- Airway, breathing and circulation; cardiac monitoring; neurological checks every 15 minutes.",
+        "- Nil by mouth until a swallow screen is passed.",
+    ]
+    sections += [f"- {action}" for action in _vital_actions(patient_data)]
+    sections += ["", "3. Blood pressure"] + [f"- {line}" for line in _blood_pressure_plan(patient_data, eligible)]
+
+    if eligible:
+        sections += [
+            "",
+            "4. Thrombolysis",
+            "- Alteplase 0.9 mg/kg (maximum 90 mg): 10% as a bolus over 1 minute, the rest over 60 minutes.",
+            "- Neurological checks every 15 minutes during the infusion and for 2 hours, then hourly to 24 hours.",
+            "- Stop the infusion and obtain an urgent CT for headache, vomiting or neurological decline.",
+            "- No antiplatelets or anticoagulants for 24 hours; repeat imaging before starting them.",
+        ]
+        if nihss_score is not None and nihss_score >= 6:
+            sections.append("- NIHSS 6 or more: CT angiography for large vessel occlusion and thrombectomy assessment.")
+    else:
+        sections += ["", "4. Alternative management"]
+        guidance = [EXCLUSION_GUIDANCE[criterion] for criterion in exclusions if criterion in EXCLUSION_GUIDANCE]
+        sections += [f"- {line}" for line in guidance] or ["- Review the documented contraindication to thrombolysis."]
+        sections += [
+            "- Aspirin 160-325 mg within 24-48 hours once haemorrhage is excluded.",
+            "- Venous thromboembolism prophylaxis with intermittent pneumatic compression.",
+        ]
+        if nihss_score is not None and nihss_score >= 6:
+            sections.append("- NIHSS 6 or more: assess for mechanical thrombectomy.")
+
+    sections += [
+        "",
+        "5. Secondary prevention",
+        "- High-intensity statin; antiplatelet therapy as above.",
+        "- Screen for atrial fibrillation (prolonged ECG monitoring); echocardiogram and carotid imaging.",
+        "- Blood pressure, diabetes and smoking cessation counselling before discharge.",
+        "",
+        "6. Rehabilitation and follow-up",
+        "- Early mobilisation once stable; physiotherapy, occupational and speech therapy assessment.",
+        "- Stroke clinic review within 2 weeks of discharge.",
+    ]
+    return "\n".join(sections)
+
+
+def rules_plan_extras(db, scan: StrokeScan) -> Dict[str, Any]:
+    """NIHSS total and failed criterion ids for a scan, as keyword arguments for generate_rules_plan."""
+    nihss_score = (scan.eligibility_inputs or {}).get("nhiss_score")
+    if nihss_score is None:
+        assessment = db.query(NIHSSAssessment).filter(
+            NIHSSAssessment.patient_id == scan.patient_id
+        ).order_by(NIHSSAssessment.timestamp.desc()).first()
+        nihss_score = assessment.total_score if assessment else None
+    return {
+        "nihss_score": nihss_score,
+        "exclusions": [failure["criterion"] for failure in scan.eligibility_failures or []],
+    }
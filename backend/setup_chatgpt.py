@@ -40,6 +40,10 @@ def create_env_file():
 # OpenAI API Configuration
 OPENAI_API_KEY=your_openai_api_key_here
 
+# Offline testing: run python mock_llm_server.py and uncomment
+# LLM_MOCK=true
+# MOCK_LLM_URL=http://127.0.0.1:8765/v1
+
 # Database Configuration
 DATABASE_URL=sqlite:///./stroke.db
 
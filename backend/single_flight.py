@@ -0,0 +1,84 @@
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Callable, Dict, Hashable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class SharedStream:
+    """
+    Runs one async iterator to completion in its own task and replays every
+    item to each subscriber, including ones that join after it started.
+    The producer keeps going if a subscriber disconnects.  If the producer
+    fails, every subscriber receives the items sent so far and then the
+    producer's exception.
+    """
+
+    def __init__(self, source: AsyncIterator):
+        self.items: List[Any] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self._changed = asyncio.Event()
+        self.task = asyncio.get_running_loop().create_task(self._pump(source))
+
+    async def _pump(self, source: AsyncIterator):
+        try:
+            async for item in source:
+                self.items.append(item)
+                self._notify()
+        except Exception as e:
+            logger.warning("Shared stream failed: %r", e)
+            self.error = e
+        finally:
+            self.done = True
+            self._notify()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def subscribe(self) -> AsyncIterator:
+        position = 0
+        while True:
+            while position < len(self.items):
+                yield self.items[position]
+                position += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await self._changed.wait()
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent streams with the same key onto one in-flight producer.
+    A key is free again as soon as its producer finishes.
+    """
+
+    def __init__(self):
+        self._streams: Dict[Hashable, SharedStream] = {}
+        self.started = 0
+        self.joined = 0
+
+    def in_flight(self, key: Hashable) -> bool:
+        return key in self._streams
+
+    def stream(self, key: Hashable, factory: Callable[[], AsyncIterator]) -> AsyncIterator:
+        """Subscribe to the stream running under key, starting factory() if there is none."""
+        shared = self._streams.get(key)
+        if shared is None:
+            shared = SharedStream(factory())
+            self._streams[key] = shared
+            shared.task.add_done_callback(lambda _: self._release(key, shared))
+            self.started += 1
+        else:
+            self.joined += 1
+        return shared.subscribe()
+
+    def _release(self, key: Hashable, shared: SharedStream):
+        if self._streams.get(key) is shared:
+            del self._streams[key]
+
+    def stats(self) -> Dict[str, int]:
+        return {"in_flight": len(self._streams), "started": self.started, "joined": self.joined}
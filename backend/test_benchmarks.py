@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Benchmark output schema test
+Runs benchmarks.py with small sizes and checks that its --json results have
+exactly the keys documented under "Benchmarks" in the top-level README, so
+result files from different releases stay comparable.
+
+Usage:
+    python -m pytest test_benchmarks.py
+    python test_benchmarks.py
+"""
+
+import json
+import os
+import sys
+
+# Add the backend directory to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from benchmarks import BENCHMARK_SCHEMA_VERSION, run_benchmarks
+
+TIMING = {"min_ms", "median_ms", "max_ms"}
+WORKLOAD = {"journal_mode", "reads_per_s", "writes_per_s", "locked_errors", "write_p95_ms"}
+
+# Keys of each section; the timing objects among them
+SCHEMA = {
+    "environment": ({"schema_version", "timestamp", "git_commit", "python", "platform"}, set()),
+    "tpa_eligibility": ({"rows", "rule_set_version", "legacy_chain", "compiled_rule_set", "all_failures",
+                         "batch_columnar"}, {"legacy_chain", "compiled_rule_set", "all_failures", "batch_columnar"}),
+    "upload_assembly": ({"rows", "build_eligibility_data", "build_and_apply_eligibility"},
+                        {"build_eligibility_data", "build_and_apply_eligibility"}),
+    "prompt_tokens": ({"cases", "tokenizer", "generation_tokens_legacy", "generation_tokens", "generation_reduction_pct",
+                       "refine_tokens_legacy", "refine_tokens", "refine_reduction_pct", "build_generation_prompts"},
+                      {"build_generation_prompts"}),
+    "sqlite_concurrency": ({"seconds", "reader_threads", "writer_threads"} |
+                           {f"{profile}_{key}" for profile in ("default", "production") for key in WORKLOAD}, set()),
+    "upload_request": ({"requests", "scan_bytes", "upload_scan"}, {"upload_scan"}),
+}
+
+
+def check_schema(results: dict):
+    assert set(results) == set(SCHEMA), sorted(results)
+    assert results["environment"]["schema_version"] == BENCHMARK_SCHEMA_VERSION
+    for name, section in results.items():
+        if section is None:
+            continue
+        keys, timings = SCHEMA[name]
+        assert set(section) == keys, (name, sorted(set(section) ^ keys))
+        for key in timings:
+            assert set(section[key]) == TIMING, (name, key)
+    json.dumps(results)
+
+
+def test_skipped_sections_keep_their_keys():
+    results = run_benchmarks(rows=200, uploads=0, db_seconds=0)
+    check_schema(results)
+    assert results["sqlite_concurrency"] is None and results["upload_request"] is None
+    assert isinstance(results["prompt_tokens"]["generation_reduction_pct"], float)
+
+
+def test_full_run_matches_the_schema():
+    check_schema(run_benchmarks(rows=200, uploads=2, db_seconds=0.2))
+
+
+def main():
+    for name, test in list(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print(f"✓ {name}")
+
+
+if __name__ == "__main__":
+    main()
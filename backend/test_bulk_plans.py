@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Bulk generation tests
+Checks that the bulk-generate endpoint rejects malformed options with 400
+before starting a run, and that a run cancelled at shutdown saves the plans
+it already generated and ends as "cancelled" instead of "running".  The
+review queue, the LLM and the plan inserts are replaced by stand-ins.
+
+Usage:
+    python -m pytest test_bulk_plans.py
+    python test_bulk_plans.py
+"""
+
+import asyncio
+import os
+import sys
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+# Add the backend directory to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import bulk_plans
+import upload_router
+from bulk_plans import BulkPlanRun
+
+
+def test_bad_options_are_rejected():
+    app = FastAPI()
+    app.include_router(upload_router.router)
+    client = TestClient(app)
+    for options in ({"concurrency": "many"}, {"concurrency": True}, {"batch_size": 2.5}, {"limit": 0},
+                    {"concurrency": -1}, {"rate_per_second": -1}, {"rate_per_second": "nan"}, {"limit": [5]}):
+        response = client.post("/api/treatment-plan/bulk-generate", json=options)
+        assert response.status_code == 400, (options, response.status_code, response.text)
+    assert not upload_router.bulk_plan_runs
+    assert upload_router._bulk_plan_options({"concurrency": "4", "rate_per_second": 0, "batch_size": 10.0}) == {
+        "concurrency": 4, "rate_per_second": 0.0, "batch_size": 10}
+
+
+class SlowService:
+    """Answers the first request at once and never answers the rest."""
+
+    def __init__(self):
+        self.calls = 0
+
+    async def request_treatment_plan(self, *args, usage=None):
+        self.calls += 1
+        if self.calls > 1:
+            await asyncio.sleep(3600)
+        return "Drafted plan"
+
+
+def test_shutdown_cancels_running_bulk_generation():
+    queue = [{"patient_id": i, "scan_id": i, "patient_data": {},
+              "scan_data": {"eligible": True, "eligibility_result": "Eligible"}} for i in range(3)]
+    saved = []
+    originals = bulk_plans.load_review_queue, bulk_plans.get_chatgpt_service, bulk_plans.save_plan_batch
+    bulk_plans.load_review_queue = lambda limit: queue
+    bulk_plans.get_chatgpt_service = SlowService
+    bulk_plans.save_plan_batch = lambda batch, created_by: saved.extend(item["scan_id"] for item in batch)
+
+    async def run():
+        bulk_run, not_started = BulkPlanRun(batch_size=10), BulkPlanRun()
+        for current in (bulk_run, not_started):
+            upload_router.bulk_plan_runs[current.id] = current
+            upload_router.bulk_plan_tasks[current.id] = asyncio.create_task(current.run())
+        upload_router.bulk_plan_tasks[not_started.id].cancel()
+        while bulk_run.generated < 1:
+            await asyncio.sleep(0.01)
+        await upload_router.stop_bulk_plan_runs()
+        return bulk_run, not_started
+
+    try:
+        bulk_run, not_started = asyncio.run(run())
+    finally:
+        bulk_plans.load_review_queue, bulk_plans.get_chatgpt_service, bulk_plans.save_plan_batch = originals
+        upload_router.bulk_plan_runs.clear()
+        upload_router.bulk_plan_tasks.clear()
+
+    # The generated plan is saved rather than dropped with the pending batch
+    assert saved == [0] and bulk_run.saved == 1
+    assert bulk_run.status == "cancelled" and bulk_run.finished_at is not None
+    assert not_started.status == "cancelled" and not_started.finished_at is not None
+
+
+def main():
+    for name, test in list(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print(f"✓ {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Incremental eligibility re-evaluation tests
+Checks that reevaluate_scan skips inputs whose hash is unchanged, that a
+re-evaluation touching a few fields (or a patient's cleared vitals) stores
+exactly what a full evaluation would, and that reevaluate_patient_scans
+never changes a scan that already carries a physician decision.
+
+Usage:
+    python -m pytest test_eligibility_service.py
+    python test_eligibility_service.py
+"""
+
+import os
+import random
+import sys
+
+from sqlalchemy.orm import sessionmaker
+
+# Add the backend directory to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from database import Base, create_database_engine
+from eligibility_service import (
+    FINAL_SCAN_STATUSES, PATIENT_ELIGIBILITY_FIELDS, apply_eligibility, build_eligibility_data,
+    patient_eligibility_inputs, reevaluate_patient_scans, reevaluate_scan
+)
+from models import NIHSSAssessment, Patient, StrokeScan
+from tpa_eligibility import TPARuleSet, get_tpa_rule_set
+from test_tpa_eligibility import eligible_row
+
+
+def assessed_scan(data: dict, **kwargs) -> StrokeScan:
+    return apply_eligibility(StrokeScan(**kwargs), dict(data), get_tpa_rule_set())
+
+
+def test_unchanged_inputs_are_skipped():
+    data = eligible_row(get_tpa_rule_set())
+    scan = assessed_scan({**data, "systolic_bp": 200})
+    failures, inputs_hash = scan.eligibility_failures, scan.eligibility_inputs_hash
+
+    assert reevaluate_scan(scan, {"systolic_bp": 200, "heart_rate": data["heart_rate"]}) is False
+    assert reevaluate_scan(scan, {}) is False
+    assert scan.eligibility_failures is failures and scan.eligibility_inputs_hash == inputs_hash
+    assert scan.eligible is False
+
+
+def test_new_rule_version_reevaluates_unchanged_inputs():
+    rule_set = get_tpa_rule_set()
+    table = {"version": "test-strict-bp", "eligible_message": rule_set.eligible_message,
+             "criteria": [dict(c) for c in rule_set.criteria if c["id"] != "blood_pressure"] + [{
+                 "id": "blood_pressure", "message": "Exclusion: SBP > 140",
+                 "checks": [{"field": "systolic_bp", "max": 140}]}]}
+    stricter = TPARuleSet(table)
+    scan = assessed_scan({**eligible_row(rule_set), "systolic_bp": 150})
+    assert scan.eligible is True
+
+    assert reevaluate_scan(scan, {}, stricter) is True
+    assert scan.eligible is False and scan.eligibility_rules_version == "test-strict-bp"
+    assert reevaluate_scan(scan, {}, stricter) is False
+
+
+def test_changed_inputs_match_a_full_evaluation():
+    rule_set = get_tpa_rule_set()
+    rng = random.Random(4)
+    base = eligible_row(rule_set)
+    numeric = [field for field in rule_set.fields if isinstance(base[field], (int, float))]
+    for _ in range(500):
+        scan = assessed_scan({field: value + rng.uniform(-60, 60) if field in numeric and rng.random() < 0.2
+                              else value for field, value in base.items()})
+        updates = {field: base[field] + rng.uniform(-60, 60) for field in rng.sample(numeric, rng.randint(1, 3))}
+        changed = reevaluate_scan(scan, updates, rule_set)
+        expected = assessed_scan({**scan.eligibility_inputs, **updates})
+        assert changed
+        assert scan.eligibility_failures == expected.eligibility_failures
+        assert (scan.eligible, scan.eligibility_result) == (expected.eligible, expected.eligibility_result)
+        assert scan.eligibility_inputs_hash == expected.eligibility_inputs_hash
+
+    # Patient edits, including vitals a nurse clears, give what a fresh evaluation of the patient gives
+    vitals = [attribute for attribute, _ in PATIENT_ELIGIBILITY_FIELDS.values()]
+    for _ in range(500):
+        patient = Patient(**{attribute: base[field] for field, (attribute, _) in PATIENT_ELIGIBILITY_FIELDS.items()})
+        nihss = NIHSSAssessment(total_score=rng.choice([None, 2, base["nhiss_score"]]))
+        scan = assessed_scan(build_eligibility_data(patient, nihss))
+        for attribute in rng.sample(vitals, rng.randint(1, 3)):
+            setattr(patient, attribute, rng.choice([None, 0, getattr(patient, attribute) + rng.uniform(-60, 60)]))
+        reevaluate_scan(scan, patient_eligibility_inputs(patient, nihss), rule_set)
+        expected = assessed_scan(build_eligibility_data(patient, nihss))
+        assert scan.eligibility_inputs == expected.eligibility_inputs
+        assert scan.eligibility_failures == expected.eligibility_failures
+        assert (scan.eligible, scan.eligibility_result) == (expected.eligible, expected.eligibility_result)
+
+
+def test_scans_without_stored_inputs_are_left_alone():
+    scan = StrokeScan(eligible=True, eligibility_result="Legacy result")
+    assert reevaluate_scan(scan, {"systolic_bp": 220}) is False
+    assert (scan.eligible, scan.eligibility_result) == (True, "Legacy result")
+
+
+def test_patient_changes_keep_final_statuses():
+    bind = create_database_engine("sqlite://")
+    Base.metadata.create_all(bind=bind)
+    db = sessionmaker(bind=bind)()
+    try:
+        data = eligible_row(get_tpa_rule_set())
+        patient = Patient(name="Reevaluation Test", code="REEVAL01",
+                          **{attribute: data[field] for field, (attribute, _) in PATIENT_ELIGIBILITY_FIELDS.items()})
+        db.add(patient)
+        db.flush()
+        statuses = [None, "pending", "saved", "ready_for_review", *FINAL_SCAN_STATUSES]
+        scans = {status: assessed_scan(data, patient_id=patient.id, status=status) for status in statuses}
+        db.add_all(scans.values())
+        db.commit()
+
+        patient.systolic_bp = 210
+        patient.glucose = None  # cleared by a nurse: falls back to the default, as in a fresh evaluation
+        nihss = NIHSSAssessment(patient_id=patient.id, total_score=2)
+        refreshed = reevaluate_patient_scans(db, patient, nihss)
+        db.commit()
+
+        assert refreshed == len(statuses) - len(FINAL_SCAN_STATUSES)
+        for status, scan in scans.items():
+            db.refresh(scan)
+            if status in FINAL_SCAN_STATUSES:
+                assert scan.eligible is True and scan.eligibility_inputs["systolic_bp"] == data["systolic_bp"], status
+            else:
+                assert [f["criterion"] for f in scan.eligibility_failures] == ["nihss_score", "blood_pressure"], status
+                assert scan.eligibility_inputs["systolic_bp"] == 210 and scan.eligibility_inputs["nhiss_score"] == 2
+                assert scan.eligibility_inputs["glucose"] == build_eligibility_data(patient, nihss)["glucose"]
+
+        # Saving the same vitals again changes nothing
+        assert reevaluate_patient_scans(db, patient, nihss) == 0
+    finally:
+        db.close()
+        bind.dispose()
+
+
+def main():
+    for name, test in list(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print(f"✓ {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -107,6 +107,7 @@ def main():
     print("=" * 60)
     print("This script tests the new /api/generate-treatment endpoint")
     print("Make sure your FastAPI server is running and OPENAI_API_KEY is set!")
+    print("(To test offline, run mock_llm_server.py and start the server with LLM_MOCK=true)")
     print()
     
     # Test with complete data
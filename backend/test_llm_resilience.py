@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Circuit breaker tests
+Walks the breaker through closed → open → half_open and checks that a
+half-open trial that fails with a bad request, a malformed response or a
+mid-stream error releases the trial instead of keeping every later call
+rejected, for both chat_completion and stream_chat_completion.
+
+Usage:
+    python -m pytest test_llm_resilience.py
+    python test_llm_resilience.py
+"""
+
+import asyncio
+import os
+import sys
+
+import httpx
+
+# Add the backend directory to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from chatgpt_service import ChatGPTTreatmentPlanService, LLMUnavailableError, OpenAIAPIError
+from llm_resilience import CircuitBreaker, CircuitOpenError
+
+MESSAGES = [{"role": "user", "content": "Plan"}]
+
+
+def tripped_service() -> ChatGPTTreatmentPlanService:
+    """A service whose breaker opened on one upstream failure and lets a trial through at once."""
+    service = ChatGPTTreatmentPlanService()
+    service.breaker = CircuitBreaker(failure_threshold=1, reset_seconds=0)
+    service.breaker.before_call()
+    service.breaker.record_failure()
+    assert service.breaker.state == "open"
+    return service
+
+
+def replies(*outcomes):
+    """Stands in for _post_chat_completion: returns or raises each outcome in turn."""
+    outcomes = list(outcomes)
+
+    async def post(*args):
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome, None
+    return post
+
+
+def stream_replies(*outcomes):
+    """Stands in for _stream_chat_completion: one fragment, then the outcome raised or streamed."""
+    outcomes = list(outcomes)
+
+    async def stream(*args):
+        outcome = outcomes.pop(0)
+        yield "fragment"
+        if isinstance(outcome, Exception):
+            raise outcome
+        yield outcome
+    return stream
+
+
+async def complete(service):
+    try:
+        return await service.chat_completion(MESSAGES, "gpt-3.5-turbo", 10, 0)
+    except Exception as e:
+        return e
+
+
+async def stream(service):
+    parts = []
+    try:
+        async for part in service.stream_chat_completion(MESSAGES, "gpt-3.5-turbo", 10, 0):
+            parts.append(part)
+    except Exception as e:
+        return e
+    return "".join(parts)
+
+
+def test_breaker_transitions():
+    breaker = CircuitBreaker(failure_threshold=2, reset_seconds=60)
+    for _ in range(2):
+        breaker.before_call()
+        breaker.record_failure()
+    assert breaker.state == "open"
+    try:
+        breaker.before_call()
+        raise AssertionError("an open breaker must reject calls")
+    except CircuitOpenError:
+        pass
+
+    breaker.reset_seconds = 0
+    breaker.before_call()
+    assert breaker.state == "half_open"
+    try:
+        breaker.before_call()
+        raise AssertionError("only one trial may run while half open")
+    except CircuitOpenError:
+        pass
+    breaker.record_abandoned()
+    breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.stats()["rejected"] == 2
+
+
+def test_failed_trial_reopens():
+    service = tripped_service()
+    service._post_chat_completion = replies(httpx.ConnectError("down"))
+    assert isinstance(asyncio.run(complete(service)), httpx.ConnectError)
+    assert service.breaker.state == "open" and service.breaker.times_opened == 2
+
+
+def test_bad_request_trial_is_released():
+    for error in (OpenAIAPIError("Invalid model", 400), KeyError("choices")):
+        service = tripped_service()
+        service._post_chat_completion = replies(error, "plan")
+        assert asyncio.run(complete(service)) is error
+        assert service.breaker.state == "half_open"
+        # Before the fix every later call was rejected with the circuit "open"
+        assert asyncio.run(complete(service)) == "plan"
+        assert service.breaker.state == "closed"
+
+
+def test_bad_stream_trial_is_released():
+    service = tripped_service()
+    service._stream_chat_completion = stream_replies(ValueError("unparseable chunk"), " done")
+    assert isinstance(asyncio.run(stream(service)), ValueError)
+    assert service.breaker.state == "half_open"
+    assert asyncio.run(stream(service)) == "fragment done"
+    assert service.breaker.state == "closed"
+
+
+def test_open_breaker_rejects_without_calling_upstream():
+    service = ChatGPTTreatmentPlanService()
+    service.breaker = CircuitBreaker(failure_threshold=1, reset_seconds=60)
+    service._post_chat_completion = replies(OpenAIAPIError("Service unavailable", 503))
+    assert asyncio.run(complete(service)).status_code == 503
+    assert isinstance(asyncio.run(complete(service)), LLMUnavailableError)
+    assert isinstance(asyncio.run(stream(service)), LLMUnavailableError)
+
+
+def main():
+    for name, test in list(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print(f"✓ {name}")
+
+
+if __name__ == "__main__":
+    main()
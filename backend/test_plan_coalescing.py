@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Concurrency test for single-flight treatment plan generation
+Fires many identical generate requests for one scan at a backend running
+against mock_llm_server.py and checks that they shared exactly one upstream
+LLM call and one saved treatment plan, for both the job and the streaming
+endpoint, and that a failing shared stream reaches every subscriber as an
+exception.
+
+Usage:
+    python test_plan_coalescing.py --concurrency 25
+"""
+
+import argparse
+import asyncio
+import json
+
+import httpx
+
+from load_test_llm import create_workspace, start_servers, stop_servers, create_scan
+
+
+def upstream_calls(mock_url: str) -> int:
+    return httpx.get(f"{mock_url}/mock/stats").json()["completions"]
+
+
+def saved_plans(base_url: str, code: str) -> list:
+    return httpx.get(f"{base_url}/api/patients/{code}/treatment-plans").json()
+
+
+async def generate_jobs(base_url: str, body: dict, concurrency: int) -> list:
+    """POST the same body concurrently, then poll each job; returns the finished jobs."""
+    async with httpx.AsyncClient(base_url=base_url, timeout=60.0,
+                                 limits=httpx.Limits(max_connections=concurrency)) as client:
+        async def run_job():
+            response = await client.post("/api/treatment-plan/generate", json=body)
+            response.raise_for_status()
+            status_url = response.json()["status_url"]
+            while True:
+                job = (await client.get(status_url)).json()
+                if job["status"] in ("succeeded", "failed", "cancelled"):
+                    return job
+                await asyncio.sleep(0.1)
+
+        return await asyncio.gather(*(run_job() for _ in range(concurrency)))
+
+
+async def generate_streams(base_url: str, body: dict, concurrency: int) -> list:
+    """Open the same stream concurrently; returns (plan text, done event) per request."""
+    async with httpx.AsyncClient(base_url=base_url, timeout=60.0,
+                                 limits=httpx.Limits(max_connections=concurrency)) as client:
+        async def read_stream():
+            tokens, done, event = [], None, None
+            async with client.stream("POST", "/api/treatment-plan/generate/stream", json=body) as response:
+                async for line in response.aiter_lines():
+                    if line.startswith("event:"):
+                        event = line[len("event:"):].strip()
+                    elif line.startswith("data:"):
+                        data = json.loads(line[len("data:"):])
+                        if event is None:
+                            tokens.append(data["token"])
+                        elif event == "done":
+                            done = data
+                        event = None
+            return "".join(tokens), done
+
+        return await asyncio.gather(*(read_stream() for _ in range(concurrency)))
+
+
+def test_shared_stream_failure_reaches_every_subscriber():
+    from single_flight import SharedStream, SingleFlight
+
+    async def failing_source():
+        yield "first"
+        await asyncio.sleep(0.05)
+        raise RuntimeError("upstream failed")
+
+    async def collect(stream):
+        items = []
+        try:
+            async for item in stream:
+                items.append(item)
+        except RuntimeError as e:
+            return items, str(e)
+        return items, None
+
+    async def run():
+        flights = SingleFlight()
+        results = await asyncio.gather(*(collect(flights.stream("key", failing_source)) for _ in range(3)))
+        # A subscriber of a stream that already failed sees the failure, not a clean end
+        shared = SharedStream(failing_source())
+        await shared.task
+        results.append(await collect(shared.subscribe()))
+        return results, flights.in_flight("key")
+
+    results, in_flight = asyncio.run(run())
+    assert results == [(["first"], "upstream failed")] * 4, results
+    assert not in_flight
+
+
+def test_concurrent_generate_requests_coalesce(concurrency: int = 20, latency: float = 1.0):
+    workspace = create_workspace()
+    processes, base_url, mock_url = start_servers(workspace, latency, 0.2, job_workers=4)
+    try:
+        with httpx.Client(base_url=base_url, timeout=30.0) as client:
+            job_scan = create_scan(client, "COAL0001")
+            stream_scan = create_scan(client, "COAL0002")
+
+        # regenerate skips the plan cache, so only coalescing can prevent duplicate calls
+        calls = upstream_calls(mock_url)
+        jobs = asyncio.run(generate_jobs(base_url, {
+            "patient_code": "COAL0001", "scan_id": job_scan, "physician_username": "test", "regenerate": True,
+        }, concurrency))
+        job_calls = upstream_calls(mock_url) - calls
+        job_plan_ids = {job["treatment_plan_id"] for job in jobs}
+        print(f"jobs:    {concurrency} requests -> {job_calls} upstream call(s), plan ids {sorted(job_plan_ids)}")
+        assert all(job["status"] == "succeeded" for job in jobs), jobs
+        assert job_calls == 1, f"expected 1 upstream call, got {job_calls}"
+        assert len(job_plan_ids) == 1 and len(saved_plans(base_url, "COAL0001")) == 1
+
+        calls = upstream_calls(mock_url)
+        streams = asyncio.run(generate_streams(base_url, {
+            "patient_code": "COAL0002", "scan_id": stream_scan, "physician_username": "test", "regenerate": True,
+        }, concurrency))
+        stream_calls = upstream_calls(mock_url) - calls
+        stream_plan_ids = {done["treatment_plan_id"] for _, done in streams if done}
+        print(f"streams: {concurrency} requests -> {stream_calls} upstream call(s), plan ids {sorted(stream_plan_ids)}")
+        assert all(done for _, done in streams), "a stream ended without a done event"
+        assert len({text for text, _ in streams}) == 1, "streams received different plan text"
+        assert stream_calls == 1, f"expected 1 upstream call, got {stream_calls}"
+        assert len(stream_plan_ids) == 1 and len(saved_plans(base_url, "COAL0002")) == 1
+    finally:
+        stop_servers(processes, workspace)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that identical concurrent plan requests share one LLM call")
+    parser.add_argument("--concurrency", type=int, default=20, help="identical requests per endpoint")
+    parser.add_argument("--latency", type=float, default=1.0, help="mock LLM response time in seconds")
+    args = parser.parse_args()
+
+    test_concurrent_generate_requests_coalesce(args.concurrency, args.latency)
+    print("✅ Concurrent requests were coalesced")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Index usage test for the hot queries
+Builds a SQLite database as it looked before the index migration, applies
+migrations.py, and checks with EXPLAIN QUERY PLAN that each query the
+dashboards, review queues and plan endpoints run most often is answered from
+its index instead of a full table scan.
+
+Usage:
+    python -m pytest test_query_indexes.py
+    python test_query_indexes.py              # also prints the plans before the migration
+"""
+
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import sessionmaker
+
+# Add the backend directory to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from database import Base
+from db_testing import temporary_database
+from models import NIHSSAssessment, Patient, StrokeScan, TreatmentPlan, TreatmentPlanJob
+from migrations import MIGRATIONS, run_migrations
+
+NEW_INDEXES = [
+    "ix_patients_linked_user_id",
+    "ix_strokescans_patient_id_timestamp",
+    "ix_strokescans_status_timestamp",
+    "ix_strokescans_eligible",
+    "ix_strokescans_timestamp",
+    "ix_nihssassessments_patient_id_timestamp",
+    "ix_treatmentplans_patient_id_created_at",
+    "ix_treatmentplans_scan_id",
+    "ix_treatmentplanjobs_scan_id_status",
+]
+
+
+# (description, query runner taking a session, index it should use), written as the endpoints write them
+TODAY = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+HOT_QUERIES = [
+    ("scans of a patient, newest first",
+     lambda db: db.query(StrokeScan).filter(StrokeScan.patient_id == 7).order_by(StrokeScan.timestamp.desc()).all(),
+     "ix_strokescans_patient_id_timestamp"),
+    ("latest NIHSS assessment",
+     lambda db: db.query(NIHSSAssessment).filter(NIHSSAssessment.patient_id == 7).order_by(
+         NIHSSAssessment.timestamp.desc()).first(),
+     "ix_nihssassessments_patient_id_timestamp"),
+    ("review queue",
+     lambda db: db.query(StrokeScan).filter(StrokeScan.status == "ready_for_review").all(),
+     "ix_strokescans_status_timestamp"),
+    ("reviewed today",
+     lambda db: db.query(StrokeScan).filter(StrokeScan.status == "reviewed", StrokeScan.timestamp >= TODAY).count(),
+     "ix_strokescans_status_timestamp"),
+    ("eligible count",
+     lambda db: db.query(StrokeScan).filter(StrokeScan.eligible == True).count(),
+     "ix_strokescans_eligible"),
+    ("scans in the last week",
+     lambda db: db.query(StrokeScan).filter(StrokeScan.timestamp >= TODAY - timedelta(days=7)).count(),
+     "ix_strokescans_timestamp"),
+    ("patient of a user account",
+     lambda db: db.query(Patient).filter(Patient.linked_user_id == 7).first(),
+     "ix_patients_linked_user_id"),
+    ("plans of a patient, newest first",
+     lambda db: db.query(TreatmentPlan).filter(TreatmentPlan.patient_id == 7).order_by(
+         TreatmentPlan.created_at.desc()).all(),
+     "ix_treatmentplans_patient_id_created_at"),
+    ("plan of a scan",
+     lambda db: db.query(TreatmentPlan).filter(TreatmentPlan.scan_id == 7).first(),
+     "ix_treatmentplans_scan_id"),
+    ("in-flight job for a scan",
+     lambda db: db.query(TreatmentPlanJob.id).filter(
+         TreatmentPlanJob.scan_id == 7, TreatmentPlanJob.status.in_(("queued", "running"))).first(),
+     "ix_treatmentplanjobs_scan_id_status"),
+]
+
+
+def query_plan(bind, run) -> str:
+    """EXPLAIN QUERY PLAN of the SELECT statements run(db) executes, with their real parameters."""
+    details = []
+
+    def explain(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            rows = cursor.connection.execute("EXPLAIN QUERY PLAN " + statement, parameters).fetchall()
+            details.extend(row[-1] for row in rows)
+
+    db = sessionmaker(bind=bind)()
+    event.listen(bind, "before_cursor_execute", explain)
+    try:
+        run(db)
+    finally:
+        event.remove(bind, "before_cursor_execute", explain)
+        db.close()
+    return " | ".join(details)
+
+
+def seed(db, patients: int = 300, scans_per_patient: int = 10):
+    rng = random.Random(7)
+    now = datetime.now()
+    for p in range(patients):
+        patient = Patient(name=f"Index Test {p}", age=rng.randint(30, 90), code=f"IDX{p:05d}", linked_user_id=p)
+        db.add(patient)
+        db.flush()
+        for s in range(scans_per_patient):
+            when = now - timedelta(hours=rng.randint(0, 24 * 60))
+            scan = StrokeScan(patient_id=patient.id, timestamp=when, eligible=rng.random() < 0.4,
+                              status=rng.choice(["pending", "saved", "ready_for_review", "reviewed"]))
+            db.add(scan)
+            db.flush()
+            db.add(NIHSSAssessment(patient_id=patient.id, total_score=rng.randint(0, 30), timestamp=when))
+            db.add(TreatmentPlan(patient_id=patient.id, scan_id=scan.id, created_at=when, status="draft"))
+            db.add(TreatmentPlanJob(id=f"{patient.id}-{scan.id}", patient_id=patient.id, scan_id=scan.id,
+                                    status=rng.choice(["succeeded", "failed", "queued"]), created_at=when))
+    db.commit()
+
+
+def build_old_database(bind):
+    """A seeded database created before the migration: same tables, none of the new indexes."""
+    Base.metadata.create_all(bind=bind)
+    with bind.begin() as conn:
+        for name in NEW_INDEXES:
+            conn.exec_driver_sql(f"DROP INDEX {name}")
+    db = sessionmaker(bind=bind)()
+    try:
+        seed(db)
+    finally:
+        db.close()
+
+
+@pytest.fixture(scope="module")
+def migrated():
+    """(engine, versions applied) for an old database brought up to date by run_migrations."""
+    with temporary_database("stroke-index-") as bind:
+        build_old_database(bind)
+        yield bind, run_migrations(bind)
+
+
+def test_migrations_create_every_index(migrated):
+    bind, applied = migrated
+    assert applied == [version for version, _, _ in MIGRATIONS], applied
+    assert run_migrations(bind) == [], "migrations must only run once"
+    existing = {index["name"] for table in inspect(bind).get_table_names()
+                for index in inspect(bind).get_indexes(table)}
+    missing = set(NEW_INDEXES) - existing
+    assert not missing, f"migration did not create {sorted(missing)}"
+
+
+@pytest.mark.parametrize("description, run, index", HOT_QUERIES, ids=[query[0] for query in HOT_QUERIES])
+def test_hot_query_uses_its_index(migrated, description, run, index):
+    plan = query_plan(migrated[0], run)
+    assert f"INDEX {index}" in plan, f"{description}: {plan}"
+
+
+def main():
+    with temporary_database("stroke-index-") as bind:
+        build_old_database(bind)
+        print("Before the migration")
+        for description, run, _ in HOT_QUERIES:
+            print(f"  {description:<34} {query_plan(bind, run)}")
+
+        run_migrations(bind)
+        print("\nAfter the migration")
+        failures = 0
+        for description, run, index in HOT_QUERIES:
+            plan = query_plan(bind, run)
+            uses_index = f"INDEX {index}" in plan
+            failures += not uses_index
+            print(f"  {'✓' if uses_index else '✗'} {description:<32} {plan}")
+
+    if failures:
+        raise SystemExit(f"{failures} hot queries do not use their index")
+    print("\n✓ Every hot query uses its index")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+"""
+tPA eligibility engine tests
+Checks that the vectorized batch evaluator reports the same eligibility and
+reason as the scalar check, on random rows and on edge rows built from the
+rule table: values exactly at and just beyond every threshold, missing
+fields, and yes/no answers spelled as other strings or booleans.  Also
+checks that evaluate reports every failing criterion, not just the first,
+that a hot reload swaps in a valid rule table but rejects a broken one and
+keeps the active rules, and that the counterfactual sweep suggests exactly
+the minimal, closest corrections a brute-force search finds and reports a
+criterion blocked when a correctable input it reads was never recorded.
+
+Usage:
+    python -m pytest test_tpa_eligibility.py
+    python test_tpa_eligibility.py --rows 100000
+"""
+
+import argparse
+import copy
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+
+# Add the backend directory to Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+
+from tpa_eligibility import (
+    CORRECTABLE_INPUTS, RULES_PATH, TPARuleSet, check_tpa_eligibility, find_eligibility_counterfactuals,
+    get_tpa_rule_set, reload_tpa_rules
+)
+
+# Answers a yes/no field may arrive as from forms, imports and older records
+YES_NO_SPELLINGS = ["yes", "no", "Yes", "NO", "true", "false", "", " yes", True, False, None]
+
+
+def eligible_row(rule_set: TPARuleSet) -> dict:
+    """A row that passes every criterion: each numeric value mid-range, each text value as required."""
+    row = {}
+    for criterion in rule_set.criteria:
+        for check in criterion["checks"]:
+            field = check["field"]
+            if "equals" in check:
+                row[field] = check["equals"]
+            elif "not_equals" in check:
+                row[field] = "no" if check["not_equals"] == "yes" else "yes"
+            elif "between" in check:
+                row[field] = sum(check["between"]) / 2
+            elif "max" in check and "min" in check:
+                row[field] = (check["max"] + check["min"]) / 2
+            elif "max" in check:
+                row[field] = check["max"] - 1
+            else:
+                row[field] = check["min"] + 1
+    return row
+
+
+def random_rows(rule_set: TPARuleSet, count: int, seed: int = 1) -> list:
+    """Rows with some fields moved near or past their thresholds, so most rows fail one or more criteria."""
+    rng = random.Random(seed)
+    base = eligible_row(rule_set)
+    rows = []
+    for _ in range(count):
+        row = dict(base)
+        for criterion in rule_set.criteria:
+            for check in criterion["checks"]:
+                field = check["field"]
+                if rng.random() > 0.15:
+                    continue
+                if "equals" in check or "not_equals" in check:
+                    row[field] = rng.choice(["yes", "no", "no", "yes"])
+                else:
+                    bounds = check.get("between") or [check[op] for op in ("min", "max") if op in check]
+                    row[field] = round(rng.uniform(min(bounds) - 10, max(bounds) + 10), 1)
+        rows.append(row)
+    return rows
+
+
+def edge_rows(rule_set: TPARuleSet) -> list:
+    base = eligible_row(rule_set)
+    rows = [dict(base)]
+    for criterion in rule_set.criteria:
+        for check in criterion["checks"]:
+            field = check["field"]
+            if "equals" in check or "not_equals" in check:
+                values = YES_NO_SPELLINGS
+            else:
+                bounds = check.get("between") or [check[op] for op in ("min", "max") if op in check]
+                values = [value for bound in bounds for value in (bound, bound - 0.1, bound + 0.1, int(bound))]
+                values += [None, float("nan"), 0, -1]
+            for value in values:
+                rows.append({**base, field: value})
+            missing = dict(base)
+            del missing[field]
+            rows.append(missing)
+    return rows
+
+
+def assert_batch_matches_scalar(rule_set: TPARuleSet, rows: list):
+    eligible, reasons = rule_set.check_batch(rows)
+    for index, row in enumerate(rows):
+        expected = rule_set.check(row)
+        assert (bool(eligible[index]), reasons[index]) == expected, f"row {index} {row}: batch " \
+            f"{(bool(eligible[index]), reasons[index])} != scalar {expected}"
+        assert rule_set.summarize(rule_set.evaluate(row)) == expected, f"row {index} {row}: evaluate disagrees"
+
+
+def test_batch_matches_scalar_on_random_rows():
+    rule_set = get_tpa_rule_set()
+    rows = random_rows(rule_set, 5000)
+    assert_batch_matches_scalar(rule_set, rows)
+    eligible, _ = rule_set.check_batch(rows)
+    assert 0 < eligible.sum() < len(rows), "random rows should include eligible and ineligible patients"
+
+
+def test_batch_matches_scalar_on_edge_rows():
+    rule_set = get_tpa_rule_set()
+    assert_batch_matches_scalar(rule_set, edge_rows(rule_set))
+
+
+def test_thresholds_are_inclusive_and_missing_values_fail():
+    rule_set = get_tpa_rule_set()
+    base = eligible_row(rule_set)
+    assert rule_set.check(base)[0]
+    assert rule_set.check({**base, "hours_since_onset": 4.5})[0], "4.5 h is still inside the window"
+    assert not rule_set.check({**base, "hours_since_onset": 4.6})[0]
+    assert rule_set.check({**base, "heart_rate": 60})[0] and rule_set.check({**base, "heart_rate": 100})[0]
+    for missing in ({**base, "nhiss_score": None}, {k: v for k, v in base.items() if k != "nhiss_score"}):
+        eligible, reason = rule_set.check(missing)
+        assert not eligible and "NIHSS" in reason
+    assert not rule_set.check({**base, "consent": "Yes"})[0], "answers are compared exactly"
+
+
+def test_columnar_input_matches_row_input():
+    rule_set = get_tpa_rule_set()
+    rows = random_rows(rule_set, 500, seed=2) + edge_rows(rule_set)
+    columns = {field: [row.get(field) for row in rows] for field in rule_set.fields}
+    from_rows, from_columns = rule_set.check_batch(rows), rule_set.check_batch(columns)
+    assert (from_rows[0] == from_columns[0]).all() and (from_rows[1] == from_columns[1]).all()
+
+
+def test_evaluate_reports_every_failing_criterion():
+    rule_set = get_tpa_rule_set()
+    base = eligible_row(rule_set)
+    assert rule_set.evaluate(base) == []
+
+    row = {**base, "hours_since_onset": 6, "consent": "no", "systolic_bp": 200, "glucose": 30}
+    failures = rule_set.evaluate(row)
+    assert [failure["criterion"] for failure in failures] == ["onset_window", "consent", "blood_pressure", "glucose"]
+    # The first failure is the reason the single-reason check reports
+    assert rule_set.summarize(failures) == rule_set.check(row) == (False, failures[0]["message"])
+
+    blood_pressure = failures[2]
+    assert blood_pressure["observed"] == {"systolic_bp": 200, "diastolic_bp": base["diastolic_bp"]}
+    assert blood_pressure["threshold"] == {"systolic_bp": {"max": 185}, "diastolic_bp": {"max": 110}}
+
+
+def test_apply_eligibility_stores_all_failures():
+    from eligibility_service import apply_eligibility
+    from models import StrokeScan
+
+    rule_set = get_tpa_rule_set()
+    row = {**eligible_row(rule_set), "age": 16, "platelet_count": 50}
+    scan = apply_eligibility(StrokeScan(), row, rule_set)
+    assert scan.eligible is False
+    assert [failure["criterion"] for failure in scan.eligibility_failures] == ["age", "platelet_count"]
+    assert scan.eligibility_result == scan.eligibility_failures[0]["message"]
+    assert scan.eligibility_rules_version == rule_set.version
+
+
+def broken_rule_tables(table: dict) -> dict:
+    """Description -> rule table (or raw file text) that reload_tpa_rules must reject."""
+    def changed(edit):
+        broken = copy.deepcopy(table)
+        edit(broken)
+        return broken
+
+    return {
+        "invalid JSON": json.dumps(table)[:-2],
+        "not an object": [table],
+        "no version": changed(lambda t: t.pop("version")),
+        "no criteria": changed(lambda t: t.update(criteria=[])),
+        "criteria not a list": changed(lambda t: t.update(criteria={"age": {}})),
+        "duplicate id": changed(lambda t: t["criteria"].append(dict(t["criteria"][0]))),
+        "unknown operator": changed(lambda t: t["criteria"][0]["checks"][0].update(above=4.5)),
+        "text bound on max": changed(lambda t: t["criteria"][0]["checks"][0].update(max="4.5")),
+        "NaN bound": changed(lambda t: t["criteria"][0]["checks"][0].update(max=float("nan"))),
+        "between with one bound": changed(lambda t: t["criteria"][6]["checks"][0].update(between=[60])),
+        "numeric and text bounds": changed(lambda t: t["criteria"][0]["checks"][0].update(equals="yes")),
+        "check without field": changed(lambda t: t["criteria"][0]["checks"][0].pop("field")),
+        "checks not a list": changed(lambda t: t["criteria"][0].update(checks="hours_since_onset")),
+        "criterion without message": changed(lambda t: t["criteria"][0].pop("message")),
+    }
+
+
+def write_rule_table(directory: str, table) -> str:
+    path = os.path.join(directory, "tpa_rules.json")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(table if isinstance(table, str) else json.dumps(table))
+    return path
+
+
+def test_reload_swaps_in_a_valid_table():
+    with open(RULES_PATH, encoding="utf-8") as f:
+        table = json.load(f)
+    table["version"] = "test-wider-window"
+    table["criteria"][0]["checks"][0]["max"] = 6
+    previous = get_tpa_rule_set()
+    row = {**eligible_row(previous), "hours_since_onset": 5}
+    with tempfile.TemporaryDirectory() as directory:
+        try:
+            reloaded = reload_tpa_rules(write_rule_table(directory, table))
+            assert get_tpa_rule_set() is reloaded and reloaded.version == "test-wider-window"
+            assert check_tpa_eligibility(row)[0], "the reloaded 6 h window applies at once"
+            assert not previous.check(row)[0], "a rule set fetched before the reload keeps its thresholds"
+        finally:
+            reload_tpa_rules()
+    assert get_tpa_rule_set().version == previous.version
+
+
+def test_reload_rejects_invalid_tables_and_keeps_the_active_one():
+    with open(RULES_PATH, encoding="utf-8") as f:
+        table = json.load(f)
+    active = get_tpa_rule_set()
+    with tempfile.TemporaryDirectory() as directory:
+        for description, broken in broken_rule_tables(table).items():
+            try:
+                reload_tpa_rules(write_rule_table(directory, broken))
+            except ValueError:
+                pass
+            else:
+                raise AssertionError(f"{description}: the rule table was accepted")
+            assert get_tpa_rule_set() is active, f"{description}: the active rule set was replaced"
+        try:
+            reload_tpa_rules(os.path.join(directory, "missing.json"))
+        except OSError:
+            pass
+        else:
+            raise AssertionError("a missing rule file was accepted")
+    assert get_tpa_rule_set() is active
+
+
+def brute_force_counterfactuals(rule_set: TPARuleSet, data: dict) -> dict:
+    """Changed fields -> smallest distance, for every minimal set of changes, by checking each grid point."""
+    fields = list(CORRECTABLE_INPUTS)
+    axes = [np.union1d(np.arange(spec["low"], spec["high"] + spec["step"], spec["step"]), [data[field]])
+            for field, spec in CORRECTABLE_INPUTS.items()]
+    best = {}
+    for point in itertools.product(*axes):
+        candidate = {**data, **dict(zip(fields, point))}
+        if not rule_set.check(candidate)[0]:
+            continue
+        changed = frozenset(field for field, value in zip(fields, point) if value != data[field])
+        distance = sum(abs(value - data[field]) / CORRECTABLE_INPUTS[field]["step"] for field, value in zip(fields, point))
+        best[changed] = min(distance, best.get(changed, distance))
+    return {changed: distance for changed, distance in best.items() if not any(other < changed for other in best)}
+
+
+def test_counterfactuals_are_minimal_and_closest():
+    rule_set = get_tpa_rule_set()
+    base = eligible_row(rule_set)
+    rng = random.Random(5)
+    patients = [{**base, "systolic_bp": 200}, {**base, "systolic_bp": 200, "glucose": 450},
+                {**base, "diastolic_bp": 125, "glucose": 30}]
+    patients += [{**base, "systolic_bp": rng.randint(150, 240), "diastolic_bp": rng.randint(70, 140),
+                  "glucose": rng.choice([rng.randint(20, 60), rng.randint(380, 520)])} for _ in range(4)]
+    for data in patients:
+        result = find_eligibility_counterfactuals(data, rule_set, limit=100)
+        expected = brute_force_counterfactuals(rule_set, data)
+        found = {frozenset(s["changes"]): s["distance"] for s in result["suggestions"]}
+        assert set(found) == set(expected), f"{data}: suggested {set(found)}, minimal {set(expected)}"
+        assert all(abs(found[key] - expected[key]) < 1e-9 for key in found), f"{data}: {found} != {expected}"
+        for suggestion in result["suggestions"]:
+            corrected = {**data, **{field: change["to"] for field, change in suggestion["changes"].items()}}
+            assert rule_set.check(corrected)[0], f"suggestion {suggestion} does not make {data} eligible"
+
+    # A raised SBP alone needs one change: down to the 185 mmHg limit, three 5 mmHg steps
+    result = find_eligibility_counterfactuals({**base, "systolic_bp": 200}, rule_set)
+    assert result["suggestions"] == [{"changes": {"systolic_bp": {"from": 200, "to": 185.0}}, "distance": 3.0}]
+    distances = [s["distance"] for s in find_eligibility_counterfactuals(patients[-1], rule_set)["suggestions"]]
+    assert distances == sorted(distances)
+
+
+def test_counterfactuals_for_eligible_and_blocked_patients():
+    rule_set = get_tpa_rule_set()
+    base = eligible_row(rule_set)
+    eligible = find_eligibility_counterfactuals(base, rule_set)
+    assert eligible["eligible"] and eligible["suggestions"] == [] and eligible["candidates_evaluated"] == 0
+
+    # Consent cannot be corrected by the sweep, so no change to vitals is suggested
+    blocked = find_eligibility_counterfactuals({**base, "consent": "no", "systolic_bp": 200}, rule_set)
+    assert not blocked["eligible"] and blocked["suggestions"] == []
+    assert [f["criterion"] for f in blocked["blocking_failures"]] == ["consent"]
+
+
+def test_counterfactuals_with_missing_correctable_inputs():
+    rule_set = get_tpa_rule_set()
+    base = eligible_row(rule_set)
+    # Scans from the legacy upload form store no diastolic BP; there is nothing to change it from
+    for inputs in ({k: v for k, v in base.items() if k != "diastolic_bp"}, {**base, "diastolic_bp": None},
+                   {**base, "diastolic_bp": float("nan")}):
+        blocked = find_eligibility_counterfactuals({**inputs, "systolic_bp": 200}, rule_set)
+        assert not blocked["eligible"] and blocked["suggestions"] == []
+        assert [f["criterion"] for f in blocked["blocking_failures"]] == ["blood_pressure"]
+
+    # A missing input blocks only the criteria that read it
+    result = find_eligibility_counterfactuals({**base, "glucose": None, "systolic_bp": 200}, rule_set)
+    assert [f["criterion"] for f in result["blocking_failures"]] == ["glucose"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the batch tPA evaluator against the scalar check")
+    parser.add_argument("--rows", type=int, default=20000, help="random rows to compare")
+    args = parser.parse_args()
+
+    rule_set = get_tpa_rule_set()
+    rows = random_rows(rule_set, args.rows)
+    edges = edge_rows(rule_set)
+    assert_batch_matches_scalar(rule_set, rows)
+    assert_batch_matches_scalar(rule_set, edges)
+    print(f"✓ Batch and scalar checks agree on {len(rows):,} random and {len(edges):,} edge rows")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,49 +1,461 @@
-from typing import Tuple
+import json
+import math
+import os
+import threading
+from typing import Dict, List, Mapping, Sequence, Tuple, Union
 
+import numpy as np
+
+# The eligibility protocol lives in a versioned rule table so thresholds can be
+# changed without a redeploy.  TPA_RULES_PATH points at an alternative table.
+RULES_PATH = os.getenv("TPA_RULES_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "tpa_rules.json"))
+
+# Each criterion lists the checks that make it fail; the first failing criterion
+# in table order is the reported reason.  "max"/"min" fail when the value is
+# beyond the bound, "between" fails unless the value lies inside the inclusive
+# range, "equals" fails when the value differs and "not_equals" fails when it
+# matches.  A missing numeric value (absent, None or NaN) fails its check, since
+# eligibility cannot be confirmed without it; a missing text value is compared
+# as None.
+_NUMERIC_OPS = ("max", "min", "between")
+_TEXT_OPS = ("equals", "not_equals")
+
+
+# -----------------------------
+# RULE TABLE COMPILATION
+# -----------------------------
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+
+def _validate_rule_table(table: dict) -> None:
+    if not isinstance(table, dict):
+        raise ValueError("Rule table must be a JSON object")
+    if not isinstance(table.get("version"), str) or not table["version"]:
+        raise ValueError("Rule table must have a non-empty string 'version'")
+    if not isinstance(table.get("eligible_message"), str):
+        raise ValueError("Rule table must have an 'eligible_message'")
+
+    if not isinstance(table.get("criteria"), list) or not all(isinstance(c, dict) for c in table["criteria"]):
+        raise ValueError("Rule table 'criteria' must be a list of objects")
+
+    seen = set()
+    for criterion in table["criteria"]:
+        criterion_id = criterion.get("id")
+        if not isinstance(criterion_id, str) or criterion_id in seen:
+            raise ValueError(f"Criterion id must be a unique string: {criterion_id!r}")
+        seen.add(criterion_id)
+        if not isinstance(criterion.get("message"), str):
+            raise ValueError(f"Criterion '{criterion_id}' must have a message")
+        if not criterion.get("checks"):
+            raise ValueError(f"Criterion '{criterion_id}' has no checks")
+        if not isinstance(criterion["checks"], list) or not all(isinstance(c, dict) for c in criterion["checks"]):
+            raise ValueError(f"Criterion '{criterion_id}' checks must be a list of objects")
+
+        for check in criterion["checks"]:
+            if not isinstance(check.get("field"), str):
+                raise ValueError(f"Criterion '{criterion_id}' has a check without a field")
+            ops = [op for op in check if op != "field"]
+            if not ops:
+                raise ValueError(f"Criterion '{criterion_id}' has a check without a bound")
+            for op in ops:
+                bound = check[op]
+                if op in ("max", "min"):
+                    valid = _is_number(bound)
+                elif op == "between":
+                    valid = isinstance(bound, list) and len(bound) == 2 and all(_is_number(b) for b in bound)
+                elif op in _TEXT_OPS:
+                    valid = isinstance(bound, str)
+                else:
+                    raise ValueError(f"Criterion '{criterion_id}' uses unknown operator '{op}'")
+                if not valid:
+                    raise ValueError(f"Criterion '{criterion_id}' has an invalid '{op}' bound: {bound!r}")
+            if any(op in _TEXT_OPS for op in ops) and any(op in _NUMERIC_OPS for op in ops):
+                raise ValueError(f"Criterion '{criterion_id}' mixes numeric and text bounds on one field")
+
+    if not seen:
+        raise ValueError("Rule table has no criteria")
+
+
+def _check_source(check: dict, guarded: bool) -> str:
+    """
+    Python expression that is true when the check fails.
+
+    Numeric bounds are written as "not inside the bound", so NaN fails them.
+    The plain form raises KeyError or TypeError on a missing or None value;
+    the guarded form fails the check instead.
+    """
+    field = check["field"]
+    value = f"data[{field!r}]"
+    conditions = []
+    if guarded:
+        value = f"data.get({field!r})"
+        if any(op in check for op in _NUMERIC_OPS):
+            conditions.append(f"(value := {value}) is None")
+            value = "value"
+    if "max" in check:
+        conditions.append(f"not ({value} <= {check['max']!r})")
+    if "min" in check:
+        conditions.append(f"not ({value} >= {check['min']!r})")
+    if "between" in check:
+        low, high = check["between"]
+        conditions.append(f"not ({low!r} <= {value} <= {high!r})")
+    if "equals" in check:
+        conditions.append(f"{value} != {check['equals']!r}")
+    if "not_equals" in check:
+        conditions.append(f"{value} == {check['not_equals']!r}")
+    return " or ".join(conditions)
+
+
+def _compile(criteria: List[dict], eligible_message: str):
+    """
+    Generate Python functions from the table: the early-return if-chain used by
+    check_tpa_eligibility (equivalent to a hand-written check with thresholds
+    inlined as literals), a variant that tests every criterion and collects the
+    failures, and one function per criterion for incremental re-evaluation.
+
+    check and evaluate run the plain conditions and switch to the guarded ones
+    only when an input is missing, so complete inputs pay nothing for the guard.
+    """
+    conditions = {guarded: [" or ".join(f"({_check_source(check, guarded)})" for check in criterion["checks"])
+                            for criterion in criteria]
+                  for guarded in (False, True)}
+    failure_literals = []
+    for criterion in criteria:
+        observed = ", ".join(f"{check['field']!r}: data.get({check['field']!r})" for check in criterion["checks"])
+        threshold = {check["field"]: {op: bound for op, bound in check.items() if op != "field"}
+                     for check in criterion["checks"]}
+        failure_literals.append(f"{{'criterion': {criterion['id']!r}, 'observed': {{{observed}}}, "
+                                f"'threshold': {threshold!r}, 'message': {criterion['message']!r}}}")
+
+    lines = []
+    for guarded, suffix in ((False, ""), (True, "_guarded")):
+        indent = "    " if guarded else "        "
+        lines.append(f"def check_tpa_eligibility{suffix}(data):")
+        if not guarded:
+            lines.append("    try:")
+        for criterion, condition in zip(criteria, conditions[guarded]):
+            lines.append(f"{indent}if {condition}:")
+            lines.append(f"{indent}    return False, {criterion['message']!r}")
+        lines.append(f"{indent}return True, {eligible_message!r}")
+        if not guarded:
+            lines.append("    except (KeyError, TypeError):")
+            lines.append("        return check_tpa_eligibility_guarded(data)")
+
+        lines.append(f"def evaluate_tpa_criteria{suffix}(data):")
+        if not guarded:
+            lines.append("    try:")
+        lines.append(f"{indent}failures = []")
+        for condition, failure in zip(conditions[guarded], failure_literals):
+            lines.append(f"{indent}if {condition}:")
+            lines.append(f"{indent}    failures.append({failure})")
+        lines.append(f"{indent}return failures")
+        if not guarded:
+            lines.append("    except (KeyError, TypeError):")
+            lines.append("        return evaluate_tpa_criteria_guarded(data)")
+
+    for index, (condition, failure) in enumerate(zip(conditions[True], failure_literals)):
+        lines.append(f"def criterion_{index}(data):")
+        lines.append(f"    if {condition}:")
+        lines.append(f"        return {failure}")
+        lines.append("    return None")
+
+    namespace = {}
+    exec(compile("\n".join(lines), "<tpa_rules>", "exec"), namespace)
+    criterion_functions = tuple(namespace[f"criterion_{index}"] for index in range(len(criteria)))
+    return namespace["check_tpa_eligibility"], namespace["evaluate_tpa_criteria"], criterion_functions
+
+
+def _failure_mask(check: dict, values: np.ndarray) -> np.ndarray:
+    if any(op in check for op in _NUMERIC_OPS):
+        values = np.asarray(values, dtype=np.float64)
+    mask = np.zeros(values.shape, dtype=bool)
+    # Written as "not inside the bound" like the scalar conditions, so NaN (missing) fails
+    if "max" in check:
+        mask |= ~(values <= check["max"])
+    if "min" in check:
+        mask |= ~(values >= check["min"])
+    if "between" in check:
+        low, high = check["between"]
+        mask |= ~((values >= low) & (values <= high))
+    if "equals" in check:
+        mask |= values != check["equals"]
+    if "not_equals" in check:
+        mask |= values == check["not_equals"]
+    return mask
+
+
+class TPARuleSet:
+    """
+    A compiled, immutable version of the eligibility rule table.
+
+    Requests should fetch the active rule set once (get_tpa_rule_set) and use it
+    for every step, so a concurrent reload never mixes two protocol versions.
+    """
+
+    def __init__(self, table: dict):
+        _validate_rule_table(table)
+        self.version = table["version"]
+        self.eligible_message = table["eligible_message"]
+        self.criteria = tuple(table["criteria"])
+        # check(data) -> (eligible, reason) stops at the first failing criterion;
+        # evaluate(data) -> [failure, ...] tests every criterion once.  Each
+        # failure records the criterion id, the observed values and thresholds
+        # keyed by input field, and the message.  An empty list means eligible.
+        self.check, self.evaluate, self._criterion_functions = _compile(self.criteria, self.eligible_message)
+
+        self._text_fields = {}
+        self._criteria_by_field = {}
+        for index, criterion in enumerate(self.criteria):
+            for check in criterion["checks"]:
+                self._text_fields[check["field"]] = any(op in check for op in _TEXT_OPS)
+                self._criteria_by_field.setdefault(check["field"], []).append(index)
+        self._messages = np.array([criterion["message"] for criterion in self.criteria] + [self.eligible_message],
+                                  dtype=object)
+
+    @property
+    def fields(self) -> List[str]:
+        return list(self._text_fields)
+
+    def reevaluate(self, data: dict, previous_failures: List[dict], changed_fields) -> List[dict]:
+        """
+        Re-run only the criteria that read one of changed_fields.
+
+        previous_failures must come from this rule set on the same inputs apart
+        from changed_fields; failures of untouched criteria are reused as is.
+        The result equals evaluate(data).
+        """
+        affected = {index for field in changed_fields for index in self._criteria_by_field.get(field, ())}
+        previous = {failure["criterion"]: failure for failure in previous_failures}
+
+        failures = []
+        for index, criterion in enumerate(self.criteria):
+            if index in affected:
+                failure = self._criterion_functions[index](data)
+            else:
+                failure = previous.get(criterion["id"])
+            if failure is not None:
+                failures.append(failure)
+        return failures
+
+    def summarize(self, failures: List[dict]) -> Tuple[bool, str]:
+        """Derive the (eligible, reason) pair check_tpa_eligibility returns from a failure list."""
+        if failures:
+            return False, failures[0]["message"]
+        return True, self.eligible_message
+
+    def build_columns(self, records: Union[Sequence[dict], Mapping[str, Sequence]]) -> Dict[str, np.ndarray]:
+        """
+        Convert a list of eligibility dicts (or a dict of columns) into NumPy columns.
+
+        Converting a list of dicts is bound by per-row dict lookups, so callers
+        screening the same rows repeatedly should convert once and pass the
+        result to check_batch.
+        """
+        if isinstance(records, Mapping):
+            source = records
+        else:
+            source = {field: [record.get(field) for record in records] for field in self._text_fields}
+
+        columns = {}
+        for field, is_text in self._text_fields.items():
+            values = source[field]
+            if is_text:
+                # Fixed-width string arrays compare in C; plain lists compare
+                # faster as object arrays than after a conversion to strings.
+                columns[field] = values if isinstance(values, np.ndarray) else np.asarray(values, dtype=object)
+            else:
+                # None becomes NaN, which fails every numeric check like a missing scalar value
+                columns[field] = np.asarray(values, dtype=np.float64)
+        return columns
+
+    def failure_matrix(self, records: Union[Sequence[dict], Mapping[str, Sequence]]) -> np.ndarray:
+        """Boolean matrix of shape (criteria, rows) that is True where a criterion fails."""
+        columns = self.build_columns(records)
+        n_rows = len(next(iter(columns.values())))
+
+        failures = np.zeros((len(self.criteria), n_rows), dtype=bool)
+        for row, criterion in enumerate(self.criteria):
+            for check in criterion["checks"]:
+                failures[row] |= _failure_mask(check, columns[check["field"]])
+        return failures
+
+    def check_batch(self, records: Union[Sequence[dict], Mapping[str, Sequence]]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Vectorized counterpart of check.
+
+        Returns a boolean eligibility array and the first failing reason per row,
+        using exactly the strings the scalar check produces.
+        """
+        failures = self.failure_matrix(records)
+        eligible = ~failures.any(axis=0)
+        first_failure = np.where(eligible, len(self.criteria), failures.argmax(axis=0))
+        return eligible, self._messages[first_failure]
+
+
+# -----------------------------
+# ACTIVE RULE SET (HOT RELOAD)
+# -----------------------------
+def load_rule_set(path: str = RULES_PATH) -> TPARuleSet:
+    with open(path, encoding="utf-8") as f:
+        return TPARuleSet(json.load(f))
+
+
+_active_rule_set = load_rule_set()
+_reload_lock = threading.Lock()
+
+
+def get_tpa_rule_set() -> TPARuleSet:
+    return _active_rule_set
+
+
+def reload_tpa_rules(path: str = RULES_PATH) -> TPARuleSet:
+    """
+    Load and compile the rule table, then swap it in with a single assignment.
+
+    In-flight requests keep the rule set they already fetched; an invalid table
+    raises and leaves the active rule set untouched.
+    """
+    global _active_rule_set
+    with _reload_lock:
+        rule_set = load_rule_set(path)
+        _active_rule_set = rule_set
+    return rule_set
+
+
+# -----------------------------
+# MODULE-LEVEL HELPERS
+# -----------------------------
 def check_tpa_eligibility(data: dict) -> Tuple[bool, str]:
-    # Initial assessment
-    if data["hours_since_onset"] > 4.5:
-        return False, "Initial Assessment: Patient presented beyond 4.5-hour treatment window"
-    if data["imaging_confirmed"] != "yes":
-        return False, "Initial Assessment: Ischemic stroke not confirmed by neuroimaging (CT/MRI)"
-    if data["consent"] != "yes":
-        return False, "Initial Assessment: Informed consent not obtained from patient or representative"
-
-    # Inclusion criteria
-    if data["age"] < 18:
-        return False, "Exclusion: Patient is under 18 years old"
-    if data["nhiss_score"] < 4:
-        return False, "Exclusion: NIHSS score below minimum threshold for thrombolytic therapy"
-    if data["inr"] > 1.7:
-        return False, "Exclusion: INR exceeds safe threshold for thrombolysis (INR > 1.7)"
-
-    if not (60 <= data["heart_rate"] <= 100):
-        return False, "Exclusion: Abnormal heart rate outside 60–100 bpm"
-    if not (12 <= data["respiratory_rate"] <= 20):
-        return False, "Exclusion: Abnormal respiratory rate outside 12–20 breaths/min"
-    if not (97 <= data["temperature"] <= 100.4):
-        return False, "Exclusion: Abnormal body temperature outside acceptable range (97–100.4 °F)"
-    if not (95 <= data["oxygen_saturation"] <= 100):
-        return False, "Exclusion: Oxygen saturation below 95%"
-
-    # Exclusion criteria
-    if data["recent_trauma"] == "yes":
-        return False, "Exclusion: Recent head or spinal trauma within 3 months"
-    if data["recent_stroke_or_injury"] == "yes":
-        return False, "Exclusion: History of stroke or serious head injury within 3 months"
-    if data["intracranial_issue"] == "yes":
-        return False, "Exclusion: Presence of intracranial hemorrhage, tumor, or vascular malformation"
-    if data["recent_mi"] == "yes":
-        return False, "Exclusion: Recent myocardial infarction (heart attack)"
-    if data["systolic_bp"] > 185 or data["diastolic_bp"] > 110:
-        return False, "Exclusion: Blood pressure exceeds safe threshold for tPA (SBP > 185 or DBP > 110 mmHg)"
-    if data["glucose"] < 50 or data["glucose"] > 400:
-        return False, "Exclusion: Blood glucose outside acceptable range (<50 or >400 mg/dL)"
-    if data["anticoagulant_risk"] == "yes":
-        return False, "Exclusion: Use of anticoagulants with elevated INR ≥ 3"
-    if data["platelet_count"] < 100:
-        return False, "Exclusion: Platelet count below safe minimum (<100,000/μL)"
-    if data["recent_surgery"] == "yes":
-        return False, "Exclusion: Recent surgery or biopsy of parenchymal organ"
-
-    return True, "Meets all criteria for intravenous thrombolysis (tPA administration)"
+    return _active_rule_set.check(data)
+
+
+def check_tpa_eligibility_batch(
+    records: Union[Sequence[dict], Mapping[str, Sequence]]
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Vectorized counterpart of check_tpa_eligibility.
+
+    Accepts either a list of the same dicts check_tpa_eligibility takes or a
+    mapping of field name to a column (list or NumPy array).
+    """
+    return _active_rule_set.check_batch(records)
+
+
+def evaluate_tpa_criteria(data: dict) -> List[dict]:
+    return _active_rule_set.evaluate(data)
+
+
+def summarize_tpa_failures(failures: List[dict]) -> Tuple[bool, str]:
+    return _active_rule_set.summarize(failures)
+
+
+# -----------------------------
+# COUNTERFACTUAL SWEEP
+# -----------------------------
+# Inputs that can be corrected before thrombolysis (e.g. antihypertensives,
+# glucose management) and the grid swept for each.  Distances are measured in
+# grid steps so the fields are comparable.
+CORRECTABLE_INPUTS = {
+    "systolic_bp": {"low": 90, "high": 230, "step": 5},
+    "diastolic_bp": {"low": 50, "high": 140, "step": 5},
+    "glucose": {"low": 40, "high": 500, "step": 10},
+}
+
+
+def _has_value(value) -> bool:
+    """False for a missing input: absent, None or NaN."""
+    try:
+        return not math.isnan(float(value))
+    except (TypeError, ValueError):
+        return False
+
+
+def find_eligibility_counterfactuals(data: dict, rule_set: TPARuleSet = None,
+                                     grid: Dict[str, dict] = None, limit: int = 5) -> dict:
+    """
+    Sweep the correctable inputs on a grid and return the smallest changes that make
+    the patient eligible.
+
+    All candidate points are evaluated at once with the batch evaluator.  One
+    result is returned per set of changed fields (the closest point), and sets
+    that contain a smaller feasible set are dropped, so every suggestion is
+    minimal.
+    """
+    rule_set = rule_set or _active_rule_set
+    grid = grid or CORRECTABLE_INPUTS
+
+    failures = rule_set.evaluate(data)
+    result = {
+        "rules_version": rule_set.version,
+        "eligible": not failures,
+        "blocking_failures": [],
+        "candidates_evaluated": 0,
+        "suggestions": [],
+    }
+    if not failures:
+        return result
+
+    # A correctable input that was never recorded has no value to change from; criteria
+    # reading it stay blocked until it is measured (e.g. scans from the legacy upload form)
+    missing = {field for field in grid if not _has_value(data.get(field))}
+    correctable = set(grid) - missing
+    result["blocking_failures"] = [
+        failure for failure in failures
+        if not correctable.intersection(failure["observed"]) or missing.intersection(failure["observed"])
+    ]
+    if result["blocking_failures"]:
+        return result
+
+    # Each axis includes the current value so a field can stay unchanged
+    fields = [field for field in grid if field in correctable]
+    axes = []
+    for field in fields:
+        spec = grid[field]
+        values = np.arange(spec["low"], spec["high"] + spec["step"], spec["step"], dtype=np.float64)
+        axes.append(np.union1d(values, [float(data[field])]))
+    mesh = [axis.ravel() for axis in np.meshgrid(*axes, indexing="ij")]
+    n_candidates = mesh[0].size
+    result["candidates_evaluated"] = int(n_candidates)
+
+    # Criteria that read no swept field already pass, so only the rest are swept
+    eligible = np.ones(n_candidates, dtype=bool)
+    for criterion in rule_set.criteria:
+        checks = criterion["checks"]
+        if not correctable.intersection(check["field"] for check in checks):
+            continue
+        failed = np.zeros(n_candidates, dtype=bool)
+        for check in checks:
+            field = check["field"]
+            values = mesh[fields.index(field)] if field in correctable else np.asarray([data.get(field)])
+            failed |= _failure_mask(check, values)
+        eligible &= ~failed
+
+    current = np.array([float(data[field]) for field in fields])
+    steps = np.array([float(grid[field]["step"]) for field in fields])
+    points = np.column_stack(mesh)[eligible]
+    if not len(points):
+        return result
+    changed = points != current
+    distance = (np.abs(points - current) / steps).sum(axis=1)
+
+    # Closest feasible point for each combination of changed fields (as a bitmask)
+    combination = changed.astype(np.int64) @ (1 << np.arange(len(fields), dtype=np.int64))
+    order = np.lexsort((distance, combination))
+    combinations, first = np.unique(combination[order], return_index=True)
+    best = dict(zip(combinations.tolist(), order[first].tolist()))
+
+    # Drop combinations that contain a smaller feasible combination
+    minimal = [key for key in best if not any(other != key and other & key == other for other in best)]
+    minimal.sort(key=lambda key: distance[best[key]])
+
+    for key in minimal[:limit]:
+        index = best[key]
+        result["suggestions"].append({
+            "changes": {
+                field: {"from": data[field], "to": float(points[index][i])}
+                for i, field in enumerate(fields) if key >> i & 1
+            },
+            "distance": float(distance[index]),
+        })
+    return result
@@ -0,0 +1,171 @@
+import hashlib
+import json
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from models import Patient, StrokeScan, TreatmentPlan, TreatmentPlanJob
+
+
+def plan_inputs_for_scan(patient: Patient, scan: StrokeScan) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Patient and scan data sent to ChatGPT when generating a treatment plan.
+    Returns (patient_data, scan_data).
+    """
+    # Prepare patient data for ChatGPT
+    patient_data = {
+        "name": patient.name,
+        "age": patient.age,
+        "gender": patient.gender,
+        "chief_complaint": patient.chief_complaint,
+        "time_since_onset": patient.time_since_onset,
+        "systolic_bp": patient.systolic_bp,
+        "diastolic_bp": patient.diastolic_bp,
+        "heart_rate": patient.heart_rate,
+        "oxygen_saturation": patient.oxygen_saturation,
+        "temperature": patient.temperature,
+        "glucose": patient.glucose,
+        "inr": patient.inr
+    }
+
+    # Prepare scan data for ChatGPT
+    scan_data = {
+        "imaging_confirmed": getattr(scan, 'imaging_confirmed', True),
+        "prediction": scan.prediction,
+        "eligibility_result": scan.eligibility_result,
+        "eligible": scan.eligible
+    }
+
+    return patient_data, scan_data
+
+
+def hash_plan_inputs(patient_data: Dict[str, Any], scan_data: Dict[str, Any]) -> str:
+    """Fingerprint of the prompt inputs; a draft is only valid while this is unchanged."""
+    payload = json.dumps({"patient": patient_data, "scan": scan_data}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def plan_type_for(eligible: bool) -> str:
+    return "tpa_eligible" if eligible else "not_eligible"
+
+
+def usage_columns(usage: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """TreatmentPlan llm_* column values for a usage record; empty for none."""
+    if not usage:
+        return {}
+    return {
+        "llm_model": usage["model"],
+        "prompt_tokens": usage["prompt_tokens"],
+        "completion_tokens": usage["completion_tokens"],
+        "llm_cost_usd": usage["cost_usd"],
+        "llm_latency_ms": usage["latency_ms"],
+        "llm_ttft_ms": usage["ttft_ms"],
+        "llm_attempts": usage["attempts"],
+    }
+
+
+def add_refinement_usage(treatment_plan: TreatmentPlan, usage: Dict[str, Any]):
+    """Add a refinement's tokens and cost to the plan's totals; the caller commits."""
+    treatment_plan.prompt_tokens = (treatment_plan.prompt_tokens or 0) + usage["prompt_tokens"]
+    treatment_plan.completion_tokens = (treatment_plan.completion_tokens or 0) + usage["completion_tokens"]
+    treatment_plan.llm_cost_usd = (treatment_plan.llm_cost_usd or 0.0) + (usage["cost_usd"] or 0.0)
+    treatment_plan.llm_attempts = (treatment_plan.llm_attempts or 0) + usage["attempts"]
+
+
+def usage_summary(treatment_plan: TreatmentPlan) -> Optional[Dict[str, Any]]:
+    """Usage block for API responses; None for plans saved before usage was recorded."""
+    if treatment_plan.llm_model is None and treatment_plan.prompt_tokens is None:
+        return None
+    return {
+        "model": treatment_plan.llm_model,
+        "prompt_tokens": treatment_plan.prompt_tokens,
+        "completion_tokens": treatment_plan.completion_tokens,
+        "cost_usd": round(treatment_plan.llm_cost_usd, 6) if treatment_plan.llm_cost_usd is not None else None,
+        "latency_ms": treatment_plan.llm_latency_ms,
+        "ttft_ms": treatment_plan.llm_ttft_ms,
+        "attempts": treatment_plan.llm_attempts,
+    }
+
+
+def create_treatment_plan(db: Session, patient_id: int, scan_id: int, plan_type: str,
+                          ai_generated_plan: str, created_by: str, source: str = "physician",
+                          inputs_hash: str = None, usage: Dict[str, Any] = None) -> TreatmentPlan:
+    """Save a freshly generated plan as a draft and commit.  usage comes from llm_metrics.new_usage()."""
+    treatment_plan = TreatmentPlan(
+        patient_id=patient_id,
+        scan_id=scan_id,
+        plan_type=plan_type,
+        ai_generated_plan=ai_generated_plan,
+        status="draft",
+        created_by=created_by,
+        created_at=datetime.now(),
+        updated_at=datetime.now(),
+        source=source,
+        inputs_hash=inputs_hash,
+        pregeneration_outcome="waiting" if source == "speculative" else None,
+        **usage_columns(usage)
+    )
+
+    db.add(treatment_plan)
+    db.commit()
+    db.refresh(treatment_plan)
+    return treatment_plan
+
+
+def claim_pregenerated_plan(db: Session, scan_id: int, inputs_hash: str,
+                            physician_username: str) -> Optional[Tuple[int, str]]:
+    """
+    Hand a waiting speculative draft for this scan to the physician.
+    Drafts generated from inputs that have since changed are discarded instead.
+    Returns (treatment_plan_id, plan text) or None; commits either way.
+    """
+    drafts = db.query(TreatmentPlan).filter(
+        TreatmentPlan.scan_id == scan_id,
+        TreatmentPlan.source == "speculative",
+        TreatmentPlan.pregeneration_outcome == "waiting"
+    ).order_by(TreatmentPlan.created_at.desc()).all()
+
+    claimed = None
+    for draft in drafts:
+        if claimed is None and draft.inputs_hash == inputs_hash:
+            draft.pregeneration_outcome = "used"
+            draft.created_by = physician_username
+            draft.updated_at = datetime.now()
+            claimed = (draft.id, draft.ai_generated_plan)
+        else:
+            draft.pregeneration_outcome = "discarded"
+    db.commit()
+    return claimed
+
+
+def discard_pregenerated_plans(db: Session, patient_id: int = None, scan_id: int = None) -> int:
+    """
+    Cancel speculative jobs and discard waiting drafts for a patient or scan
+    whose inputs changed.  The caller commits.  Returns how many were affected.
+    """
+    jobs = db.query(TreatmentPlanJob).filter(
+        TreatmentPlanJob.speculative == True,
+        TreatmentPlanJob.status.in_(("queued", "running"))
+    )
+    drafts = db.query(TreatmentPlan).filter(
+        TreatmentPlan.source == "speculative",
+        TreatmentPlan.pregeneration_outcome == "waiting"
+    )
+    if patient_id is not None:
+        jobs = jobs.filter(TreatmentPlanJob.patient_id == patient_id)
+        drafts = drafts.filter(TreatmentPlan.patient_id == patient_id)
+    if scan_id is not None:
+        jobs = jobs.filter(TreatmentPlanJob.scan_id == scan_id)
+        drafts = drafts.filter(TreatmentPlan.scan_id == scan_id)
+
+    cancelled = jobs.update({
+        TreatmentPlanJob.status: "cancelled",
+        TreatmentPlanJob.progress: "Cancelled (case changed)",
+        TreatmentPlanJob.finished_at: datetime.now(),
+    }, synchronize_session=False)
+    discarded = drafts.update({
+        TreatmentPlan.pregeneration_outcome: "discarded",
+        TreatmentPlan.updated_at: datetime.now(),
+    }, synchronize_session=False)
+    return cancelled + discarded
@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
 """
 Script to update database schema
+Adds new tables and columns and applies pending migrations in place; no
+table is dropped and existing data is kept.  See migrations.py for a dry run.
 """
 import sys
 import os
@@ -8,19 +10,19 @@ import os
 # Add the backend directory to Python path
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from database import engine, Base
-from models import Patient, User, StrokeScan, NIHSSAssessment
+from database import engine
+from migrations import sync_model_schema, run_migrations
 
 def update_database():
     try:
-        print("Dropping existing tables...")
-        Base.metadata.drop_all(bind=engine)
+        print("Adding new tables and columns...")
+        sync_model_schema(engine)
         
-        print("Creating new tables with updated schema...")
-        Base.metadata.create_all(bind=engine)
+        print("Applying pending migrations...")
+        applied = run_migrations(engine)
         
         print("Database schema updated successfully!")
-        print("The 'time_since_onset' field has been added to the Patient table.")
+        print(f"Migrations applied: {', '.join(map(str, applied)) or 'none pending'}")
         
     except Exception as e:
         print(f"Error updating database: {e}")
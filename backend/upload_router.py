@@ -1,15 +1,34 @@
 from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Depends
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, StreamingResponse
 from sqlalchemy.orm import Session
 from sqlalchemy import func
 from datetime import datetime
 import os
-import requests
+import time
+import asyncio
+import httpx
 import json
 from database import SessionLocal
-from models import Patient, StrokeScan, NIHSSAssessment, TreatmentPlan
-from tpa_eligibility import check_tpa_eligibility
-from chatgpt_service import get_chatgpt_service
+from models import Patient, StrokeScan, NIHSSAssessment, TreatmentPlan, TreatmentPlanJob
+from tpa_eligibility import get_tpa_rule_set, reload_tpa_rules, find_eligibility_counterfactuals
+from eligibility_service import apply_eligibility
+from chatgpt_service import (
+    get_chatgpt_service, OpenAIAPIError, LLMUnavailableError, GENERATION_SETTINGS, REFINE_SETTINGS
+)
+from llm_metrics import get_llm_metrics, new_usage
+from prompt_builder import prompt_stats
+from plan_cache import get_plan_cache
+from plan_jobs import join_or_enqueue_plan_job, plan_job_status, record_pregenerated_job, PLAN_PREGENERATION_ENABLED
+from single_flight import SingleFlight
+from rules_plan import generate_rules_plan, rules_plan_extras, PLAN_RULES_FALLBACK_ENABLED
+from plan_similarity import get_plan_similarity_index, APPROVED_PLAN_STATUSES
+from bulk_plans import BulkPlanRun, BULK_PLAN_RUN_TTL_SECONDS
+from dashboard_stats import dashboard_stats
+import plan_jobs
+from treatment_plan_service import (
+    plan_inputs_for_scan, plan_type_for, create_treatment_plan, hash_plan_inputs,
+    claim_pregenerated_plan, discard_pregenerated_plans, add_refinement_usage, usage_summary
+)
 
 router = APIRouter()
 UPLOAD_DIR = "uploads"
@@ -82,8 +101,6 @@ async def upload_scan(
         "recent_mi": recent_mi,
         "recent_surgery": recent_surgery
     }
-    eligible, reason = check_tpa_eligibility(data)
-
     patient = Patient(
         name=name,
         age=age,
@@ -102,14 +119,17 @@ async def upload_scan(
     scan_record = StrokeScan(
         patient_id=patient.id,
         image_path=relative_path,
-        prediction=reason,
-        eligibility_result=reason,
-        eligible=eligible,
         timestamp=datetime.now()
     )
+    apply_eligibility(scan_record, data)
+    reason = scan_record.eligibility_result
+    eligibility_failures = scan_record.eligibility_failures
+    scan_record.prediction = reason
     db.add(scan_record)
     db.commit()
 
+    additional_failures = "".join(f"<p>{failure['message']}</p>" for failure in eligibility_failures[1:])
+
     return HTMLResponse(content=f"""
         <html>
         <head>
@@ -163,6 +183,7 @@ async def upload_scan(
                 <p><strong>Patient:</strong> {name}</p>
                 <p><strong>Eligibility Status:</strong></p>
                 <p>{reason}</p>
+                {additional_failures}
                 <a href="/technician-dashboard">Return to Dashboard</a>
             </div>
         </body>
@@ -259,39 +280,17 @@ def add_doctor_comment(scan_id: int, comment: str = Form(...), db: Session = Dep
 @router.get("/dashboard-stats")
 def get_dashboard_stats(db: Session = Depends(get_db)):
     try:
-        # Total patients
-        total_patients = db.query(Patient).count()
-        
-        # Total scans
-        total_scans = db.query(StrokeScan).count()
-        
-        # Eligible scans (where eligible = True)
-        eligible_scans = db.query(StrokeScan).filter(StrokeScan.eligible == True).count()
-        
-        # Not eligible scans (where eligible = False)
-        not_eligible_scans = db.query(StrokeScan).filter(StrokeScan.eligible == False).count()
-        
-        # Sent to doctor scans (scans with ready_for_review status)
-        sent_to_doctor_scans = db.query(StrokeScan).filter(StrokeScan.status == "ready_for_review").count()
-        
-        # Recent activity (last 7 days) - using timestamp for scans
-        week_ago = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-        week_ago = week_ago.replace(day=week_ago.day - 7)
-        
-        # Since Patient doesn't have created_at, we'll use scans timestamp as proxy
-        recent_scans = db.query(StrokeScan).filter(StrokeScan.timestamp >= week_ago).count()
-        
-        # For recent patients, we'll count patients who have recent scans
-        recent_patients = db.query(Patient).join(StrokeScan).filter(StrokeScan.timestamp >= week_ago).distinct().count()
-        
+        # Counters maintained on every write (see dashboard_stats.py); recent activity
+        # is the last 7 days, using scan timestamps since Patient has no created_at
+        stats = dashboard_stats(db)
         return {
-            "total_patients": total_patients,
-            "total_scans": total_scans,
-            "eligible_scans": eligible_scans,
-            "not_eligible_scans": not_eligible_scans,
-            "sent_to_doctor_scans": sent_to_doctor_scans,
-            "recent_patients": recent_patients,
-            "recent_scans": recent_scans
+            "total_patients": stats["total_patients"],
+            "total_scans": stats["total_scans"],
+            "eligible_scans": stats["eligible_scans"],
+            "not_eligible_scans": stats["not_eligible_scans"],
+            "sent_to_doctor_scans": stats["sent_to_doctor_scans"],
+            "recent_patients": stats["recent_patients"],
+            "recent_scans": stats["recent_scans"]
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching dashboard stats: {str(e)}")
@@ -300,29 +299,14 @@ def get_dashboard_stats(db: Session = Depends(get_db)):
 @router.get("/physician-dashboard-stats")
 def get_physician_dashboard_stats(db: Session = Depends(get_db)):
     try:
-        from datetime import datetime, timedelta
-        
-        # New Cases: Number of patients sent by technicians (ready_for_review status)
-        new_cases = db.query(StrokeScan).filter(StrokeScan.status == "ready_for_review").count()
-        
-        # Reviewed Cases: How many have been checked today (status = "reviewed" and today's date)
-        today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-        reviewed_today = db.query(StrokeScan).filter(
-            StrokeScan.status == "reviewed",
-            StrokeScan.timestamp >= today
-        ).count()
-        
-        # Eligible for tPA: Count of confirmed eligible cases (eligible = True)
-        eligible_for_tpa = db.query(StrokeScan).filter(StrokeScan.eligible == True).count()
-        
-        # Not Eligible: Count of rejected cases (eligible = False)
-        not_eligible = db.query(StrokeScan).filter(StrokeScan.eligible == False).count()
-        
+        stats = dashboard_stats(db)
         return {
-            "new_cases": new_cases,
-            "reviewed_today": reviewed_today,
-            "eligible_for_tpa": eligible_for_tpa,
-            "not_eligible": not_eligible
+            # New Cases: scans sent by technicians (ready_for_review status)
+            "new_cases": stats["sent_to_doctor_scans"],
+            # Reviewed Cases: status = "reviewed" with today's date
+            "reviewed_today": stats["reviewed_today"],
+            "eligible_for_tpa": stats["eligible_scans"],
+            "not_eligible": stats["not_eligible_scans"]
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching physician dashboard stats: {str(e)}")
@@ -511,6 +495,8 @@ def get_case_details(patient_code: str, db: Session = Depends(get_db)):
                 "doctor_comment": scan.doctor_comment,
                 "eligibility_result": scan.eligibility_result,
                 "eligible": scan.eligible,
+                "eligibility_failures": scan.eligibility_failures or [],
+                "eligibility_rules_version": scan.eligibility_rules_version,
                 "technician_notes": scan.technician_notes,
                 "status": scan.status,
                 "imaging_confirmed": getattr(scan, 'imaging_confirmed', True)  # Default to True if field doesn't exist
@@ -678,95 +664,558 @@ def get_sent_to_doctor_scans_detail(db: Session = Depends(get_db)):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching sent to doctor scans: {str(e)}")
 
+# tPA Eligibility Rule Table Endpoints
+
+@router.get("/api/eligibility-rules")
+def get_eligibility_rules():
+    """
+    Return the active tPA eligibility rule table.
+    """
+    rule_set = get_tpa_rule_set()
+    return {
+        "version": rule_set.version,
+        "eligible_message": rule_set.eligible_message,
+        "criteria": list(rule_set.criteria)
+    }
+
+@router.post("/api/eligibility-rules/reload")
+def reload_eligibility_rules():
+    """
+    Reload tpa_rules.json without restarting; requests in flight finish on the previous version.
+    """
+    try:
+        rule_set = reload_tpa_rules()
+    except (OSError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Rule table not reloaded: {str(e)}")
+
+    return {
+        "message": "Eligibility rules reloaded successfully",
+        "version": rule_set.version,
+        "criteria_count": len(rule_set.criteria)
+    }
+
+@router.get("/api/scans/{scan_id}/eligibility-counterfactuals")
+def get_eligibility_counterfactuals(scan_id: int, limit: int = 5, db: Session = Depends(get_db)):
+    """
+    Return the smallest changes to correctable inputs (blood pressure, glucose)
+    that would make the scan's patient eligible for tPA.
+    """
+    try:
+        scan = db.query(StrokeScan).filter(StrokeScan.id == scan_id).first()
+        if not scan:
+            raise HTTPException(status_code=404, detail="Scan not found")
+        if not scan.eligibility_inputs:
+            raise HTTPException(status_code=409, detail="Scan has no stored eligibility inputs; re-upload to assess it")
+
+        started = time.perf_counter()
+        result = find_eligibility_counterfactuals(scan.eligibility_inputs, limit=limit)
+        result["scan_id"] = scan.id
+        result["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 3)
+        return result
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to compute counterfactuals: {str(e)}")
+
 # Treatment Plan API Endpoints
 
-@router.post("/api/treatment-plan/generate")
+def _treatment_plan_inputs(request: dict, db: Session):
+    """
+    Look up the patient and scan named in a generate request and collect the
+    data sent to ChatGPT.  Returns (patient, scan, patient_data, scan_data).
+    """
+    patient_code = request.get("patient_code")
+    scan_id = request.get("scan_id")
+    
+    if not patient_code or not scan_id:
+        raise HTTPException(status_code=400, detail="Patient code and scan ID are required")
+    
+    # Get patient data
+    patient = db.query(Patient).filter(Patient.code == patient_code).first()
+    if not patient:
+        raise HTTPException(status_code=404, detail="Patient not found")
+    
+    # Get scan data
+    scan = db.query(StrokeScan).filter(StrokeScan.id == scan_id).first()
+    if not scan:
+        raise HTTPException(status_code=404, detail="Scan not found")
+    
+    patient_data, scan_data = plan_inputs_for_scan(patient, scan)
+    
+    return patient, scan, patient_data, scan_data
+
+def _pregenerated_plan(request: dict, db: Session, scan_id: int, patient_data: dict, scan_data: dict,
+                       physician_username: str):
+    """
+    The speculative draft waiting for this scan, claimed for the physician, as
+    (treatment_plan_id, plan text).  None when there is none or "regenerate"
+    asks for a fresh plan, in which case waiting drafts are discarded.
+    """
+    if request.get("regenerate", False):
+        discard_pregenerated_plans(db, scan_id=scan_id)
+        return None
+    return claim_pregenerated_plan(db, scan_id, hash_plan_inputs(patient_data, scan_data), physician_username)
+
+def _llm_http_error(error: Exception, action: str) -> HTTPException:
+    """503 with Retry-After while the AI service is unavailable, 502 for other upstream errors."""
+    detail = f"{action}: {str(error) or type(error).__name__}"
+    if isinstance(error, LLMUnavailableError):
+        headers = {"Retry-After": str(int(error.retry_after))} if error.retry_after else None
+        return HTTPException(status_code=503, detail=detail, headers=headers)
+    return HTTPException(status_code=502, detail=detail)
+
+def _sse_event(data: dict, event: str = None) -> str:
+    """Format one Server-Sent Events frame with a JSON payload."""
+    frame = f"event: {event}\n" if event else ""
+    return frame + f"data: {json.dumps(data)}\n\n"
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no",  # stop reverse proxies from buffering the stream
+}
+
+async def _error_event_on_failure(stream):
+    """End an SSE stream that raises with an "error" event instead of a dropped connection."""
+    try:
+        async for frame in stream:
+            yield frame
+    except Exception as e:
+        yield _sse_event({"detail": f"Failed to generate treatment plan: {str(e) or type(e).__name__}"}, "error")
+
+# Concurrent streams for the same scan and inputs share one LLM call and one saved plan
+plan_stream_flights = SingleFlight()
+
+@router.post("/api/treatment-plan/generate", status_code=202)
 async def generate_treatment_plan(
     request: dict,
     db: Session = Depends(get_db)
 ):
     """
-    Generate a treatment plan using ChatGPT for a specific patient and scan.
+    Queue generation of a treatment plan using ChatGPT for a specific patient and scan.
+    Returns 202 with a job id; poll /api/treatment-plan-jobs/{job_id} for the
+    resulting treatment plan id.  Pass "regenerate": true to bypass the plan cache
+    and any pre-generated draft.  A waiting pre-generated draft is returned as an
+    already succeeded job, and a request that matches a job still in flight for
+    the same scan and inputs joins that job ("coalesced": true).
     """
     try:
-        patient_code = request.get("patient_code")
-        scan_id = request.get("scan_id")
         physician_username = request.get("physician_username", "Unknown")
+        patient, scan, patient_data, scan_data = _treatment_plan_inputs(request, db)
+        patient_id, scan_id = patient.id, scan.id
+        regenerate = bool(request.get("regenerate", False))
+        inputs_hash = hash_plan_inputs(patient_data, scan_data)
+        
+        draft = _pregenerated_plan(request, db, scan_id, patient_data, scan_data, physician_username)
+        if draft:
+            job_id = record_pregenerated_job(db, patient_id, scan_id, physician_username, draft[0])
+            return {
+                "message": "Pre-generated treatment plan ready",
+                "job_id": job_id,
+                "status": "succeeded",
+                "treatment_plan_id": draft[0],
+                "status_url": f"/api/treatment-plan-jobs/{job_id}"
+            }
         
-        if not patient_code or not scan_id:
-            raise HTTPException(status_code=400, detail="Patient code and scan ID are required")
+        job_id, joined = join_or_enqueue_plan_job(
+            db, patient_id, scan_id, physician_username, inputs_hash, regenerate=regenerate
+        )
         
-        # Get patient data
-        patient = db.query(Patient).filter(Patient.code == patient_code).first()
-        if not patient:
-            raise HTTPException(status_code=404, detail="Patient not found")
+        return {
+            "message": "Joined treatment plan generation in progress" if joined else "Treatment plan generation queued",
+            "job_id": job_id,
+            "status": "queued",
+            "coalesced": joined,
+            "status_url": f"/api/treatment-plan-jobs/{job_id}"
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=500, detail=f"Failed to queue treatment plan generation: {str(e)}")
+
+# Bulk runs by id; at most one runs at a time
+bulk_plan_runs = {}
+bulk_plan_tasks = {}
+
+# Bulk generation options and their types; rate_per_second 0 disables the rate limit
+BULK_PLAN_OPTIONS = {"concurrency": int, "rate_per_second": float, "batch_size": int, "limit": int}
+
+def _bulk_plan_options(request: dict) -> dict:
+    """Validated bulk generation options from the request body; HTTP 400 on a bad value."""
+    options = {}
+    for key, cast in BULK_PLAN_OPTIONS.items():
+        value = request.get(key)
+        if value is None:
+            continue
+        try:
+            # bool is an int, and int(2.5) would silently truncate
+            if isinstance(value, bool) or (cast is int and isinstance(value, float) and not value.is_integer()):
+                raise ValueError
+            number = cast(value)
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail=f"{key} must be a {cast.__name__}, got {value!r}")
+        minimum = 0 if key == "rate_per_second" else 1
+        if not minimum <= number < float("inf"):
+            raise HTTPException(status_code=400, detail=f"{key} must be at least {minimum}, got {value!r}")
+        options[key] = number
+    return options
+
+async def stop_bulk_plan_runs():
+    """Cancel the running bulk generation at shutdown; its run is marked "cancelled"."""
+    tasks = list(bulk_plan_tasks.values())
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    for run in bulk_plan_runs.values():
+        # A task cancelled before it started never ran to mark its run
+        if run.status in ("pending", "running"):
+            run.status = "cancelled"
+            run.finished_at = run.finished_at or datetime.now()
+
+def _prune_bulk_plan_runs():
+    """Forget runs that finished more than BULK_PLAN_RUN_TTL_SECONDS ago."""
+    now = datetime.now()
+    for run_id, run in list(bulk_plan_runs.items()):
+        if run.finished_at and (now - run.finished_at).total_seconds() > BULK_PLAN_RUN_TTL_SECONDS:
+            del bulk_plan_runs[run_id]
+
+@router.post("/api/treatment-plan/bulk-generate", status_code=202)
+async def bulk_generate_treatment_plans(request: dict):
+    """
+    Draft treatment plans for every ready_for_review scan that has none.
+    Optional: concurrency, rate_per_second, batch_size, limit, physician_username.
+    Returns 202 with a run id; poll /api/treatment-plan-bulk-runs/{run_id} for progress.
+    """
+    try:
+        options = _bulk_plan_options(request)
+        _prune_bulk_plan_runs()
+        if any(run.status in ("pending", "running") for run in bulk_plan_runs.values()):
+            raise HTTPException(status_code=409, detail="A bulk generation run is already in progress")
         
-        # Get scan data
+        bulk_run = BulkPlanRun(created_by=request.get("physician_username", "bulk-generation"), **options)
+        bulk_plan_runs[bulk_run.id] = bulk_run
+        task = asyncio.create_task(bulk_run.run())
+        bulk_plan_tasks[bulk_run.id] = task
+        task.add_done_callback(lambda _: bulk_plan_tasks.pop(bulk_run.id, None))
+        
+        return {
+            "message": "Bulk treatment plan generation started",
+            "run_id": bulk_run.id,
+            "status_url": f"/api/treatment-plan-bulk-runs/{bulk_run.id}"
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to start bulk generation: {str(e)}")
+
+@router.get("/api/treatment-plan-bulk-runs/{run_id}")
+def get_bulk_generation_run(run_id: str):
+    """
+    Progress of a bulk generation run.
+    """
+    _prune_bulk_plan_runs()
+    bulk_run = bulk_plan_runs.get(run_id)
+    if not bulk_run:
+        raise HTTPException(status_code=404, detail="Bulk generation run not found")
+    return bulk_run.progress()
+
+@router.get("/api/treatment-plan-jobs/{job_id}")
+def get_treatment_plan_job(job_id: str, db: Session = Depends(get_db)):
+    """
+    Status, progress and (once succeeded) the treatment plan id of a generation job.
+    """
+    try:
+        job = db.query(TreatmentPlanJob).filter(TreatmentPlanJob.id == job_id).first()
+        if not job:
+            raise HTTPException(status_code=404, detail="Treatment plan job not found")
+        
+        return plan_job_status(job)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to get treatment plan job: {str(e)}")
+
+@router.post("/api/treatment-plan/generate/stream")
+async def stream_treatment_plan(
+    request: dict,
+    db: Session = Depends(get_db)
+):
+    """
+    Generate a treatment plan and stream it as Server-Sent Events.
+
+    Emits a "start" event with the plan type, one unnamed event per token
+    ({"token": ...}), then "done" with the saved treatment plan id, or "error".
+    The plan is saved once the completion has finished.  A waiting pre-generated
+    draft is sent as a single token.  Requests for the same scan and inputs that
+    arrive while a stream is running receive that stream from the start.
+    If the AI model fails before sending any text, a rules-based draft is sent
+    and saved instead ("source": "rules" in the done event).
+    """
+    try:
+        physician_username = request.get("physician_username", "Unknown")
+        regenerate = bool(request.get("regenerate", False))
+        patient, scan, patient_data, scan_data = _treatment_plan_inputs(request, db)
+        patient_id, scan_id = patient.id, scan.id
+        rules_extras = rules_plan_extras(db, scan)
+        flight_key = (scan_id, hash_plan_inputs(patient_data, scan_data), regenerate)
+        draft = None
+        if not plan_stream_flights.in_flight(flight_key):
+            draft = _pregenerated_plan(request, db, scan_id, patient_data, scan_data, physician_username)
+        db.commit()  # release the DB connection for the duration of the stream
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to generate treatment plan: {str(e)}")
+    
+    plan_type = plan_type_for(scan_data["eligible"])
+    
+    async def events():
+        yield _sse_event({"plan_type": plan_type}, "start")
+        
+        if draft:
+            yield _sse_event({"token": draft[1]})
+            yield _sse_event({"treatment_plan_id": draft[0], "plan_type": plan_type, "status": "draft"}, "done")
+            return
+        
+        parts = []
+        usage = new_usage(GENERATION_SETTINGS["model"])
+        try:
+            async for token in get_chatgpt_service().stream_treatment_plan(
+                patient_data, scan_data, scan_data["eligibility_result"], scan_data["eligible"],
+                regenerate=regenerate, usage=usage
+            ):
+                parts.append(token)
+                yield _sse_event({"token": token})
+        except (OpenAIAPIError, httpx.HTTPError) as e:
+            detail = f"Failed to generate treatment plan: {str(e) or type(e).__name__}"
+            if parts or not PLAN_RULES_FALLBACK_ENABLED:
+                yield _sse_event({"detail": detail}, "error")
+                return
+            fallback_reason = detail
+        else:
+            fallback_reason = None
+        
+        source = "physician"
+        plan_text = "".join(parts).strip()
+        if fallback_reason:
+            source, usage = "rules", None
+            plan_text = generate_rules_plan(patient_data, scan_data, **rules_extras)
+            yield _sse_event({"token": plan_text})
+        elif not plan_text:
+            yield _sse_event({"detail": "Failed to generate treatment plan: the AI model returned no text"}, "error")
+            return
+        
+        session = SessionLocal()
+        try:
+            treatment_plan = create_treatment_plan(
+                session, patient_id, scan_id, plan_type, plan_text, physician_username,
+                source=source, inputs_hash=flight_key[1], usage=usage
+            )
+            done = {
+                "treatment_plan_id": treatment_plan.id,
+                "plan_type": plan_type,
+                "status": "draft",
+                "source": source
+            }
+            if fallback_reason:
+                done["fallback_reason"] = fallback_reason
+            yield _sse_event(done, "done")
+        except Exception as e:
+            session.rollback()
+            yield _sse_event({"detail": f"Failed to save treatment plan: {str(e)}"}, "error")
+        finally:
+            session.close()
+    
+    stream = events() if draft else plan_stream_flights.stream(flight_key, events)
+    return StreamingResponse(_error_event_on_failure(stream), media_type="text/event-stream", headers=SSE_HEADERS)
+
+@router.post("/api/treatment-plan/generate/rules")
+def generate_rules_based_treatment_plan(
+    request: dict,
+    db: Session = Depends(get_db)
+):
+    """
+    Draft a treatment plan from protocol templates without calling the AI model.
+    Returns the saved plan at once, for use as a first draft while the AI plan is generated.
+    """
+    try:
+        physician_username = request.get("physician_username", "Unknown")
+        patient, scan, patient_data, scan_data = _treatment_plan_inputs(request, db)
+        
+        started = time.perf_counter()
+        plan_text = generate_rules_plan(patient_data, scan_data, **rules_plan_extras(db, scan))
+        generation_ms = (time.perf_counter() - started) * 1000
+        
+        plan_type = plan_type_for(scan_data["eligible"])
+        treatment_plan = create_treatment_plan(
+            db, patient.id, scan.id, plan_type, plan_text, physician_username,
+            source="rules", inputs_hash=hash_plan_inputs(patient_data, scan_data)
+        )
+        
+        return {
+            "message": "Rules-based treatment plan drafted",
+            "treatment_plan_id": treatment_plan.id,
+            "plan_type": plan_type,
+            "source": "rules",
+            "ai_generated_plan": plan_text,
+            "generation_ms": round(generation_ms, 3)
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=500, detail=f"Failed to draft treatment plan: {str(e)}")
+
+@router.get("/api/scans/{scan_id}/similar-plans")
+def get_similar_approved_plans(scan_id: int, limit: int = 5, icd_code: str = None, db: Session = Depends(get_db)):
+    """
+    The approved treatment plans whose cases are closest to this scan's
+    (vitals, NIHSS, eligibility, failed criteria, ICD code), most similar first.
+    icd_code defaults to the code on the scan's own plan, if any.
+    """
+    try:
         scan = db.query(StrokeScan).filter(StrokeScan.id == scan_id).first()
         if not scan:
             raise HTTPException(status_code=404, detail="Scan not found")
         
-        # Prepare patient data for ChatGPT
-        patient_data = {
-            "name": patient.name,
-            "age": patient.age,
-            "gender": patient.gender,
-            "chief_complaint": patient.chief_complaint,
-            "time_since_onset": patient.time_since_onset,
-            "systolic_bp": patient.systolic_bp,
-            "diastolic_bp": patient.diastolic_bp,
-            "heart_rate": patient.heart_rate,
-            "oxygen_saturation": patient.oxygen_saturation,
-            "temperature": patient.temperature,
-            "glucose": patient.glucose,
-            "inr": patient.inr
-        }
+        index = get_plan_similarity_index()
+        index.ensure_loaded(db)
+        
+        own_plans = db.query(TreatmentPlan).filter(TreatmentPlan.scan_id == scan_id).all()
+        if icd_code is None:
+            icd_code = next((plan.icd_code for plan in own_plans if plan.icd_code), None)
+        
+        started = time.perf_counter()
+        matches = index.query(index.vector(db, scan.patient, scan, icd_code), k=max(1, min(limit, 50)),
+                              exclude=[plan.id for plan in own_plans])
+        query_ms = (time.perf_counter() - started) * 1000
+        
+        plans = {plan.id: plan for plan in db.query(TreatmentPlan).filter(
+            TreatmentPlan.id.in_([plan_id for plan_id, _ in matches])
+        ).all()}
         
-        # Prepare scan data for ChatGPT
-        scan_data = {
-            "imaging_confirmed": getattr(scan, 'imaging_confirmed', True),
-            "prediction": scan.prediction,
-            "eligibility_result": scan.eligibility_result,
-            "eligible": scan.eligible
+        return {
+            "scan_id": scan_id,
+            "icd_code": icd_code,
+            "query_ms": round(query_ms, 3),
+            "indexed_plans": len(index),
+            "similar_plans": [
+                {
+                    "treatment_plan_id": plan_id,
+                    "similarity": round(score, 4),
+                    "scan_id": plans[plan_id].scan_id,
+                    "plan_type": plans[plan_id].plan_type,
+                    "icd_code": plans[plan_id].icd_code,
+                    "icd_description": plans[plan_id].icd_description,
+                    "ai_generated_plan": plans[plan_id].ai_generated_plan,
+                    "physician_notes": plans[plan_id].physician_notes,
+                    "approved_by": plans[plan_id].created_by,
+                    "updated_at": plans[plan_id].updated_at.strftime("%Y-%m-%d %H:%M") if plans[plan_id].updated_at else None
+                }
+                for plan_id, score in matches if plan_id in plans
+            ]
         }
         
-        # Generate treatment plan using ChatGPT
-        ai_generated_plan = get_chatgpt_service().generate_treatment_plan(
-            patient_data, scan_data, scan.eligibility_result, scan.eligible
-        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to find similar plans: {str(e)}")
+
+@router.post("/api/scans/{scan_id}/similar-plans/{treatment_plan_id}/use")
+def use_similar_approved_plan(scan_id: int, treatment_plan_id: int, request: dict, db: Session = Depends(get_db)):
+    """
+    Start this scan's treatment plan from an approved plan of a similar case.
+    Saves a draft copy with source "retrieved" for the physician to adapt.
+    """
+    try:
+        scan = db.query(StrokeScan).filter(StrokeScan.id == scan_id).first()
+        if not scan:
+            raise HTTPException(status_code=404, detail="Scan not found")
         
-        # Determine plan type
-        plan_type = "tpa_eligible" if scan.eligible else "not_eligible"
-        
-        # Create treatment plan record
-        treatment_plan = TreatmentPlan(
-            patient_id=patient.id,
-            scan_id=scan.id,
-            plan_type=plan_type,
-            ai_generated_plan=ai_generated_plan,
-            status="draft",
-            created_by=physician_username,
-            created_at=datetime.now(),
-            updated_at=datetime.now()
-        )
+        template = db.query(TreatmentPlan).filter(TreatmentPlan.id == treatment_plan_id).first()
+        if not template or template.status not in APPROVED_PLAN_STATUSES:
+            raise HTTPException(status_code=404, detail="Approved treatment plan not found")
         
-        db.add(treatment_plan)
-        db.commit()
-        db.refresh(treatment_plan)
+        patient_data, scan_data = plan_inputs_for_scan(scan.patient, scan)
+        plan_type = plan_type_for(scan_data["eligible"])
+        treatment_plan = create_treatment_plan(
+            db, scan.patient_id, scan_id, plan_type, template.ai_generated_plan,
+            request.get("physician_username", "Unknown"),
+            source="retrieved", inputs_hash=hash_plan_inputs(patient_data, scan_data)
+        )
         
         return {
-            "message": "Treatment plan generated successfully",
+            "message": "Draft treatment plan created from a similar approved plan",
             "treatment_plan_id": treatment_plan.id,
+            "based_on_treatment_plan_id": treatment_plan_id,
             "plan_type": plan_type,
-            "ai_generated_plan": ai_generated_plan,
-            "status": "draft"
+            "source": "retrieved"
         }
         
     except HTTPException:
         raise
     except Exception as e:
         db.rollback()
-        raise HTTPException(status_code=500, detail=f"Failed to generate treatment plan: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to use similar plan: {str(e)}")
+
+@router.get("/api/treatment-plan-cache/stats")
+def get_treatment_plan_cache_stats():
+    """
+    Hit rate and LLM latency saved by the treatment plan cache since startup,
+    plus how many requests joined an in-flight generation instead.
+    """
+    stats = get_plan_cache().stats()
+    stats["coalesced_streams"] = plan_stream_flights.stats()
+    stats["coalesced_jobs"] = plan_jobs.jobs_joined
+    return stats
+
+@router.get("/api/treatment-plan-pregeneration/stats")
+def get_treatment_plan_pregeneration_stats(db: Session = Depends(get_db)):
+    """
+    How often speculative drafts were used by a physician versus discarded.
+    """
+    try:
+        jobs = dict(db.query(TreatmentPlanJob.status, func.count(TreatmentPlanJob.id)).filter(
+            TreatmentPlanJob.speculative == True
+        ).group_by(TreatmentPlanJob.status).all())
+        drafts = dict(db.query(TreatmentPlan.pregeneration_outcome, func.count(TreatmentPlan.id)).filter(
+            TreatmentPlan.source == "speculative"
+        ).group_by(TreatmentPlan.pregeneration_outcome).all())
+        
+        used = drafts.get("used", 0)
+        discarded = drafts.get("discarded", 0)
+        return {
+            "enabled": PLAN_PREGENERATION_ENABLED,
+            "jobs": jobs,
+            "drafts_waiting": drafts.get("waiting", 0),
+            "drafts_used": used,
+            "drafts_discarded": discarded,
+            "use_rate": round(used / (used + discarded), 4) if used + discarded else None
+        }
+        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to get pre-generation stats: {str(e)}")
+
+@router.get("/api/llm/stats")
+def get_llm_stats():
+    """
+    Circuit breaker state, recent upstream latency percentiles and hedging counts.
+    """
+    return get_chatgpt_service().resilience_stats()
+
+@router.get("/api/llm/metrics")
+def get_llm_usage_metrics():
+    """
+    Per-operation request, error and retry counts, latency and time-to-first-token
+    histograms, token totals and estimated cost since startup, plus how often
+    refine prompts had to be cut down to their token budget.
+    """
+    return {**get_llm_metrics().snapshot(), "prompts": prompt_stats()}
 
 @router.get("/api/treatment-plan/{treatment_plan_id}")
 def get_treatment_plan(treatment_plan_id: int, db: Session = Depends(get_db)):
@@ -788,6 +1237,8 @@ def get_treatment_plan(treatment_plan_id: int, db: Session = Depends(get_db)):
             "physician_notes": treatment_plan.physician_notes,
             "status": treatment_plan.status,
             "created_by": treatment_plan.created_by,
+            "source": treatment_plan.source or "physician",
+            "llm_usage": usage_summary(treatment_plan),
             "created_at": treatment_plan.created_at.strftime("%Y-%m-%d %H:%M") if treatment_plan.created_at else None,
             "updated_at": treatment_plan.updated_at.strftime("%Y-%m-%d %H:%M") if treatment_plan.updated_at else None
         }
@@ -820,8 +1271,19 @@ def update_treatment_plan(
         
         treatment_plan.updated_at = datetime.now()
         
+        # Keep the similar-plan index in step with approvals
+        index = get_plan_similarity_index()
+        approved_vector = None
+        if index.loaded and treatment_plan.status in APPROVED_PLAN_STATUSES:
+            approved_vector = index.vector(db, treatment_plan.patient, treatment_plan.scan, treatment_plan.icd_code)
+        
         db.commit()
         
+        if approved_vector is not None:
+            index.upsert(treatment_plan_id, approved_vector)
+        else:
+            index.remove(treatment_plan_id)
+        
         return {
             "message": "Treatment plan updated successfully",
             "treatment_plan_id": treatment_plan.id,
@@ -852,22 +1314,31 @@ async def refine_treatment_plan(
         if not physician_notes:
             raise HTTPException(status_code=400, detail="Physician notes are required for refinement")
         
-        # Refine the treatment plan using ChatGPT
-        refined_plan = get_chatgpt_service().refine_treatment_plan(
-            treatment_plan.ai_generated_plan, physician_notes
-        )
+        existing_plan = treatment_plan.ai_generated_plan
+        db.commit()  # release the DB connection while waiting on the LLM
+        
+        # Refine the treatment plan using ChatGPT; on failure the stored plan is left untouched
+        usage = new_usage(REFINE_SETTINGS["model"])
+        try:
+            refined_plan = await get_chatgpt_service().refine_treatment_plan(
+                existing_plan, physician_notes, usage=usage
+            )
+        except (OpenAIAPIError, httpx.HTTPError) as e:
+            raise _llm_http_error(e, "Failed to refine treatment plan")
         
         # Update the treatment plan
         treatment_plan.ai_generated_plan = refined_plan
         treatment_plan.physician_notes = physician_notes
         treatment_plan.updated_at = datetime.now()
+        add_refinement_usage(treatment_plan, usage)
         
         db.commit()
         
         return {
             "message": "Treatment plan refined successfully",
-            "treatment_plan_id": treatment_plan.id,
-            "refined_plan": refined_plan
+            "treatment_plan_id": treatment_plan_id,
+            "refined_plan": refined_plan,
+            "llm_usage": usage
         }
         
     except HTTPException:
@@ -876,6 +1347,70 @@ async def refine_treatment_plan(
         db.rollback()
         raise HTTPException(status_code=500, detail=f"Failed to refine treatment plan: {str(e)}")
 
+@router.post("/api/treatment-plan/{treatment_plan_id}/refine/stream")
+async def stream_refined_treatment_plan(
+    treatment_plan_id: int,
+    request: dict,
+    db: Session = Depends(get_db)
+):
+    """
+    Refine a treatment plan and stream the new text as Server-Sent Events.
+
+    Emits one unnamed event per token ({"token": ...}), then "done" or "error".
+    The refined plan replaces the stored one once the completion has finished.
+    """
+    try:
+        treatment_plan = db.query(TreatmentPlan).filter(TreatmentPlan.id == treatment_plan_id).first()
+        if not treatment_plan:
+            raise HTTPException(status_code=404, detail="Treatment plan not found")
+        
+        physician_notes = request.get("physician_notes", "")
+        if not physician_notes:
+            raise HTTPException(status_code=400, detail="Physician notes are required for refinement")
+        
+        existing_plan = treatment_plan.ai_generated_plan
+        db.commit()  # release the DB connection for the duration of the stream
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to refine treatment plan: {str(e)}")
+    
+    async def events():
+        parts = []
+        usage = new_usage(REFINE_SETTINGS["model"])
+        try:
+            async for token in get_chatgpt_service().stream_refined_plan(existing_plan, physician_notes, usage=usage):
+                parts.append(token)
+                yield _sse_event({"token": token})
+        except (OpenAIAPIError, httpx.HTTPError) as e:
+            yield _sse_event({"detail": f"Failed to refine treatment plan: {str(e) or type(e).__name__}"}, "error")
+            return
+        
+        refined_plan = "".join(parts).strip()
+        if not refined_plan:
+            yield _sse_event({"detail": "Failed to refine treatment plan: the AI model returned no text"}, "error")
+            return
+        
+        session = SessionLocal()
+        try:
+            plan = session.query(TreatmentPlan).filter(TreatmentPlan.id == treatment_plan_id).first()
+            if not plan:
+                yield _sse_event({"detail": "Treatment plan not found"}, "error")
+                return
+            plan.ai_generated_plan = refined_plan
+            plan.physician_notes = physician_notes
+            plan.updated_at = datetime.now()
+            add_refinement_usage(plan, usage)
+            session.commit()
+            yield _sse_event({"treatment_plan_id": treatment_plan_id}, "done")
+        except Exception as e:
+            session.rollback()
+            yield _sse_event({"detail": f"Failed to save refined treatment plan: {str(e)}"}, "error")
+        finally:
+            session.close()
+    
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
 @router.get("/api/patients/{patient_code}/treatment-plans")
 def get_patient_treatment_plans(patient_code: str, db: Session = Depends(get_db)):
     """
@@ -895,6 +1430,7 @@ def get_patient_treatment_plans(patient_code: str, db: Session = Depends(get_db)
                 "plan_type": tp.plan_type,
                 "status": tp.status,
                 "created_by": tp.created_by,
+                "source": tp.source or "physician",
                 "created_at": tp.created_at.strftime("%Y-%m-%d %H:%M") if tp.created_at else None,
                 "updated_at": tp.updated_at.strftime("%Y-%m-%d %H:%M") if tp.updated_at else None
             }
@@ -926,9 +1462,9 @@ async def generate_treatment_recommendation(request: dict):
                 detail=f"Missing required fields: {', '.join(missing_fields)}"
             )
         
-        # Get OpenAI API key from environment
-        openai_api_key = os.getenv("OPENAI_API_KEY")
-        if not openai_api_key or openai_api_key == "your_openai_api_key_here":
+        # Shared client; api_key is None when OPENAI_API_KEY is not configured
+        chatgpt_service = get_chatgpt_service()
+        if not chatgpt_service.api_key:
             raise HTTPException(
                 status_code=500, 
                 detail="OpenAI API key not configured. Please set OPENAI_API_KEY environment variable."
@@ -957,72 +1493,46 @@ Please provide a comprehensive treatment recommendation including:
 Format your response as a structured treatment plan with clear sections.
 """
         
-        # Prepare the request to OpenAI API
-        openai_url = "https://api.openai.com/v1/chat/completions"
-        headers = {
-            "Authorization": f"Bearer {openai_api_key}",
-            "Content-Type": "application/json"
-        }
-        
-        payload = {
-            "model": "gpt-4o-mini",
-            "messages": [
-                {
-                    "role": "system",
-                    "content": "You are a medical assistant suggesting evidence-based stroke care plans following current stroke management guidelines. Provide a structured treatment recommendation and include tPA or alternative care guidance."
-                },
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
-            "max_tokens": 1500,
-            "temperature": 0.3
-        }
-        
-        # Make request to OpenAI API
-        response = requests.post(openai_url, headers=headers, json=payload, timeout=30)
-        
-        if response.status_code != 200:
-            error_detail = "OpenAI API request failed"
-            try:
-                error_data = response.json()
-                error_detail = error_data.get("error", {}).get("message", error_detail)
-            except:
-                pass
-            
-            raise HTTPException(
-                status_code=502,
-                detail=f"OpenAI API error: {error_detail}"
+        # Make request to OpenAI API over the shared connection pool
+        usage = new_usage("gpt-4o-mini")
+        try:
+            treatment_plan = await chatgpt_service.chat_completion(
+                model="gpt-4o-mini",
+                messages=[
+                    {
+                        "role": "system",
+                        "content": "You are a medical assistant suggesting evidence-based stroke care plans following current stroke management guidelines. Provide a structured treatment recommendation and include tPA or alternative care guidance."
+                    },
+                    {
+                        "role": "user",
+                        "content": prompt
+                    }
+                ],
+                max_tokens=1500,
+                temperature=0.3,
+                operation="generate_treatment",
+                usage=usage
             )
-        
-        # Parse OpenAI response
-        openai_response = response.json()
-        
-        if "choices" not in openai_response or not openai_response["choices"]:
-            raise HTTPException(
-                status_code=502,
-                detail="Invalid response from OpenAI API"
-            )
-        
-        treatment_plan = openai_response["choices"][0]["message"]["content"]
+        except OpenAIAPIError as e:
+            raise _llm_http_error(e, "OpenAI API error")
         
         # Return the treatment plan
         return {
             "treatment_plan": treatment_plan,
             "model_used": "gpt-4o-mini",
             "patient_name": request["name"],
-            "generated_at": datetime.now().isoformat()
+            "generated_at": datetime.now().isoformat(),
+            "usage": usage
         }
         
     except HTTPException:
         raise
-    except requests.exceptions.Timeout:
+    except httpx.TimeoutException:
         raise HTTPException(
             status_code=504,
             detail="Request to OpenAI API timed out"
         )
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         raise HTTPException(
             status_code=502,
             detail=f"Network error communicating with OpenAI API: {str(e)}"